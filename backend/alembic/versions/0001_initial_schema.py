@@ -0,0 +1,94 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2025-03-25 00:00:00.000000
+
+Databases created earlier with Base.metadata.create_all already have this
+schema and should be stamped with `alembic stamp 0001` before upgrading.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'books',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('title', sa.String(255), nullable=False),
+        sa.Column('author', sa.String(255), nullable=False),
+        sa.Column('isbn', sa.String(20), nullable=True, unique=True),
+        sa.Column('genre', sa.String(100), nullable=False),
+        sa.Column('publication_year', sa.Integer(), nullable=False),
+        sa.Column('publisher', sa.String(255), nullable=True),
+        sa.Column('description', sa.Text(), nullable=False),
+        sa.Column('copies', sa.Integer(), nullable=False),
+        sa.Column('copies_available', sa.Integer(), nullable=False),
+        sa.Column('cover_image', sa.String(255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_books_title', 'books', ['title'])
+    op.create_index('ix_books_author', 'books', ['author'])
+    op.create_index('ix_books_genre', 'books', ['genre'])
+
+    op.create_table(
+        'users',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('email', sa.String(255), nullable=False),
+        sa.Column('first_name', sa.String(100), nullable=False),
+        sa.Column('last_name', sa.String(100), nullable=False),
+        sa.Column('hashed_password', sa.String(255), nullable=False),
+        sa.Column('role', sa.String(20), nullable=False),
+        sa.Column('student_id', sa.String(50), nullable=True),
+        sa.Column('department', sa.String(100), nullable=True),
+        sa.Column('avatar', sa.String(255), nullable=True),
+        sa.Column('join_date', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    op.create_index('ix_users_role', 'users', ['role'])
+
+    op.create_table(
+        'borrowed_books',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('book_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('books.id'), nullable=False),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('borrow_date', sa.DateTime(), nullable=False),
+        sa.Column('due_date', sa.DateTime(), nullable=False),
+        sa.Column('return_date', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+
+    op.create_table(
+        'book_embeddings',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('book_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('books.id'), nullable=False, unique=True),
+        sa.Column('embedding', postgresql.ARRAY(sa.Float()), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('book_embeddings')
+    op.drop_table('borrowed_books')
+    op.drop_index('ix_users_role', table_name='users')
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_table('users')
+    op.drop_index('ix_books_genre', table_name='books')
+    op.drop_index('ix_books_author', table_name='books')
+    op.drop_index('ix_books_title', table_name='books')
+    op.drop_table('books')
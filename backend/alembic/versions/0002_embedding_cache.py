@@ -0,0 +1,42 @@
+"""Embedding cache and embedding provenance
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('book_embeddings', sa.Column('model', sa.String(100), nullable=True))
+    op.add_column('book_embeddings', sa.Column('text_hash', sa.String(64), nullable=True))
+
+    # Existing vectors were all produced by the original embedding model. Their
+    # text hash is unknown, so the next backfill re-embeds them once.
+    op.execute("UPDATE book_embeddings SET model = 'text-embedding-3-small' WHERE model IS NULL")
+
+    op.create_table(
+        'embedding_cache',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('text_hash', sa.String(64), nullable=False),
+        sa.Column('embedding', postgresql.ARRAY(sa.Float()), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.UniqueConstraint('model', 'text_hash', name='uq_embedding_cache_model_text_hash'),
+    )
+
+
+def downgrade():
+    op.drop_table('embedding_cache')
+    op.drop_column('book_embeddings', 'text_hash')
+    op.drop_column('book_embeddings', 'model')
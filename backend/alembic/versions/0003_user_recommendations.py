@@ -0,0 +1,33 @@
+"""Precomputed user recommendations
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user_recommendations',
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('recommendations', sa.JSON(), nullable=False),
+        sa.Column('num_recommendations', sa.Integer(), nullable=False),
+        sa.Column('history_count', sa.Integer(), nullable=False),
+        sa.Column('history_updated_at', sa.DateTime(), nullable=True),
+        sa.Column('generated_at', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('user_recommendations')
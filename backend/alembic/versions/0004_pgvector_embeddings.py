@@ -0,0 +1,75 @@
+"""Optional pgvector column for server-side similarity search
+
+Adds book_embeddings.embedding_vector, a copy of the embedding in the
+pgvector type with an HNSW or IVFFlat index, and converts the existing rows.
+The ARRAY column stays the source of truth. On databases without the
+pgvector extension the migration does nothing and similarity search keeps
+using the resident index.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+import logging
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from app.core.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+
+def _pgvector_available():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return False
+    if context.is_offline_mode():
+        return True
+    return bind.execute(
+        sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'vector'")
+    ).scalar() is not None
+
+
+def upgrade():
+    if not _pgvector_available():
+        logger.info("pgvector is not available, skipping the embedding_vector column")
+        return
+
+    dimensions = settings.EMBEDDING_DIMENSIONS
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    op.execute(f"ALTER TABLE book_embeddings ADD COLUMN embedding_vector vector({dimensions})")
+
+    # Vectors of another width belong to a different model and are re-embedded by the backfill
+    op.execute(
+        f"UPDATE book_embeddings SET embedding_vector = embedding::vector({dimensions}) "
+        f"WHERE array_length(embedding, 1) = {dimensions}"
+    )
+
+    if settings.PGVECTOR_INDEX_TYPE == "ivfflat":
+        op.execute(
+            "CREATE INDEX ix_book_embeddings_embedding_vector ON book_embeddings "
+            f"USING ivfflat (embedding_vector vector_cosine_ops) WITH (lists = {settings.IVF_NLIST or 100})"
+        )
+    else:
+        op.execute(
+            "CREATE INDEX ix_book_embeddings_embedding_vector ON book_embeddings "
+            "USING hnsw (embedding_vector vector_cosine_ops)"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("DROP INDEX IF EXISTS ix_book_embeddings_embedding_vector")
+    op.execute("ALTER TABLE book_embeddings DROP COLUMN IF EXISTS embedding_vector")
@@ -0,0 +1,70 @@
+"""Store embeddings as packed float32/float16 bytes
+
+Replaces the double precision ARRAY embedding columns of book_embeddings and
+embedding_cache with bytea holding packed floats, plus an embedding_dtype
+column naming the NumPy dtype needed to decode them. Existing rows are
+converted inside PostgreSQL with float4send, which writes big-endian
+float32, so they are tagged '>f4'. New rows are written little-endian.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import context, op
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+TABLES = ('book_embeddings', 'embedding_cache')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('embedding_packed', sa.LargeBinary(), nullable=True))
+        op.add_column(table, sa.Column('embedding_dtype', sa.String(8), nullable=True))
+
+        op.execute(f"""
+            UPDATE {table} SET embedding_dtype = '>f4', embedding_packed = COALESCE((
+                SELECT string_agg(float4send(element.value::real), ''::bytea ORDER BY element.position)
+                FROM unnest(embedding) WITH ORDINALITY AS element(value, position)
+            ), ''::bytea)
+        """)
+
+        op.drop_column(table, 'embedding')
+        op.alter_column(table, 'embedding_packed', new_column_name='embedding', nullable=False)
+        op.alter_column(table, 'embedding_dtype', nullable=False)
+
+
+def downgrade():
+    if context.is_offline_mode():
+        raise RuntimeError("Downgrading 0005 decodes embeddings in Python and cannot be run in --sql mode")
+
+    bind = op.get_bind()
+
+    for table in TABLES:
+        op.add_column(table, sa.Column('embedding_array', postgresql.ARRAY(sa.Float()), nullable=True))
+
+        rows = bind.execute(sa.text(f"SELECT id, embedding, embedding_dtype FROM {table}")).all()
+        if rows:
+            bind.execute(
+                sa.text(f"UPDATE {table} SET embedding_array = :embedding WHERE id = :id").bindparams(
+                    sa.bindparam('embedding', type_=postgresql.ARRAY(sa.Float())),
+                    sa.bindparam('id', type_=postgresql.UUID(as_uuid=True)),
+                ),
+                [
+                    {'id': row_id, 'embedding': np.frombuffer(packed, dtype=dtype).astype(float).tolist()}
+                    for row_id, packed, dtype in rows
+                ]
+            )
+
+        op.drop_column(table, 'embedding_dtype')
+        op.drop_column(table, 'embedding')
+        op.alter_column(table, 'embedding_array', new_column_name='embedding', nullable=False)
@@ -0,0 +1,40 @@
+"""Composite indexes for borrowed_books query shapes
+
+Adds (user_id, borrow_date DESC) for reading histories, (book_id, status)
+for a book's active loans and (status, due_date) for overdue sweeps.
+On PostgreSQL the indexes are built concurrently so circulation is not
+blocked while a large table is indexed.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_borrowed_books_user_id_borrow_date': ['user_id', sa.text('borrow_date DESC')],
+    'ix_borrowed_books_book_id_status': ['book_id', 'status'],
+    'ix_borrowed_books_status_due_date': ['status', 'due_date'],
+}
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(name, 'borrowed_books', columns, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.drop_index(name, table_name='borrowed_books', postgresql_concurrently=True)
@@ -0,0 +1,41 @@
+"""User preference profiles
+
+Stores each reader's recency-weighted centroid and taste cluster centroids,
+rebuilt by the precompute job and used as similarity search queries; borrows
+newer than borrowed_through are folded in when a profile is read.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user_preference_profiles',
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('centroid', sa.LargeBinary(), nullable=False),
+        sa.Column('clusters', sa.LargeBinary(), nullable=False),
+        sa.Column('cluster_weights', sa.JSON(), nullable=False),
+        sa.Column('weight', sa.Float(), nullable=False),
+        sa.Column('reference_date', sa.DateTime(), nullable=False),
+        sa.Column('book_count', sa.Integer(), nullable=False),
+        sa.Column('borrowed_through', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('user_preference_profiles')
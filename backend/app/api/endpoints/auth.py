@@ -7,27 +7,33 @@ from typing import Any
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
+from app.core.passwords import password_hasher
 from app.core.security import (
     create_access_token,
-    verify_password,
+    get_password_hash_async,
+    verify_password_async,
     get_current_active_user,
 )
-from backend.app.db.database import get_async_database
+from app.db.database import get_async_db
+from app.db.models import User as UserRecord
 from app.models.user import Token, User
 
 router = APIRouter()
 
 @router.post("/login", response_model=Token)
-async def login_access_token(form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
+async def login_access_token(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db)
+) -> Any:
     """
     OAuth2 compatible token login, get an access token for future requests.
     """
-    db = await get_async_database()
-    
     # Find user by email
-    user = await db.users.find_one({"email": form_data.username})
+    user = await db.scalar(select(UserRecord).where(UserRecord.email == form_data.username))
     
     if not user:
         raise HTTPException(
@@ -36,19 +42,24 @@ async def login_access_token(form_data: OAuth2PasswordRequestForm = Depends()) -
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Verify password
-    if not verify_password(form_data.password, user["hashed_password"]):
+    # Verify password on the hashing pool, so other requests are served meanwhile
+    if not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Upgrade the stored hash when BCRYPT_ROUNDS has changed
+    if password_hasher.needs_rehash(user.hashed_password):
+        user.hashed_password = await get_password_hash_async(form_data.password)
+        await db.commit()
+    
     # Create access token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        subject=str(user["id"]),
-        role=user["role"],
+        subject=str(user.id),
+        role=user.role,
         expires_delta=access_token_expires,
     )
     
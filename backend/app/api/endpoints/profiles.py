@@ -0,0 +1,54 @@
+"""
+API endpoints for stored request profiles
+"""
+
+from typing import List, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi.responses import PlainTextResponse
+from starlette.status import HTTP_404_NOT_FOUND
+
+from app.core.profiling import folded, profile_store
+from app.core.security import get_current_librarian_principal
+from app.models.user import Principal
+
+router = APIRouter()
+
+@router.get(
+    "",
+    response_model=List[Dict[str, Any]],
+    summary="List request profiles",
+    description="Summaries of the stored request profiles, newest first"
+)
+async def list_profiles(
+    current_user: Principal = Depends(get_current_librarian_principal)  # Only librarians can access this endpoint
+):
+    """List request profiles"""
+    return profile_store.list()
+
+@router.get(
+    "/{profile_id}",
+    summary="Download a request profile",
+    description="A stored profile as JSON, or one of its stacks in the folded format read by flamegraph.pl and speedscope"
+)
+async def get_profile(
+    profile_id: str = Path(..., description="The ID of the profile"),
+    format: str = Query("json", description="'json' or 'folded'", pattern="^(json|folded)$"),
+    stacks: str = Query("task", description="With the folded format: the request's 'task' stacks or the event 'loop' stacks", pattern="^(task|loop)$"),
+    current_user: Principal = Depends(get_current_librarian_principal)  # Only librarians can access this endpoint
+):
+    """Download a request profile"""
+    profile = profile_store.get(profile_id)
+    
+    if not profile:
+        raise HTTPException(
+            status_code=HTTP_404_NOT_FOUND,
+            detail=f"Profile with ID {profile_id} not found"
+        )
+    
+    if format == "folded":
+        return PlainTextResponse(
+            folded(profile[f"{stacks}_stacks"]),
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.{stacks}.folded"'}
+        )
+    
+    return profile
@@ -2,14 +2,25 @@
 API endpoints for book recommendations
 """
 
+import json
+import uuid
 from typing import List, Dict, Any
 from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.status import HTTP_404_NOT_FOUND
 
-from app.models.book import Recommendation, BookWithRecommendationReason
-from app.models.user import User
+from app.db.models import Book, User as UserRecord
+from app.db.vector_store import VectorStore
+from app.models.book import Recommendation, BookWithRecommendationReason, BulkRecommendationRequest
+from app.models.user import Principal
+from app.services.embedding_service import EmbeddingService
 from app.services.recommendation_service import RecommendationService
-from app.core.security import get_current_active_user, get_current_librarian
+from app.services.recommendation_cache import recommendation_cache
+from app.core.security import get_current_principal, get_current_librarian_principal
+from app.db.database import get_async_db
 
 router = APIRouter()
 
@@ -21,8 +32,9 @@ router = APIRouter()
 )
 async def get_reading_history(
     user_id: str = Path(..., description="The ID of the user"),
-    current_user: User = Depends(get_current_active_user),
-    recommendation_service: RecommendationService = Depends()
+    current_user: Principal = Depends(get_current_principal),
+    recommendation_service: RecommendationService = Depends(),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get a user's reading history"""
     # Check permissions - users can only see their own history, librarians can see any history
@@ -32,7 +44,7 @@ async def get_reading_history(
             detail="You do not have permission to view this user's reading history"
         )
     
-    reading_history = await recommendation_service.get_reading_history(user_id)
+    reading_history = await recommendation_service.get_reading_history(db, user_id)
     
     if not reading_history:
         return []
@@ -43,23 +55,133 @@ async def get_reading_history(
     "/users/{user_id}/recommendations",
     response_model=Recommendation,
     summary="Get book recommendations for a user",
-    description="Generate personalized book recommendations for a specific user"
+    description="Serve a user's precomputed book recommendations, or generate them live if missing or on request"
 )
 async def get_recommendations(
     user_id: str = Path(..., description="The ID of the user"),
     num_recommendations: int = Query(3, description="Number of recommendations to generate", ge=1, le=10),
-    current_user: User = Depends(get_current_librarian),  # Only librarians can access this endpoint
-    recommendation_service: RecommendationService = Depends()
+    refresh: bool = Query(False, description="Ignore precomputed recommendations and generate them live"),
+    current_user: Principal = Depends(get_current_librarian_principal),  # Only librarians can access this endpoint
+    recommendation_service: RecommendationService = Depends(),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get book recommendations for a user"""
-    # Get recommendations
+    # Serve the precomputed recommendations unless a live refresh is requested
+    if not refresh:
+        precomputed = await recommendation_service.get_precomputed_recommendations(db, user_id, num_recommendations)
+        if precomputed:
+            return precomputed
+    
+    # Generate recommendations and store them for subsequent requests
     recommendations = await recommendation_service.generate_recommendations(
+        db,
         user_id, 
         num_recommendations=num_recommendations
     )
+    if recommendations["recommendations"]:
+        await recommendation_service.save_recommendations(db, user_id, recommendations, num_recommendations)
     
     return recommendations
 
+@router.get(
+    "/users/{user_id}/recommendations/stream",
+    summary="Stream book recommendations for a user",
+    description=(
+        "Server-Sent Events variant of the recommendations endpoint. Emits a 'candidates' event with the "
+        "similarity-search results, a 'recommendation' event per refined book as it is written, "
+        "and a final 'done' event with the complete recommendations, flagged with 'error' if the response was cut short"
+    )
+)
+async def stream_recommendations(
+    user_id: str = Path(..., description="The ID of the user"),
+    num_recommendations: int = Query(3, description="Number of recommendations to generate", ge=1, le=10),
+    refresh: bool = Query(False, description="Ignore precomputed recommendations and generate them live"),
+    current_user: Principal = Depends(get_current_principal),
+    recommendation_service: RecommendationService = Depends(),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Stream book recommendations for a user"""
+    # Check permissions - students can only see their own recommendations, librarians can see anyone's
+    if current_user.id != user_id and current_user.role != "librarian":
+        raise HTTPException(
+            status_code=403,
+            detail="You do not have permission to view this user's recommendations"
+        )
+    
+    def event(name: str, data: Dict[str, Any]) -> str:
+        return f"event: {name}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+    
+    async def stream():
+        # Serve the precomputed recommendations unless a live refresh is requested
+        if not refresh:
+            precomputed = await recommendation_service.get_precomputed_recommendations(db, user_id, num_recommendations)
+            if precomputed:
+                yield event("done", precomputed)
+                return
+        
+        async for name, data in recommendation_service.stream_recommendations(db, user_id, num_recommendations):
+            # A response cut off part way is shown but not kept as the user's recommendations
+            if name == "done" and data["recommendations"] and not data.get("error"):
+                await recommendation_service.save_recommendations(db, user_id, data, num_recommendations)
+            yield event(name, data)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post(
+    "/bulk",
+    summary="Get book recommendations for a group of students",
+    description=(
+        "Generate recommendations for a list of students or a whole department. "
+        "Results are streamed as newline-delimited JSON, one line per student as soon as it is ready"
+    )
+)
+async def get_bulk_recommendations(
+    request: BulkRecommendationRequest,
+    current_user: Principal = Depends(get_current_librarian_principal),  # Only librarians can access this endpoint
+    recommendation_service: RecommendationService = Depends(),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Stream book recommendations for a group of students"""
+    if request.department is not None:
+        user_ids = [
+            str(user_id) for user_id in (await db.scalars(
+                select(UserRecord.id)
+                .where(UserRecord.role == "student", UserRecord.department == request.department)
+            )).all()
+        ]
+    else:
+        user_ids = list(dict.fromkeys(request.user_ids))
+    
+    async def stream():
+        async for user_id, recommendations in recommendation_service.generate_recommendations_bulk(
+            db, user_ids, num_recommendations=request.num_recommendations
+        ):
+            # Store the results so later single-student requests are served from the table
+            if recommendations["recommendations"]:
+                await recommendation_service.save_recommendations(
+                    db, user_id, recommendations, request.num_recommendations
+                )
+            yield json.dumps(jsonable_encoder({"user_id": user_id, **recommendations})) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get(
+    "/cache/stats",
+    response_model=Dict[str, Any],
+    summary="Get recommendation cache statistics",
+    description="Hit/miss counters for the GPT recommendation cache and the LLM latency and tokens it saved"
+)
+async def get_recommendation_cache_stats(
+    current_user: Principal = Depends(get_current_librarian_principal)  # Only librarians can access this endpoint
+):
+    """Get recommendation cache statistics"""
+    return await recommendation_cache.stats()
+
 @router.get(
     "/books/{book_id}/similar",
     response_model=List[BookWithRecommendationReason],
@@ -69,16 +191,16 @@ async def get_recommendations(
 async def get_similar_books(
     book_id: str = Path(..., description="The ID of the book"),
     limit: int = Query(5, description="Number of similar books to return", ge=1, le=20),
-    current_user: User = Depends(get_current_active_user),
-    recommendation_service: RecommendationService = Depends()
+    current_user: Principal = Depends(get_current_principal),
+    recommendation_service: RecommendationService = Depends(),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get books similar to a specific book"""
-    from backend.app.db.database import get_async_database
-    from app.db.vector_store import VectorStore
-    
     # Get the book
-    db = await get_async_database()
-    book = await db.books.find_one({"id": book_id})
+    try:
+        book = await db.get(Book, uuid.UUID(book_id))
+    except ValueError:
+        book = None
     
     if not book:
         raise HTTPException(
@@ -88,16 +210,19 @@ async def get_similar_books(
     
     # Get the book's embedding
     vector_store = VectorStore()
-    embedding = await vector_store.get_book_embedding(book_id)
+    embedding = await vector_store.get_book_embedding(db, book_id)
     
-    if not embedding:
+    if embedding is None:
         # Generate embedding if not found
         embedding_service = recommendation_service.embedding_service
-        embedding = await embedding_service.create_embedding_for_book(book)
+        book_data = book.to_dict()
+        embedding = await embedding_service.create_embedding_for_book(book_data, db=db)
         
-        if embedding:
+        if embedding is not None:
             # Save for future use
-            await vector_store.save_embedding(book_id, embedding)
+            await vector_store.save_embedding(
+                db, book_id, embedding, text_hash=EmbeddingService.book_text_hash(book_data)
+            )
         else:
             raise HTTPException(
                 status_code=500,
@@ -106,6 +231,7 @@ async def get_similar_books(
     
     # Find similar books
     similar_books = await vector_store.find_similar_books(
+        db,
         embedding,
         n=limit,
         exclude_book_ids=[book_id]  # Exclude the source book
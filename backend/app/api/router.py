@@ -4,13 +4,12 @@ Main API router
 
 from fastapi import APIRouter
 
-from app.api.endpoints import auth, books, users, recommendations
+from app.api.endpoints import auth, profiles, recommendations
 
 # Create main API router
 api_router = APIRouter()
 
 # Include routes from endpoint modules
 api_router.include_router(auth.router, prefix="/auth", tags=["authentication"])
-api_router.include_router(books.router, prefix="/books", tags=["books"])
-api_router.include_router(users.router, prefix="/users", tags=["users"])
-api_router.include_router(recommendations.router, prefix="/recommendations", tags=["recommendations"])
\ No newline at end of file
+api_router.include_router(recommendations.router, prefix="/recommendations", tags=["recommendations"])
+api_router.include_router(profiles.router, prefix="/profiles", tags=["profiling"])
\ No newline at end of file
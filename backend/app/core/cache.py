@@ -0,0 +1,325 @@
+"""
+Caching utilities with in-process, on-disk and Redis backends
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from app.core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded LRU cache with optional per-entry expiry.
+
+    Keeps hit and miss counters so callers can report how effective the
+    cache is.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        """
+        Args:
+            maxsize: Maximum number of entries; the least recently used entry is evicted beyond it
+            ttl: Seconds an entry stays valid, or None for no expiry
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a cached value, refreshing its recency.
+
+        Args:
+            key: Cache key
+            default: Value returned on a miss
+
+        Returns:
+            The cached value, or default if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entries if full.
+
+        Args:
+            key: Cache key
+            value: Value to cache
+        """
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """Remove an entry if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Current size and hit/miss counters."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class MemoryCache:
+    """
+    An in-process LRUCache behind the async interface shared with the
+    on-disk and Redis backends, so callers need not know which one they use.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        """
+        Args:
+            maxsize: Maximum number of entries; the least recently used entry is evicted beyond it
+            ttl: Seconds an entry stays valid, or None for no expiry
+        """
+        self.cache = LRUCache(maxsize, ttl)
+
+    async def get(self, key: Hashable, default: Any = None) -> Any:
+        return self.cache.get(key, default)
+
+    async def set(self, key: Hashable, value: Any) -> None:
+        self.cache.set(key, value)
+
+    async def delete(self, key: Hashable) -> None:
+        self.cache.delete(key)
+
+    async def clear(self) -> None:
+        self.cache.clear()
+
+    async def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+class SQLiteCache:
+    """
+    A size-bounded, expiring cache persisted to a local SQLite file.
+
+    Survives restarts and can be shared by workers on the same host.
+    Values must be JSON serializable. SQLite calls block, so the async
+    methods run them on a worker thread.
+    """
+
+    def __init__(self, path: str, maxsize: int, ttl: Optional[float] = None):
+        """
+        Args:
+            path: SQLite database file
+            maxsize: Maximum number of entries; least recently used entries are evicted beyond it
+            ttl: Seconds an entry stays valid, or None for no expiry
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        return await asyncio.to_thread(self._get, key, default)
+
+    async def set(self, key: str, value: Any) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    async def clear(self) -> None:
+        await asyncio.to_thread(self._clear)
+
+    async def stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._stats)
+
+    def _get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def _set(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now)
+            )
+            # Drop expired entries, then the least recently used ones beyond maxsize
+            self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,)
+            )
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self.hits = 0
+            self.misses = 0
+
+    def _stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class RedisCache:
+    """
+    An expiring cache stored in Redis, shared by every worker and host.
+
+    Works with any asyncio client exposing Redis' get/set/delete/scan_iter
+    methods. Size is bounded by the server's maxmemory eviction policy rather
+    than by this class. Values must be JSON serializable.
+    """
+
+    def __init__(self, client: Any, prefix: str, ttl: Optional[float] = None):
+        """
+        Args:
+            client: A redis.asyncio.Redis instance or compatible stand-in
+            prefix: Namespace prepended to every key
+            ttl: Seconds an entry stays valid, or None for no expiry
+        """
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        value = await self.client.get(f"{self.prefix}:{key}")
+        if value is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return json.loads(value)
+
+    async def set(self, key: str, value: Any) -> None:
+        ttl = int(self.ttl) if self.ttl is not None else None
+        await self.client.set(f"{self.prefix}:{key}", json.dumps(value), ex=ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(f"{self.prefix}:{key}")
+
+    async def clear(self) -> None:
+        async for key in self.client.scan_iter(f"{self.prefix}:*"):
+            await self.client.delete(key)
+        self.hits = 0
+        self.misses = 0
+
+    async def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+def create_cache(backend: str, name: str, maxsize: int, ttl: Optional[float] = None):
+    """
+    Create a cache for the given backend, with async get/set/delete/clear/stats.
+
+    Args:
+        backend: 'memory', 'disk' or 'redis'
+        name: Cache name, used for the disk file and the Redis key prefix
+        maxsize: Maximum number of entries (memory and disk backends)
+        ttl: Seconds an entry stays valid, or None for no expiry
+
+    Returns:
+        A MemoryCache, SQLiteCache or RedisCache
+    """
+    backend = backend.lower()
+
+    if backend == "disk":
+        return SQLiteCache(os.path.join(settings.CACHE_DIR, f"{name}.sqlite3"), maxsize, ttl)
+
+    if backend == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("The redis cache backend requires the 'redis' package to be installed")
+        return RedisCache(redis.Redis.from_url(settings.REDIS_URL), prefix=name, ttl=ttl)
+
+    if backend != "memory":
+        logger.warning(f"Unknown cache backend '{backend}', using memory")
+    return MemoryCache(maxsize, ttl)
@@ -0,0 +1,254 @@
+"""
+Latency histograms for the hot paths, in the Prometheus text format
+"""
+
+import functools
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a cache hit to a slow GPT call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage durations of the current request, collected for the Server-Timing header
+_server_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("server_timings", default=None)
+
+class Histogram:
+    """
+    A Prometheus-style histogram with one label.
+
+    Observing a value is a bisect and a few additions under a lock, cheap
+    enough to leave on in production.
+    """
+
+    def __init__(self, name: str, documentation: str, label: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Args:
+            name: Metric name
+            documentation: Help text for the metric
+            label: Name of the label distinguishing series
+            buckets: Sorted bucket upper bounds in seconds
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        """Record one observation."""
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # Per-bucket counts (the last one past every bound), sum, count
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> Dict[str, Tuple[List[int], float, int]]:
+        """Cumulative bucket counts, sum and count of every series."""
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+        result = {}
+        for key, (counts, total, count) in series.items():
+            cumulative, running = [], 0
+            for bucket_count in counts:
+                running += bucket_count
+                cumulative.append(running)
+            result[key] = (cumulative, total, count)
+        return result
+
+    def render(self) -> str:
+        """The histogram in the Prometheus text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_value, (cumulative, total, count) in sorted(self.snapshot().items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), cumulative):
+                upper = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{upper}"}} {bucket_count}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        """Drop all observations."""
+        with self._lock:
+            self._series.clear()
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Time spent in each stage of the recommendation pipeline
+stage_latency = Histogram(
+    "bookbuddy_stage_duration_seconds",
+    "Time spent in each stage of the recommendation pipeline.",
+    "stage",
+)
+
+# Time to respond to each API route
+request_latency = Histogram(
+    "bookbuddy_request_duration_seconds",
+    "Time to respond to HTTP requests, by route.",
+    "route",
+)
+
+def record_stage(stage: str, seconds: float) -> None:
+    """
+    Record the duration of a pipeline stage.
+
+    Args:
+        stage: Stage name
+        seconds: How long the stage took
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    stage_latency.observe(stage, seconds)
+    timings = _server_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+class timed:
+    """
+    Time a pipeline stage, as a context manager or as a decorator.
+
+    Decorates plain functions, coroutine functions and async generators;
+    an async generator is timed from its first item until it finishes.
+    """
+
+    def __init__(self, stage: str):
+        """
+        Args:
+            stage: Stage name, used as the histogram label and Server-Timing metric name
+        """
+        self.stage = stage
+        # Start times of the uses in progress, per task or thread, innermost last
+        self._started: ContextVar[Tuple[float, ...]] = ContextVar(f"timed_{stage}", default=())
+
+    def __enter__(self) -> "timed":
+        self._started.set(self._started.get() + (time.perf_counter(),))
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        *outer, started = self._started.get()
+        self._started.set(tuple(outer))
+        record_stage(self.stage, time.perf_counter() - started)
+
+    def __call__(self, function: Callable) -> Callable:
+        stage = self.stage
+
+        if inspect.isasyncgenfunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    async for item in function(*args, **kwargs):
+                        yield item
+                finally:
+                    record_stage(stage, time.perf_counter() - started)
+        elif inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    record_stage(stage, time.perf_counter() - started)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    record_stage(stage, time.perf_counter() - started)
+
+        return wrapper
+
+def render_samples(
+    name: str,
+    documentation: str,
+    metric_type: str,
+    samples: Dict[Optional[str], float],
+    label: Optional[str] = None
+) -> str:
+    """
+    A gauge or counter in the Prometheus text exposition format.
+
+    Args:
+        name: Metric name
+        documentation: Help text for the metric
+        metric_type: 'gauge' or 'counter'
+        samples: Value per label value; key None for the unlabelled sample
+        label: Name of the label distinguishing samples
+
+    Returns:
+        The metric's lines, or an empty string when there are no samples
+    """
+    if not samples:
+        return ""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for label_value, value in samples.items():
+        labels = f'{{{label}="{_escape(label_value)}"}}' if label_value is not None else ""
+        lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+def render_metrics() -> str:
+    """All histograms in the Prometheus text exposition format."""
+    return stage_latency.render() + request_latency.render()
+
+def _server_timing_header(timings: Dict[str, float], total: float) -> bytes:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries).encode("latin-1")
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency by route.
+
+    With SERVER_TIMING_ENABLED, responses also carry a Server-Timing header
+    listing the pipeline stages that finished before the headers were sent,
+    so browser dev tools show where a slow request spent its time.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings: Optional[Dict[str, float]] = {} if settings.SERVER_TIMING_ENABLED else None
+        token = _server_timings.set(timings)
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            if timings is not None and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing_header(timings, time.perf_counter() - started)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _server_timings.reset(token)
+            # Label by route template, so IDs in paths do not create a series each
+            route = scope.get("route")
+            request_latency.observe(
+                f"{scope['method']} {route.path if route is not None else 'unmatched'}",
+                time.perf_counter() - started
+            )
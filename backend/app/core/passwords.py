@@ -0,0 +1,163 @@
+"""
+Password hashing on a bounded worker pool
+"""
+
+import asyncio
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import bcrypt
+
+from app.core.config import settings
+from app.core.metrics import render_samples
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# bcrypt only uses the first 72 bytes of a password
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+# Cost factor of a bcrypt hash, as in $2b$12$...
+BCRYPT_COST_PATTERN = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+class PasswordHasher:
+    """
+    bcrypt hashing and verification run off the event loop.
+
+    bcrypt releases the GIL while it works, so a thread pool runs as many
+    hashes in parallel as it has workers, and the event loop keeps serving
+    other requests meanwhile. Counters report how many hashes are waiting
+    for a worker, to size the pool.
+    """
+
+    def __init__(self, rounds: int, workers: int):
+        """
+        Args:
+            rounds: bcrypt cost factor for new hashes; each step doubles the work
+            workers: Number of hashes computed in parallel
+        """
+        self.rounds = rounds
+        self.workers = workers
+        self.queued = 0
+        self.running = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def _encode(password: str) -> bytes:
+        return password.encode("utf-8")[:BCRYPT_MAX_PASSWORD_BYTES]
+
+    def hash_sync(self, password: str) -> str:
+        """Hash a password on the calling thread."""
+        return bcrypt.hashpw(self._encode(password), bcrypt.gensalt(self.rounds)).decode("ascii")
+
+    def verify_sync(self, password: str, hashed_password: str) -> bool:
+        """Verify a password against a hash on the calling thread."""
+        try:
+            return bcrypt.checkpw(self._encode(password), hashed_password.encode("ascii"))
+        except ValueError:
+            logger.warning("Stored password hash is not a valid bcrypt hash")
+            return False
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """Whether a hash was made with a different cost factor than the configured one."""
+        match = BCRYPT_COST_PATTERN.match(hashed_password)
+        return match is None or int(match.group(1)) != self.rounds
+
+    async def hash(self, password: str) -> str:
+        """
+        Hash a password on the worker pool.
+
+        Args:
+            password: The plain text password
+
+        Returns:
+            The bcrypt hash
+        """
+        return await self._run(self.hash_sync, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """
+        Verify a password on the worker pool.
+
+        Args:
+            password: The plain text password
+            hashed_password: The stored bcrypt hash
+
+        Returns:
+            True if the password matches
+        """
+        return await self._run(self.verify_sync, password, hashed_password)
+
+    async def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+        waiting = True
+
+        def leave_queue():
+            # Called with the lock held, by whichever of the worker and the caller gets there first
+            nonlocal waiting
+            if waiting:
+                waiting = False
+                self.queued -= 1
+
+        def work():
+            with self._lock:
+                leave_queue()
+                self.running += 1
+            try:
+                return function(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        with self._lock:
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, work)
+        finally:
+            # A cancelled caller or a shut down pool means the work may never start
+            with self._lock:
+                leave_queue()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool size, hashes waiting for a worker, hashes in progress and hashes done."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "queued": self.queued,
+                "peak_queued": self.peak_queued,
+                "running": self.running,
+                "completed": self.completed,
+            }
+
+    def render(self) -> str:
+        """Pool size, queue depth and progress in the Prometheus text format."""
+        stats = self.stats()
+        return "".join([
+            render_samples("bookbuddy_password_hash_workers", "Threads hashing passwords.", "gauge", {None: stats["workers"]}),
+            render_samples("bookbuddy_password_hash_queued", "Hashes waiting for a worker.", "gauge", {None: stats["queued"]}),
+            render_samples("bookbuddy_password_hash_queued_peak", "Most hashes waiting for a worker at once.", "gauge", {None: stats["peak_queued"]}),
+            render_samples("bookbuddy_password_hash_running", "Hashes in progress.", "gauge", {None: stats["running"]}),
+            render_samples("bookbuddy_password_hash_completed_total", "Hashes and verifications done.", "counter", {None: stats["completed"]}),
+        ])
+
+    def shutdown(self) -> None:
+        """Stop the worker threads."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Process-wide hasher used by the API
+password_hasher = PasswordHasher(settings.BCRYPT_ROUNDS, settings.PASSWORD_HASH_WORKERS)
@@ -0,0 +1,275 @@
+"""
+Wall-clock sampling profiler for requests, with capture of slow requests
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Frames recorded per stack, innermost ones dropped beyond this
+MAX_STACK_DEPTH = 64
+
+# Profile IDs are generated hex strings; anything else is rejected before touching the filesystem
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+def _describe(frame: FrameType) -> str:
+    code = frame.f_code
+    path = Path(code.co_filename)
+    return f"{code.co_name} ({path.parent.name}/{path.name}:{frame.f_lineno})"
+
+def _thread_stack(frame: Optional[FrameType]) -> str:
+    """A thread's stack in folded form, outermost frame first."""
+    frames = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        frames.append(_describe(frame))
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+def _task_stack(task: asyncio.Task) -> str:
+    """The chain of coroutines a task is awaiting, in folded form, outermost first."""
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None and len(frames) < MAX_STACK_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(_describe(frame))
+        awaitable = (
+            getattr(awaitable, "cr_await", None)
+            or getattr(awaitable, "ag_await", None)
+            or getattr(awaitable, "gi_yieldfrom", None)
+        )
+    return ";".join(frames)
+
+class RequestProfile:
+    """
+    Stack samples collected for one request.
+
+    Each sample records two stacks: the coroutines the request is awaiting,
+    which shows what it is waiting for, and the event loop thread's stack,
+    which shows what the process was running at the time, whichever request
+    that belongs to.
+    """
+
+    def __init__(self, task: asyncio.Task, method: str, path: str, trigger: Optional[str]):
+        """
+        Args:
+            task: The task serving the request
+            method: HTTP method
+            path: Request path
+            trigger: Why the request is profiled ('header' or 'sample'), or None if only kept when slow
+        """
+        self.id = uuid.uuid4().hex
+        self.task = task
+        self.loop_thread_id = threading.get_ident()
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = datetime.utcnow()
+        self.samples = 0
+        self.task_stacks: Dict[str, int] = {}
+        self.loop_stacks: Dict[str, int] = {}
+
+    def sample(self, loop_stack: Optional[str]) -> None:
+        """Record the request's current stacks; called from the sampler thread."""
+        self.samples += 1
+        task_stack = _task_stack(self.task) or "<idle>"
+        self.task_stacks[task_stack] = self.task_stacks.get(task_stack, 0) + 1
+        if loop_stack:
+            self.loop_stacks[loop_stack] = self.loop_stacks.get(loop_stack, 0) + 1
+
+    def to_dict(self, duration: float, status: Optional[int]) -> Dict[str, Any]:
+        """The profile with request details, ready to store."""
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "trigger": self.trigger or "slow",
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": duration * 1000,
+            "interval_ms": settings.PROFILING_INTERVAL_SECONDS * 1000,
+            "samples": self.samples,
+            "task_stacks": self.task_stacks,
+            "loop_stacks": self.loop_stacks,
+        }
+
+class StackSampler:
+    """
+    One background thread sampling the stacks of every profiled request.
+
+    The thread sleeps while no request is being profiled, so the sampler
+    costs nothing when profiling is idle.
+    """
+
+    def __init__(self, interval: float):
+        """
+        Args:
+            interval: Seconds between samples
+        """
+        self.interval = interval
+        self._profiles: Dict[str, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, profile: RequestProfile) -> None:
+        """Start sampling a request."""
+        with self._lock:
+            self._profiles[profile.id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def unregister(self, profile: RequestProfile) -> None:
+        """Stop sampling a request; no sample is added to it afterwards."""
+        with self._lock:
+            self._profiles.pop(profile.id, None)
+
+    def _run(self) -> None:
+        while True:
+            if not self._profiles:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                loop_stacks: Dict[int, Optional[str]] = {}
+                for profile in self._profiles.values():
+                    if profile.loop_thread_id not in loop_stacks:
+                        loop_stacks[profile.loop_thread_id] = _thread_stack(frames.get(profile.loop_thread_id))
+                    profile.sample(loop_stacks[profile.loop_thread_id])
+
+class ProfileStore:
+    """Stored profiles as JSON files in a directory, keeping only the newest."""
+
+    def __init__(self, directory: str, max_profiles: int):
+        """
+        Args:
+            directory: Directory holding the profiles
+            max_profiles: Number of profiles kept; older ones are deleted
+        """
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+
+    def save(self, profile: Dict[str, Any]) -> None:
+        """Store a profile and delete the oldest beyond max_profiles."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary = self.directory / f"{profile['id']}.tmp"
+        temporary.write_text(json.dumps(profile))
+        temporary.replace(self.directory / f"{profile['id']}.json")
+
+        stored = sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        for path in stored[:-self.max_profiles]:
+            path.unlink(missing_ok=True)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Summaries of the stored profiles, newest first."""
+        if not self.directory.exists():
+            return []
+
+        summaries = []
+        for path in sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True):
+            try:
+                profile = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            summaries.append({key: value for key, value in profile.items() if key not in ("task_stacks", "loop_stacks")})
+        return summaries
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        """A stored profile, or None if there is no such profile."""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        try:
+            return json.loads((self.directory / f"{profile_id}.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+def folded(stacks: Dict[str, int]) -> str:
+    """Stacks in the folded format read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+
+# Process-wide sampler and profile storage
+stack_sampler = StackSampler(settings.PROFILING_INTERVAL_SECONDS)
+profile_store = ProfileStore(
+    settings.PROFILING_DIR or os.path.join(settings.CACHE_DIR, "profiles"),
+    settings.PROFILING_MAX_PROFILES
+)
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests with the stack sampler.
+
+    With PROFILING_ENABLED set, a request is profiled when it carries the
+    PROFILING_HEADER header or is picked at PROFILING_SAMPLE_RATE; its profile
+    is stored and its ID returned in the X-Profile-Id response header. With
+    PROFILING_SLOW_REQUEST_SECONDS above zero, every request is sampled and
+    the profile of any request slower than that is stored too.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not settings.PROFILING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        header = settings.PROFILING_HEADER.lower().encode("latin-1")
+        if any(name == header for name, _ in scope.get("headers", [])):
+            trigger = "header"
+        elif settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE:
+            trigger = "sample"
+        else:
+            trigger = None
+
+        if trigger is None and settings.PROFILING_SLOW_REQUEST_SECONDS <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(asyncio.current_task(), scope["method"], scope["path"], trigger)
+        status = None
+
+        async def send_with_profile_id(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trigger is not None:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        started = time.perf_counter()
+        stack_sampler.register(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            stack_sampler.unregister(profile)
+            duration = time.perf_counter() - started
+            slow = 0 < settings.PROFILING_SLOW_REQUEST_SECONDS <= duration
+            if trigger is not None or slow:
+                if slow:
+                    logger.warning(f"Slow request {scope['method']} {scope['path']} took {duration:.2f}s; profile {profile.id}")
+                try:
+                    await asyncio.to_thread(profile_store.save, profile.to_dict(duration, status))
+                except OSError as e:
+                    logger.error(f"Could not store profile {profile.id}: {e}")
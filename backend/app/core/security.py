@@ -2,31 +2,47 @@
 Security utilities for authentication and authorization
 """
 
+import uuid
 from datetime import datetime, timedelta
-from typing import Optional, Any
-import jwt
-from passlib.context import CryptContext
+from typing import Dict, Optional, Any
+from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import ValidationError
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models.user import User, TokenPayload
+from app.models.user import User, Principal, TokenPayload
+from app.core.cache import LRUCache
+from app.core.passwords import password_hasher
 from app.core.config import settings
-from backend.app.db.database import get_async_database
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.db.database import get_async_db
+from app.db.models import User as UserRecord
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
+# Authenticated users by ID, so most requests need no user lookup
+user_cache = LRUCache(settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+
+# Invalidation count per user ID, so a lookup racing an update cannot cache the old record
+_user_generations: Dict[str, int] = {}
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against a hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    """Verify a password against a hash, blocking the calling thread; async code should use verify_password_async."""
+    return password_hasher.verify_sync(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    """Hash a password for storing."""
-    return pwd_context.hash(password)
+    """Hash a password for storing, blocking the calling thread; async code should use get_password_hash_async."""
+    return password_hasher.hash_sync(password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against a hash on the password hashing pool."""
+    return await password_hasher.verify(plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password for storing on the password hashing pool."""
+    return await password_hasher.hash(password)
 
 def create_access_token(subject: str, role: str, expires_delta: Optional[timedelta] = None) -> str:
     """
@@ -36,7 +52,7 @@ def create_access_token(subject: str, role: str, expires_delta: Optional[timedel
         subject: The subject of the token (usually user ID)
         role: The user's role
         expires_delta: Optional token expiration time
-        
+    
     Returns:
         JWT token string
     """
@@ -48,34 +64,34 @@ def create_access_token(subject: str, role: str, expires_delta: Optional[timedel
     payload = {
         "sub": subject,
         "role": role,
-        "exp": expire.timestamp()
+        "exp": int(expire.timestamp())
     }
     
     encoded_jwt = jwt.encode(
-        payload, 
-        settings.JWT_SECRET, 
+        payload,
+        settings.JWT_SECRET,
         algorithm=settings.JWT_ALGORITHM
     )
     
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+def decode_access_token(token: str) -> TokenPayload:
     """
-    Get the current user from the JWT token.
+    Validate a JWT access token and return its claims.
     
     Args:
         token: JWT token
-        
+    
     Returns:
-        User object
-        
+        The token's payload
+    
     Raises:
-        HTTPException: If authentication fails
+        HTTPException: If the token is invalid or expired
     """
     try:
         payload = jwt.decode(
-            token, 
-            settings.JWT_SECRET, 
+            token,
+            settings.JWT_SECRET,
             algorithms=[settings.JWT_ALGORITHM]
         )
         token_data = TokenPayload(**payload)
@@ -87,24 +103,79 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
                 detail="Token expired",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-    except (jwt.JWTError, ValidationError):
+    except (JWTError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    return token_data
+
+def invalidate_user(user_id: str) -> None:
+    """
+    Drop a user from the authenticated user cache.
+    
+    Called automatically when a User row is updated or deleted through the
+    ORM. Code changing users with bulk UPDATE statements must call it itself.
+    Other worker processes see the change once their entry expires.
+    
+    Args:
+        user_id: The user ID
+    """
+    user_id = str(user_id)
+    _user_generations[user_id] = _user_generations.get(user_id, 0) + 1
+    user_cache.delete(user_id)
+
+@event.listens_for(UserRecord, "after_update")
+@event.listens_for(UserRecord, "after_delete")
+def _invalidate_changed_user(mapper, connection, target) -> None:
+    invalidate_user(target.id)
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """
+    Get the current user from the JWT token.
+    
+    Users are served from a short-lived in-process cache, so the database
+    is only queried on the first request of a user within the TTL.
+    
+    Args:
+        token: JWT token
+        db: Database session
+    
+    Returns:
+        User object
+    
+    Raises:
+        HTTPException: If authentication fails
+    """
+    token_data = decode_access_token(token)
+    
+    user = user_cache.get(token_data.sub)
+    if user is not None:
+        return user
+    
     # Get user from database
-    db = await get_async_database()
-    user = await db.users.find_one({"id": token_data.sub})
+    generation = _user_generations.get(token_data.sub, 0)
+    try:
+        record = await db.get(UserRecord, uuid.UUID(token_data.sub))
+    except ValueError:
+        record = None
     
-    if not user:
+    if not record:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    return User(**user)
+    user = User(**record.to_dict())
+    if _user_generations.get(token_data.sub, 0) == generation:
+        user_cache.set(token_data.sub, user)
+    
+    return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     """
@@ -112,10 +183,10 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     
     Args:
         current_user: Current user
-        
+    
     Returns:
         User object
-        
+    
     Raises:
         HTTPException: If user is inactive
     """
@@ -129,10 +200,10 @@ async def get_current_librarian(current_user: User = Depends(get_current_active_
     
     Args:
         current_user: Current user
-        
+    
     Returns:
         User object
-        
+    
     Raises:
         HTTPException: If user is not a librarian
     """
@@ -142,4 +213,53 @@ async def get_current_librarian(current_user: User = Depends(get_current_active_
             detail="Not enough permissions"
         )
     
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    """
+    Get the ID and role of the caller, for read-only endpoints.
+    
+    With AUTH_TRUST_TOKEN_ROLE set, the role claim of the signed token is
+    used without loading the user, so a role change takes effect when the
+    user's current token expires. Otherwise the role comes from the user record.
+    
+    Args:
+        token: JWT token
+        db: Database session
+    
+    Returns:
+        Principal object
+    
+    Raises:
+        HTTPException: If authentication fails
+    """
+    if settings.AUTH_TRUST_TOKEN_ROLE:
+        token_data = decode_access_token(token)
+        return Principal(id=token_data.sub, role=token_data.role)
+    
+    user = await get_current_active_user(await get_current_user(token, db))
+    return Principal(id=user.id, role=user.role)
+
+async def get_current_librarian_principal(principal: Principal = Depends(get_current_principal)) -> Principal:
+    """
+    Get the ID and role of a librarian caller, for read-only endpoints.
+    
+    Args:
+        principal: The caller
+    
+    Returns:
+        Principal object
+    
+    Raises:
+        HTTPException: If the caller is not a librarian
+    """
+    if principal.role != "librarian":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    return principal
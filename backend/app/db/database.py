@@ -3,21 +3,103 @@ PostgreSQL database connection and session management
 """
 
 import logging
+import uuid
+from typing import AsyncIterator
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 
 from app.core.config import settings
+from app.db.pool import InstrumentedAsyncQueuePool, InstrumentedNullPool, InstrumentedQueuePool, instrument
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Create SQLAlchemy engine
-engine = create_engine(settings.DATABASE_URL)
+# Async drivers used by the API for each database backend
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def async_database_url(url: str) -> str:
+    """
+    Derive the async driver URL for a database URL.
+    
+    Args:
+        url: A SQLAlchemy database URL, such as settings.DATABASE_URL
+        
+    Returns:
+        The same database addressed through its async driver
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}' databases")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    """
+    Pool configuration for an engine, from settings.
+    
+    SQLite keeps SQLAlchemy's defaults. With DB_PGBOUNCER set, connections are
+    opened per checkout and left to PgBouncer to pool; asyncpg's prepared
+    statement caches are disabled since transaction pooling can hand each
+    statement to a different server connection.
+    
+    Args:
+        url: The database URL the engine connects to
+        is_async: Whether the engine is created with create_async_engine
+        
+    Returns:
+        Keyword arguments for create_engine or create_async_engine
+    """
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return {}
+    
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING}
+    
+    if settings.DB_PGBOUNCER:
+        options["poolclass"] = InstrumentedNullPool
+        if url.get_driver_name() == "asyncpg":
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            }
+        return options
+    
+    options.update({
+        "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    })
+    return options
+
+def database_url(url: str) -> str:
+    """The URL to connect with, adjusted for PgBouncer when DB_PGBOUNCER is set."""
+    parsed = make_url(url)
+    if settings.DB_PGBOUNCER and parsed.get_driver_name() == "asyncpg":
+        parsed = parsed.update_query_dict({"prepared_statement_cache_size": "0"})
+    return parsed.render_as_string(hide_password=False)
+
+# Create SQLAlchemy engine, used by scripts and migrations
+engine = create_engine(database_url(settings.DATABASE_URL), **engine_options(settings.DATABASE_URL))
+instrument(engine)
 
 # Create SessionLocal class for database sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and sessions used by the API, so queries never block the event loop
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL)
+async_engine = create_async_engine(
+    database_url(ASYNC_DATABASE_URL), **engine_options(ASYNC_DATABASE_URL, is_async=True)
+)
+instrument(async_engine.sync_engine)
+
+# Objects stay readable after commit; lazy refreshes are not possible outside the async context
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Create Base class for declarative models
 Base = declarative_base()
 
@@ -34,4 +116,14 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """
+    Get an async database session.
+    
+    This is the dependency used by the API's endpoints. It creates a new
+    AsyncSession for each request and closes it when the request is finished.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,538 @@
+"""
+In-memory embedding index for fast similarity search
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import weakref
+from datetime import datetime
+from typing import Awaitable, Callable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class EmbeddingIndex:
+    """
+    A process-wide matrix of book embeddings.
+
+    Embeddings are stored L2-normalized as float32 rows of a single matrix,
+    with a parallel array of book IDs, so cosine similarity against the whole
+    catalog is one matrix-vector product.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Serializes loading per event loop, since asyncio locks are bound to one loop
+        self._load_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._book_ids = np.empty(0, dtype=object)
+        self._positions = {}
+        self._size = 0
+        self.loaded = False
+        # Latest BookEmbedding.updated_at reflected in the index
+        self.synced_at: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """L2-normalize vectors row-wise, leaving zero vectors untouched."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def load(self, book_ids: Sequence[str], embeddings: Iterable[Sequence[float]]) -> None:
+        """
+        Replace the index contents.
+
+        Args:
+            book_ids: Book IDs, one per embedding
+            embeddings: Embedding vectors in the same order as book_ids
+        """
+        book_ids = [str(book_id) for book_id in book_ids]
+        matrix = np.asarray(list(embeddings), dtype=np.float32)
+
+        with self._lock:
+            if not book_ids:
+                self._matrix = np.empty((0, 0), dtype=np.float32)
+            else:
+                self._matrix = self._normalize(matrix.reshape(len(book_ids), -1))
+            self._book_ids = np.array(book_ids, dtype=object)
+            self._positions = {book_id: i for i, book_id in enumerate(book_ids)}
+            self._size = len(book_ids)
+            self.loaded = True
+
+        logger.info(f"Loaded {self._size} embeddings into the in-memory index")
+
+    def clear(self) -> None:
+        """Empty the index and mark it as not loaded."""
+        self.load([], [])
+        self.loaded = False
+        self.synced_at = None
+
+    async def ensure_loaded(self, loader: Callable[["EmbeddingIndex"], Awaitable[None]]) -> None:
+        """
+        Load the index once, the first time it is needed.
+
+        Concurrent callers wait for the first one's load instead of
+        starting their own.
+
+        Args:
+            loader: Coroutine function that populates the index it is given
+        """
+        if self.loaded:
+            return
+
+        lock = self._load_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+        async with lock:
+            if not self.loaded:
+                await loader(self)
+
+    def upsert(self, book_id: str, embedding: Sequence[float]) -> None:
+        """
+        Insert or replace the embedding for a book.
+
+        Args:
+            book_id: The ID of the book
+            embedding: The embedding vector
+        """
+        book_id = str(book_id)
+        vector = self._normalize(np.asarray(embedding, dtype=np.float32).ravel())
+
+        with self._lock:
+            position = self._positions.get(book_id)
+            if position is not None:
+                self._matrix[position] = vector
+                return
+
+            if self._size == 0 and self._matrix.shape[1] != vector.shape[0]:
+                self._matrix = np.empty((0, vector.shape[0]), dtype=np.float32)
+
+            # Grow the backing arrays geometrically so appends stay amortized O(1)
+            if self._size == len(self._matrix):
+                capacity = max(16, 2 * len(self._matrix))
+                matrix = np.empty((capacity, self._matrix.shape[1]), dtype=np.float32)
+                matrix[:self._size] = self._matrix[:self._size]
+                book_ids = np.empty(capacity, dtype=object)
+                book_ids[:self._size] = self._book_ids[:self._size]
+                self._matrix, self._book_ids = matrix, book_ids
+
+            self._matrix[self._size] = vector
+            self._book_ids[self._size] = book_id
+            self._positions[book_id] = self._size
+            self._size += 1
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        n: int,
+        exclude_book_ids: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Find the books most similar to a query embedding.
+
+        Args:
+            query_embedding: The embedding vector to compare against
+            n: Number of results to return
+            exclude_book_ids: Book IDs to leave out of the results
+
+        Returns:
+            List of (book_id, cosine similarity) pairs, most similar first
+        """
+        query = self._normalize(np.asarray(query_embedding, dtype=np.float32).ravel())
+
+        with self._lock:
+            if self._size == 0 or n <= 0:
+                return []
+
+            similarities = self._matrix[:self._size] @ query
+
+            # Apply the exclusion list as a boolean mask over the score vector
+            valid = np.ones(self._size, dtype=bool)
+            for book_id in exclude_book_ids or []:
+                position = self._positions.get(str(book_id))
+                if position is not None:
+                    valid[position] = False
+            similarities[~valid] = -np.inf
+
+            return self._top_k(self._book_ids[:self._size], similarities, min(n, int(valid.sum())))
+
+    def search_many(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n: int,
+        exclude_book_ids: Optional[Sequence[Optional[Iterable[str]]]] = None,
+        chunk_size: int = 256
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Find the most similar books for several queries at once.
+
+        Scores are computed as one matrix-matrix product per chunk of queries.
+
+        Args:
+            query_embeddings: The embedding vectors to compare against
+            n: Number of results per query
+            exclude_book_ids: Per-query book IDs to leave out of the results
+            chunk_size: Queries scored together, bounding the score matrix size
+
+        Returns:
+            One list of (book_id, cosine similarity) pairs per query, most similar first
+        """
+        queries = self._normalize(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        exclude_book_ids = exclude_book_ids or [None] * len(queries)
+        results = []
+
+        with self._lock:
+            if self._size == 0 or n <= 0:
+                return [[] for _ in range(len(queries))]
+
+            book_ids = self._book_ids[:self._size]
+            for start in range(0, len(queries), chunk_size):
+                similarities = queries[start:start + chunk_size] @ self._matrix[:self._size].T
+
+                for row, excluded_ids in zip(similarities, exclude_book_ids[start:start + chunk_size]):
+                    valid = np.ones(self._size, dtype=bool)
+                    for book_id in excluded_ids or []:
+                        position = self._positions.get(str(book_id))
+                        if position is not None:
+                            valid[position] = False
+                    row[~valid] = -np.inf
+                    results.append(self._top_k(book_ids, row, min(n, int(valid.sum()))))
+
+        return results
+
+    def _snapshot(self) -> dict:
+        """Arrays to persist, keyed by name."""
+        return {
+            "matrix": self._matrix[:self._size],
+            "book_ids": np.array(self._book_ids[:self._size], dtype=str),
+        }
+
+    def _restore_snapshot(self, snapshot) -> None:
+        """Restore the arrays written by _snapshot."""
+        book_ids = snapshot["book_ids"].tolist()
+        self._matrix = np.ascontiguousarray(snapshot["matrix"], dtype=np.float32)
+        self._book_ids = np.array(book_ids, dtype=object)
+        self._positions = {book_id: i for i, book_id in enumerate(book_ids)}
+        self._size = len(book_ids)
+
+    def save(self, path: str) -> None:
+        """
+        Persist the index to disk so it does not have to be rebuilt at startup.
+
+        Args:
+            path: Destination file
+        """
+        with self._lock:
+            snapshot = self._snapshot()
+            snapshot["backend"] = np.array(type(self).__name__)
+            snapshot["synced_at"] = np.array(self.synced_at.isoformat() if self.synced_at else "")
+
+            # Write to a temporary file first so readers never see a partial snapshot
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **snapshot)
+            os.replace(tmp_path, path)
+
+        logger.info(f"Saved {self._size} embeddings to {path}")
+
+    def restore(self, path: str) -> bool:
+        """
+        Load a snapshot written by save.
+
+        The index is not marked as loaded; the caller does that once it has
+        checked the snapshot against the database.
+
+        Args:
+            path: Snapshot file
+
+        Returns:
+            True if the snapshot was loaded, False if it is missing or unusable
+        """
+        if not os.path.exists(path):
+            return False
+
+        try:
+            with np.load(path, allow_pickle=False) as snapshot:
+                if str(snapshot["backend"]) != type(self).__name__:
+                    logger.warning(f"Ignoring index snapshot {path} built by a different backend")
+                    return False
+
+                with self._lock:
+                    self._restore_snapshot(snapshot)
+                    synced_at = str(snapshot["synced_at"])
+                    self.synced_at = datetime.fromisoformat(synced_at) if synced_at else None
+        except (OSError, KeyError, ValueError) as e:
+            logger.error(f"Error loading index snapshot {path}: {e}")
+            return False
+
+        logger.info(f"Restored {self._size} embeddings from {path}")
+        return True
+
+    @staticmethod
+    def _top_k(book_ids: np.ndarray, similarities: np.ndarray, n: int) -> List[Tuple[str, float]]:
+        """Select the n highest scores with argpartition and sort only those."""
+        k = min(n, len(similarities))
+        if k <= 0:
+            return []
+
+        if k < len(similarities):
+            top = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            top = np.arange(len(similarities))
+        top = top[np.argsort(-similarities[top], kind="stable")]
+
+        return [(book_ids[i], float(similarities[i])) for i in top]
+
+class IVFFlatIndex(EmbeddingIndex):
+    """
+    Inverted-file index with exact scoring inside the probed lists.
+
+    Vectors are partitioned by a spherical k-means coarse quantizer. A query
+    only scores the vectors in its nprobe closest lists, trading a little
+    recall for search time that grows with nprobe / nlist of the catalog.
+    Until the index holds min_train_size vectors it behaves like the exact
+    index. Inserts that reach that size train the quantizer on a background
+    thread, so searches and inserts are not held up by k-means.
+    """
+
+    def __init__(self, nlist: int = 0, nprobe: int = 8, min_train_size: int = 10000):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        # Row positions belonging to each list
+        self._lists: List[np.ndarray] = []
+        self._training: Optional[threading.Thread] = None
+        # Positions replaced while a training run is assigning vectors, or None between runs
+        self._changed: Optional[set] = None
+        # Bumped by load, so a training run over replaced contents is discarded
+        self._loads = 0
+        super().__init__()
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def load(self, book_ids: Sequence[str], embeddings: Iterable[Sequence[float]]) -> None:
+        with self._lock:
+            super().load(book_ids, embeddings)
+            self._loads += 1
+            self._centroids = None
+            self._assignments = np.empty(0, dtype=np.int32)
+            self._lists = []
+            if self._size >= max(self.min_train_size, 1):
+                self.train()
+
+    def train(self, iterations: int = 10, sample_per_list: int = 256) -> None:
+        """
+        Fit the coarse quantizer and assign every vector to a list.
+
+        The lock is only held to take a sample and to install the result, so
+        the index keeps serving exact searches and inserts while k-means runs.
+
+        Args:
+            iterations: Number of k-means iterations
+            sample_per_list: Training sample size per list
+        """
+        with self._lock:
+            if self._size == 0:
+                return
+
+            size, matrix, loads = self._size, self._matrix, self._loads
+            nlist = self.nlist or int(np.sqrt(size))
+            nlist = max(1, min(nlist, size))
+            rng = np.random.default_rng(0)
+
+            sample_size = min(size, nlist * sample_per_list)
+            sample = matrix[rng.choice(size, sample_size, replace=False)]
+            self._changed = set()
+
+        try:
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                # Keep the previous centroid for lists that attracted no vectors
+                empty = np.bincount(labels, minlength=nlist) == 0
+                sums[empty] = centroids[empty]
+                centroids = self._normalize(sums)
+
+            assigned = self._assign(matrix[:size], centroids)
+
+            with self._lock:
+                if self._loads != loads:
+                    return
+
+                # Vectors inserted or replaced since the sample was taken are assigned again
+                stale = np.array(sorted(self._changed | set(range(size, self._size))), dtype=np.int64)
+                self._assignments = np.empty(len(self._matrix), dtype=np.int32)
+                self._assignments[:size] = assigned
+                if len(stale):
+                    self._assignments[stale] = self._assign(self._matrix[stale], centroids)
+                self._centroids = centroids
+                self._build_lists()
+        finally:
+            with self._lock:
+                self._changed = None
+
+        logger.info(f"Trained IVF index with {nlist} lists over {size} embeddings")
+
+    def wait_for_training(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait for a background training run started by upsert, if any.
+
+        Args:
+            timeout: Seconds to wait at most, or None to wait until it finishes
+        """
+        training = self._training
+        if training is not None:
+            training.join(timeout)
+
+    def _build_lists(self) -> None:
+        """Group row positions by assigned list."""
+        assignments = self._assignments[:self._size]
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=len(self._centroids))
+        self._lists = np.split(order, np.cumsum(counts)[:-1])
+
+    def _assign(self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None, chunk_size: int = 65536) -> np.ndarray:
+        """Nearest centroid for each vector, in chunks to bound memory."""
+        centroids = self._centroids if centroids is None else centroids
+        return np.concatenate([
+            np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), chunk_size)
+        ]).astype(np.int32)
+
+    def upsert(self, book_id: str, embedding: Sequence[float]) -> None:
+        with self._lock:
+            existing = str(book_id) in self._positions
+            super().upsert(book_id, embedding)
+
+            if self._changed is not None and existing:
+                self._changed.add(self._positions[str(book_id)])
+
+            if not self.trained:
+                training = self._training is not None and self._training.is_alive()
+                if self._size >= max(self.min_train_size, 1) and not training:
+                    self._training = threading.Thread(target=self.train, name="ivf-train", daemon=True)
+                    self._training.start()
+                return
+
+            # Move the new or updated vector into its nearest list
+            position = self._positions[str(book_id)]
+            assignment = self._assign(self._matrix[position:position + 1])[0]
+
+            if existing:
+                previous = self._lists[self._assignments[position]]
+                self._lists[self._assignments[position]] = previous[previous != position]
+            elif position >= len(self._assignments):
+                assignments = np.empty(len(self._matrix), dtype=np.int32)
+                assignments[:len(self._assignments)] = self._assignments
+                self._assignments = assignments
+
+            self._assignments[position] = assignment
+            self._lists[assignment] = np.append(self._lists[assignment], position)
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        n: int,
+        exclude_book_ids: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, float]]:
+        exclude_book_ids = list(exclude_book_ids or [])
+
+        with self._lock:
+            if not self.trained:
+                return super().search(query_embedding, n, exclude_book_ids)
+
+            query = self._normalize(np.asarray(query_embedding, dtype=np.float32).ravel())
+
+            # Pick the nprobe lists whose centroids are closest to the query
+            nprobe = min(self.nprobe, len(self._centroids))
+            probes = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+            candidates = np.concatenate([self._lists[probe] for probe in probes])
+
+            excluded = {
+                self._positions[str(book_id)]
+                for book_id in exclude_book_ids
+                if str(book_id) in self._positions
+            }
+            if excluded:
+                candidates = candidates[~np.isin(candidates, list(excluded))]
+
+            # Too few vectors in the probed lists to fill the result; scan everything
+            if len(candidates) < n:
+                return super().search(query_embedding, n, exclude_book_ids)
+
+            similarities = self._matrix[candidates] @ query
+            return self._top_k(self._book_ids[candidates], similarities, n)
+
+    def search_many(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n: int,
+        exclude_book_ids: Optional[Sequence[Optional[Iterable[str]]]] = None,
+        chunk_size: int = 256
+    ) -> List[List[Tuple[str, float]]]:
+        with self._lock:
+            if not self.trained:
+                return super().search_many(query_embeddings, n, exclude_book_ids, chunk_size)
+
+            # Each query probes its own lists, so queries are answered one at a time
+            exclude_book_ids = exclude_book_ids or [None] * len(query_embeddings)
+            return [
+                self.search(query, n, excluded)
+                for query, excluded in zip(query_embeddings, exclude_book_ids)
+            ]
+
+    def _snapshot(self) -> dict:
+        snapshot = super()._snapshot()
+        if self.trained:
+            snapshot["centroids"] = self._centroids
+            snapshot["assignments"] = self._assignments[:self._size]
+        return snapshot
+
+    def _restore_snapshot(self, snapshot) -> None:
+        super()._restore_snapshot(snapshot)
+        if "centroids" in snapshot:
+            self._centroids = np.asarray(snapshot["centroids"], dtype=np.float32)
+            self._assignments = np.asarray(snapshot["assignments"], dtype=np.int32).copy()
+            self._build_lists()
+        else:
+            self._centroids = None
+            self._assignments = np.empty(0, dtype=np.int32)
+            self._lists = []
+
+def create_embedding_index() -> EmbeddingIndex:
+    """
+    Create the embedding index selected by settings.VECTOR_INDEX_BACKEND.
+
+    Returns:
+        An empty, unloaded index
+    """
+    backend = settings.VECTOR_INDEX_BACKEND.lower()
+    if backend == "ivf":
+        return IVFFlatIndex(
+            nlist=settings.IVF_NLIST,
+            nprobe=settings.IVF_NPROBE,
+            min_train_size=settings.IVF_MIN_TRAIN_SIZE,
+        )
+    if backend != "exact":
+        logger.warning(f"Unknown VECTOR_INDEX_BACKEND '{backend}', using exact search")
+    return EmbeddingIndex()
+
+# Process-wide index shared by all VectorStore instances
+embedding_index = create_embedding_index()
@@ -3,13 +3,67 @@ SQLAlchemy database models
 """
 
 import uuid
-from sqlalchemy import Column, String, Integer, Float, Boolean, Text, DateTime, ForeignKey, Table, UniqueConstraint
-from sqlalchemy.dialects.postgresql import UUID, ARRAY
+from typing import Any, Dict, Sequence, Tuple
+import numpy as np
+from sqlalchemy import Column, String, Integer, Float, Boolean, Text, DateTime, ForeignKey, Index, Table, UniqueConstraint, JSON, LargeBinary
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.types import UserDefinedType
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
+from app.core.config import settings
 from app.db.database import Base
 
+# Embeddings are stored as packed floats; each row's embedding_dtype holds the
+# NumPy dtype string needed to decode it, so rows of different widths coexist
+EMBEDDING_STORAGE_DTYPES = {"float32": "<f4", "float16": "<f2"}
+
+def pack_embedding(embedding: Sequence[float]) -> Tuple[bytes, str]:
+    """
+    Pack an embedding with the configured storage width.
+
+    Args:
+        embedding: The embedding vector
+
+    Returns:
+        Tuple of (packed bytes, NumPy dtype string)
+    """
+    dtype = np.dtype(EMBEDDING_STORAGE_DTYPES[settings.EMBEDDING_STORAGE_DTYPE])
+    return np.ascontiguousarray(embedding, dtype=dtype).tobytes(), dtype.str
+
+def unpack_embedding(packed: bytes, dtype: str) -> np.ndarray:
+    """
+    Decode a packed embedding without copying it.
+
+    Args:
+        packed: Bytes as stored in the embedding column
+        dtype: NumPy dtype string from the embedding_dtype column
+
+    Returns:
+        A read-only array viewing the stored bytes
+    """
+    return np.frombuffer(packed, dtype=np.dtype(dtype))
+
+class PGVector(UserDefinedType):
+    """
+    The pgvector extension's vector type.
+
+    Only used in SQL expressions against the optional
+    book_embeddings.embedding_vector column, which is not mapped on the model
+    because it exists only where the extension is installed.
+    """
+    cache_ok = True
+
+    def get_col_spec(self, **kw) -> str:
+        return "vector"
+
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None:
+                return None
+            return "[" + ",".join(str(float(x)) for x in value) + "]"
+        return process
+
 class Book(Base):
     """Book model"""
     __tablename__ = "books"
@@ -31,6 +85,23 @@ class Book(Base):
     # Relationships
     borrowed_records = relationship("BorrowedBook", back_populates="book")
     embedding = relationship("BookEmbedding", uselist=False, back_populates="book")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the book using the API's field names."""
+        return {
+            "id": str(self.id),
+            "title": self.title,
+            "author": self.author,
+            "isbn": self.isbn,
+            "genre": self.genre,
+            "publicationYear": self.publication_year,
+            "publisher": self.publisher,
+            "description": self.description,
+            "copies": self.copies,
+            "copiesAvailable": self.copies_available,
+            "coverImage": self.cover_image,
+            "available": (self.copies_available or 0) > 0,
+        }
 
 class User(Base):
     """User model"""
@@ -51,6 +122,20 @@ class User(Base):
     
     # Relationships
     borrowed_records = relationship("BorrowedBook", back_populates="user")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the user using the API's field names, without the password hash."""
+        return {
+            "id": str(self.id),
+            "email": self.email,
+            "firstName": self.first_name,
+            "lastName": self.last_name,
+            "role": self.role,
+            "studentId": self.student_id,
+            "department": self.department,
+            "avatar": self.avatar,
+            "joinDate": self.join_date,
+        }
 
 class BorrowedBook(Base):
     """Borrowed book record model"""
@@ -66,6 +151,13 @@ class BorrowedBook(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Indexes matching the hot query shapes: reading histories, a book's active loans and overdue sweeps
+    __table_args__ = (
+        Index("ix_borrowed_books_user_id_borrow_date", user_id, borrow_date.desc()),
+        Index("ix_borrowed_books_book_id_status", book_id, status),
+        Index("ix_borrowed_books_status_due_date", status, due_date),
+    )
+    
     # Relationships
     book = relationship("Book", back_populates="borrowed_records")
     user = relationship("User", back_populates="borrowed_records")
@@ -76,9 +168,69 @@ class BookEmbedding(Base):
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     book_id = Column(UUID(as_uuid=True), ForeignKey("books.id"), unique=True, nullable=False)
-    embedding = Column(ARRAY(Float), nullable=False)  # Vector storage for embeddings
+    embedding = Column(LargeBinary, nullable=False)  # Packed embedding, see pack_embedding
+    embedding_dtype = Column(String(8), nullable=False, default="<f4")  # NumPy dtype of the packed values
+    model = Column(String(100), nullable=True)  # Embedding model that produced the vector
+    text_hash = Column(String(64), nullable=True)  # Hash of the normalized book text that was embedded
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    book = relationship("Book", back_populates="embedding")
\ No newline at end of file
+    book = relationship("Book", back_populates="embedding")
+    
+    @property
+    def vector(self) -> np.ndarray:
+        """The embedding as a read-only array over the stored bytes."""
+        return unpack_embedding(self.embedding, self.embedding_dtype)
+    
+    @vector.setter
+    def vector(self, embedding: Sequence[float]) -> None:
+        self.embedding, self.embedding_dtype = pack_embedding(embedding)
+
+class EmbeddingCacheEntry(Base):
+    """Embedding cache entry keyed by model and normalized-text hash"""
+    __tablename__ = "embedding_cache"
+    __table_args__ = (UniqueConstraint("model", "text_hash", name="uq_embedding_cache_model_text_hash"),)
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    model = Column(String(100), nullable=False)
+    text_hash = Column(String(64), nullable=False)
+    embedding = Column(LargeBinary, nullable=False)  # Packed embedding, see pack_embedding
+    embedding_dtype = Column(String(8), nullable=False, default="<f4")  # NumPy dtype of the packed values
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    @property
+    def vector(self) -> np.ndarray:
+        """The embedding as a read-only array over the stored bytes."""
+        return unpack_embedding(self.embedding, self.embedding_dtype)
+    
+    @vector.setter
+    def vector(self, embedding: Sequence[float]) -> None:
+        self.embedding, self.embedding_dtype = pack_embedding(embedding)
+
+class UserRecommendation(Base):
+    """Precomputed recommendations for a user"""
+    __tablename__ = "user_recommendations"
+    
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    recommendations = Column(JSON, nullable=False)  # Recommendation payload as served by the API
+    num_recommendations = Column(Integer, nullable=False)
+    # State of the user's borrowed_books when the recommendations were computed
+    history_count = Column(Integer, nullable=False)
+    history_updated_at = Column(DateTime, nullable=True)
+    generated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class UserPreferenceProfile(Base):
+    """Reading preference profile of a user, updated as books are borrowed"""
+    __tablename__ = "user_preference_profiles"
+    
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    model = Column(String(100), nullable=False)  # Embedding model of the vectors folded in
+    centroid = Column(LargeBinary, nullable=False)  # Recency-weighted sum of the history's embeddings, float32
+    clusters = Column(LargeBinary, nullable=False)  # Recency-weighted sum per taste cluster, float32 rows
+    cluster_weights = Column(JSON, nullable=False)  # Decayed weight of each cluster
+    weight = Column(Float, nullable=False)  # Decayed weight of the whole history
+    reference_date = Column(DateTime, nullable=False)  # Borrow date the weights are decayed to
+    book_count = Column(Integer, nullable=False)  # Borrow records folded in
+    borrowed_through = Column(DateTime, nullable=True)  # Latest created_at of the borrow records folded in
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,191 @@
+"""
+Instrumented connection pools
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from app.core.metrics import render_samples
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class PoolMetrics:
+    """
+    Counters describing how an engine's connections are used.
+
+    Checkout wait is the time between asking the pool for a connection and
+    getting one, including opening a new connection when the pool has to.
+    Wait percentiles are computed over the most recent checkouts.
+    """
+
+    def __init__(self, window: int = 1000):
+        """
+        Args:
+            window: Number of recent checkout waits kept for percentiles
+        """
+        self.checkouts = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._waits = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        """Record one checkout attempt and how long it waited."""
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self._waits.append(seconds)
+
+    def checked_out(self) -> None:
+        """Count a connection handed to the application."""
+        with self._lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def checked_in(self) -> None:
+        """Count a connection returned to the pool."""
+        with self._lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def stats(self, pool: Optional[Any] = None) -> Dict[str, Any]:
+        """
+        Current counters, plus the pool's own sizing if it has any.
+
+        Args:
+            pool: The pool these metrics belong to
+
+        Returns:
+            Checkouts, timeouts, connections in use and checkout wait in milliseconds
+        """
+        with self._lock:
+            waits = np.asarray(self._waits) * 1000
+            attempts = self.checkouts + self.timeouts
+            stats = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "wait_mean_ms": self.wait_total * 1000 / attempts if attempts else 0.0,
+                "wait_p95_ms": float(np.percentile(waits, 95)) if len(waits) else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+            }
+
+        if isinstance(pool, QueuePool):
+            stats.update({
+                "pool_size": pool.size(),
+                "idle": pool.checkedin(),
+                # Negative until the pool has opened pool_size connections
+                "overflow": max(pool.overflow(), 0),
+            })
+        return stats
+
+class InstrumentedPool:
+    """Mixin timing every checkout into the pool's PoolMetrics."""
+
+    metrics: Optional[PoolMetrics] = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            if self.metrics is not None:
+                self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        if self.metrics is not None:
+            self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool; keep counting into the same metrics
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+class InstrumentedQueuePool(InstrumentedPool, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+class InstrumentedNullPool(InstrumentedPool, NullPool):
+    pass
+
+def instrument(engine: Engine) -> PoolMetrics:
+    """
+    Attach metrics to an engine created with one of the instrumented pools.
+
+    Args:
+        engine: A sync engine, or the sync_engine of an AsyncEngine
+
+    Returns:
+        The engine's PoolMetrics
+    """
+    metrics = PoolMetrics()
+    engine.pool.metrics = metrics
+    event.listen(engine, "checkout", lambda *args: metrics.checked_out())
+    event.listen(engine, "checkin", lambda *args: metrics.checked_in())
+    return metrics
+
+def pool_stats(engine: Engine) -> Dict[str, Any]:
+    """
+    Connection usage of an instrumented engine.
+
+    Args:
+        engine: A sync engine, or the sync_engine of an AsyncEngine
+
+    Returns:
+        The PoolMetrics counters, or an empty dict if the engine is not instrumented
+    """
+    metrics = getattr(engine.pool, "metrics", None)
+    return metrics.stats(engine.pool) if metrics is not None else {}
+
+# PoolMetrics.stats keys exported on /metrics: (metric name, type, help, scale to base units)
+PROMETHEUS_POOL_METRICS = {
+    "checkouts": ("bookbuddy_db_pool_checkouts_total", "counter", "Connections handed out by the pool.", 1),
+    "timeouts": ("bookbuddy_db_pool_checkout_timeouts_total", "counter", "Checkouts that timed out waiting for a connection.", 1),
+    "in_use": ("bookbuddy_db_pool_connections_in_use", "gauge", "Connections currently checked out.", 1),
+    "peak_in_use": ("bookbuddy_db_pool_connections_in_use_peak", "gauge", "Most connections checked out at once.", 1),
+    "pool_size": ("bookbuddy_db_pool_size", "gauge", "Connections the pool keeps open.", 1),
+    "idle": ("bookbuddy_db_pool_connections_idle", "gauge", "Open connections waiting in the pool.", 1),
+    "overflow": ("bookbuddy_db_pool_connections_overflow", "gauge", "Connections open beyond the pool size.", 1),
+    "wait_p95_ms": ("bookbuddy_db_pool_checkout_wait_p95_seconds", "gauge", "95th percentile of recent checkout waits.", 0.001),
+    "wait_max_ms": ("bookbuddy_db_pool_checkout_wait_max_seconds", "gauge", "Longest checkout wait.", 0.001),
+}
+
+def render_pool_metrics(engines: Dict[str, Engine]) -> str:
+    """
+    Connection usage of instrumented engines in the Prometheus text format.
+
+    Args:
+        engines: Engines by the name used as their 'engine' label
+
+    Returns:
+        Gauges and counters from every engine's PoolMetrics
+    """
+    stats = {name: pool_stats(engine) for name, engine in engines.items()}
+    return "".join(
+        render_samples(
+            metric, documentation, metric_type,
+            {name: values[key] * scale for name, values in stats.items() if key in values},
+            label="engine"
+        )
+        for key, (metric, metric_type, documentation, scale) in PROMETHEUS_POOL_METRICS.items()
+    )
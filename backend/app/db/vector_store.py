@@ -2,15 +2,20 @@
 Vector storage and similarity search for book recommendations
 """
 
+import asyncio
 import logging
 import numpy as np
-from typing import List, Dict, Any, Optional
-from sklearn.metrics.pairwise import cosine_similarity
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import Float, bindparam, cast, func, literal_column, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
 import uuid
 
-from app.db.models import Book, BookEmbedding
+from app.db.embedding_index import EmbeddingIndex, embedding_index
+from app.db.models import Book, BookEmbedding, PGVector, unpack_embedding
 from app.core.config import settings
+from app.core.metrics import timed
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -18,13 +23,97 @@ logger = logging.getLogger(__name__)
 class VectorStore:
     """
     A class for storing and searching embeddings.
-    Uses PostgreSQL to store the embeddings and provides methods for similarity search.
+    Uses PostgreSQL to store the embeddings and keeps a resident in-memory
+    index of them for similarity search. With VECTOR_STORAGE set to
+    'pgvector', similarity search runs inside PostgreSQL instead.
     """
     
+    # Optional pgvector copy of BookEmbedding.embedding, see migration 0004
+    embedding_vector = literal_column("book_embeddings.embedding_vector", PGVector())
+    
+    # Whether each database has that column, checked once per database URL
+    _vector_columns: Dict[str, bool] = {}
+    
+    @staticmethod
+    async def has_vector_column(db: AsyncSession) -> bool:
+        """Whether the database is PostgreSQL with the pgvector copy of the embeddings."""
+        bind = db.get_bind()
+        if bind.dialect.name != "postgresql":
+            return False
+        
+        key = str(bind.url)
+        if key not in VectorStore._vector_columns:
+            VectorStore._vector_columns[key] = await db.scalar(text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'book_embeddings' AND column_name = 'embedding_vector'"
+            )) is not None
+        return VectorStore._vector_columns[key]
+    
+    @staticmethod
+    def uses_pgvector(db: AsyncSession) -> bool:
+        """Whether similarity search runs in PostgreSQL rather than the resident index."""
+        return settings.VECTOR_STORAGE == "pgvector" and db.get_bind().dialect.name == "postgresql"
+    
+    @staticmethod
+    async def _get_index(db: AsyncSession) -> EmbeddingIndex:
+        """
+        Get the process-wide embedding index, loading it on first use.
+        
+        Args:
+            db: Database session
+            
+        Returns:
+            The loaded embedding index
+        """
+        await embedding_index.ensure_loaded(lambda index: VectorStore._load_index(db, index))
+        return embedding_index
+    
+    @staticmethod
+    async def _load_index(db: AsyncSession, index: EmbeddingIndex) -> None:
+        """
+        Populate the index from its on-disk snapshot or from the database.
+        
+        Args:
+            db: Database session
+            index: The index to populate
+        """
+        # Select only the needed columns instead of hydrating ORM objects,
+        # and only vectors produced by the current embedding model
+        columns = (BookEmbedding.book_id, BookEmbedding.embedding, BookEmbedding.embedding_dtype, BookEmbedding.updated_at)
+        current_model = BookEmbedding.model == settings.EMBEDDING_MODEL
+        
+        # Snapshot files can be large, so they are read and written off the event loop
+        if settings.VECTOR_INDEX_PATH and await asyncio.to_thread(index.restore, settings.VECTOR_INDEX_PATH):
+            # Catch up on embeddings written since the snapshot was taken
+            query = select(*columns).where(current_model)
+            if index.synced_at:
+                query = query.where(BookEmbedding.updated_at >= index.synced_at)
+            rows = (await db.execute(query)).all()
+            for book_id, embedding, dtype, updated_at in rows:
+                index.upsert(book_id, unpack_embedding(embedding, dtype))
+                if updated_at and (not index.synced_at or updated_at > index.synced_at):
+                    index.synced_at = updated_at
+            
+            count = await db.scalar(select(func.count(BookEmbedding.id)).where(current_model))
+            if count == len(index):
+                index.loaded = True
+                if rows:
+                    await asyncio.to_thread(index.save, settings.VECTOR_INDEX_PATH)
+                return
+            
+            logger.warning("Index snapshot does not match the database, rebuilding")
+        
+        rows = (await db.execute(select(*columns).where(current_model))).all()
+        index.load([row[0] for row in rows], [unpack_embedding(row[1], row[2]) for row in rows])
+        index.synced_at = max((row[3] for row in rows if row[3]), default=None)
+        
+        if settings.VECTOR_INDEX_PATH:
+            await asyncio.to_thread(index.save, settings.VECTOR_INDEX_PATH)
+    
     @staticmethod
     async def find_similar_books(
-        db: Session,
-        query_embedding: List[float], 
+        db: AsyncSession,
+        query_embedding: np.ndarray, 
         n: int = settings.NUM_SIMILAR_BOOKS,
         exclude_book_ids: Optional[List[str]] = None
     ) -> List[Dict[str, Any]]:
@@ -40,60 +129,199 @@ class VectorStore:
         Returns:
             List of book objects with similarity scores
         """
-        # Get all book embeddings
-        book_embeddings = db.query(BookEmbedding).all()
+        results = await VectorStore.find_similar_books_many(
+            db, [query_embedding], n=n, exclude_book_ids=[exclude_book_ids]
+        )
+        return results[0]
+    
+    @staticmethod
+    @timed("similar_books")
+    async def find_similar_books_many(
+        db: AsyncSession,
+        query_embeddings: List[np.ndarray],
+        n: int = settings.NUM_SIMILAR_BOOKS,
+        exclude_book_ids: Optional[List[Optional[List[str]]]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Find similar books for several query embeddings at once.
+        
+        Args:
+            db: Database session
+            query_embeddings: The embedding vectors to compare against
+            n: Number of similar books to return per query
+            exclude_book_ids: Per-query lists of book IDs to exclude from results
+        
+        Returns:
+            One list of book objects with similarity scores per query
+        """
+        if VectorStore.uses_pgvector(db):
+            # Rank inside PostgreSQL with the vector index, one top-k query per embedding
+            exclude_book_ids = exclude_book_ids or [None] * len(query_embeddings)
+            top_similar = [
+                await VectorStore._pgvector_search(db, query_embedding, n, excluded)
+                for query_embedding, excluded in zip(query_embeddings, exclude_book_ids)
+            ]
+        else:
+            index = await VectorStore._get_index(db)
+            
+            if len(index) == 0:
+                logger.warning("No embeddings found in the database")
+                return [[] for _ in query_embeddings]
+            
+            # Rank the catalog for every query with one matrix-matrix product
+            top_similar = index.search_many(query_embeddings, n, exclude_book_ids=exclude_book_ids)
+        
+        book_ids = {book_id for ranked in top_similar for book_id, _ in ranked}
+        if not book_ids:
+            return [[] for _ in query_embeddings]
         
-        if not book_embeddings:
-            logger.warning("No embeddings found in the database")
-            return []
+        # Fetch full book details for all results in one query
+        books = (await db.scalars(
+            select(Book).where(Book.id.in_([uuid.UUID(book_id) for book_id in book_ids]))
+        )).all()
+        books_by_id = {str(book.id): book.to_dict() for book in books}
+        
+        # Add similarity scores, keeping the similarity order
+        return [
+            [
+                {**books_by_id[book_id], "similarity_score": similarity}
+                for book_id, similarity in ranked
+                if book_id in books_by_id
+            ]
+            for ranked in top_similar
+        ]
+    
+    @staticmethod
+    def pgvector_query(
+        query_embedding: np.ndarray,
+        n: int,
+        exclude_book_ids: Optional[List[str]] = None
+    ) -> Select:
+        """
+        Build the server-side top-k query for the pgvector storage mode.
+        
+        Args:
+            query_embedding: The embedding vector to compare against
+            n: Number of results
+            exclude_book_ids: Book IDs to exclude from results
+            
+        Returns:
+            A select of (book_id, cosine similarity) rows, most similar first
+        """
+        distance = VectorStore.embedding_vector.op("<=>", return_type=Float)(
+            cast(bindparam("query_embedding", query_embedding, type_=PGVector()), PGVector())
+        )
+        query = (
+            select(BookEmbedding.book_id, (1 - distance).label("similarity"))
+            .where(
+                BookEmbedding.model == settings.EMBEDDING_MODEL,
+                VectorStore.embedding_vector.isnot(None)
+            )
+            .order_by(distance)
+            .limit(n)
+        )
         
-        # Filter out excluded books if provided
         if exclude_book_ids:
-            # Convert string IDs to UUID objects
-            exclude_uuids = [uuid.UUID(id) for id in exclude_book_ids]
-            book_embeddings = [e for e in book_embeddings if e.book_id not in exclude_uuids]
-        
-        # Extract embedding vectors
-        embedding_vectors = np.array([e.embedding for e in book_embeddings])
-        
-        # Compute cosine similarity
-        query_embedding_np = np.array(query_embedding).reshape(1, -1)
-        similarities = cosine_similarity(query_embedding_np, embedding_vectors).flatten()
-        
-        # Sort by similarity score
-        book_similarities = [(e, float(sim)) for e, sim in zip(book_embeddings, similarities)]
-        book_similarities.sort(key=lambda x: x[1], reverse=True)
-        
-        # Get top n similar books
-        top_similar = book_similarities[:n]
-        
-        # Get full book details for each similar book
-        result = []
-        for embedding_doc, similarity in top_similar:
-            book = db.query(Book).filter(Book.id == embedding_doc.book_id).first()
-            
-            if book:
-                # Add similarity score to book object
-                book_dict = {
-                    "id": str(book.id),
-                    "title": book.title,
-                    "author": book.author,
-                    "isbn": book.isbn,
-                    "genre": book.genre,
-                    "publicationYear": book.publication_year,
-                    "publisher": book.publisher,
-                    "description": book.description,
-                    "copies": book.copies,
-                    "copiesAvailable": book.copies_available,
-                    "coverImage": book.cover_image,
-                    "similarity_score": similarity
-                }
-                result.append(book_dict)
-        
-        return result
+            query = query.where(BookEmbedding.book_id.notin_([uuid.UUID(str(book_id)) for book_id in exclude_book_ids]))
+        
+        return query
+    
+    @staticmethod
+    async def _pgvector_search(
+        db: AsyncSession,
+        query_embedding: np.ndarray,
+        n: int,
+        exclude_book_ids: Optional[List[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """Run the pgvector top-k query and return (book_id, similarity) pairs."""
+        # Widen the approximate search so the exclusions do not leave it short of n results
+        candidates = n + len(exclude_book_ids or [])
+        await db.execute(
+            text("SELECT set_config('hnsw.ef_search', :ef_search, true), set_config('ivfflat.probes', :probes, true)"),
+            {"ef_search": str(max(settings.PGVECTOR_EF_SEARCH, candidates)), "probes": str(settings.PGVECTOR_PROBES)}
+        )
+        
+        rows = (await db.execute(VectorStore.pgvector_query(query_embedding, n, exclude_book_ids))).all()
+        return [(str(book_id), float(similarity)) for book_id, similarity in rows]
+    
+    @staticmethod
+    async def write_vectors(db: AsyncSession, embeddings: Dict[str, np.ndarray]) -> None:
+        """
+        Copy embeddings into the pgvector column, wherever the column exists.
+        
+        The copy is kept whatever VECTOR_STORAGE is set to, so switching to
+        pgvector later finds every embedding. The caller commits.
+        
+        Args:
+            db: Database session
+            embeddings: Mapping of book ID to embedding
+        """
+        if not embeddings or not await VectorStore.has_vector_column(db):
+            return
+        
+        statement = text(
+            "UPDATE book_embeddings SET embedding_vector = CAST(:vector AS vector) WHERE book_id = :book_id"
+        ).bindparams(
+            bindparam("vector", type_=PGVector()),
+            bindparam("book_id", type_=BookEmbedding.book_id.type)
+        )
+        await db.execute(statement, [
+            {"book_id": uuid.UUID(str(book_id)), "vector": embedding}
+            for book_id, embedding in embeddings.items()
+        ])
     
     @staticmethod
-    def get_book_embedding(db: Session, book_id: str) -> Optional[List[float]]:
+    async def backfill_vectors(db: AsyncSession, batch_size: int = 1000) -> int:
+        """
+        Fill the pgvector column for embeddings saved without it.
+        
+        Rows of the current model with a NULL embedding_vector, e.g. saved
+        before the column was kept in every storage mode, are copied in
+        batches. Vectors of another width than EMBEDDING_DIMENSIONS cannot
+        be stored in the column and are left for re-embedding.
+        
+        Args:
+            db: Database session
+            batch_size: Rows copied per transaction
+            
+        Returns:
+            Number of rows filled
+        """
+        if not await VectorStore.has_vector_column(db):
+            return 0
+        
+        filled = 0
+        last_book_id = None
+        while True:
+            query = (
+                select(BookEmbedding.book_id, BookEmbedding.embedding, BookEmbedding.embedding_dtype)
+                .where(BookEmbedding.model == settings.EMBEDDING_MODEL, VectorStore.embedding_vector.is_(None))
+                .order_by(BookEmbedding.book_id)
+                .limit(batch_size)
+            )
+            if last_book_id is not None:
+                query = query.where(BookEmbedding.book_id > last_book_id)
+            rows = (await db.execute(query)).all()
+            if not rows:
+                break
+            
+            last_book_id = rows[-1][0]
+            vectors = {
+                str(book_id): unpack_embedding(embedding, dtype)
+                for book_id, embedding, dtype in rows
+                if embedding and len(unpack_embedding(embedding, dtype)) == settings.EMBEDDING_DIMENSIONS
+            }
+            await VectorStore.write_vectors(db, vectors)
+            await db.commit()
+            filled += len(vectors)
+        
+        if filled:
+            logger.info(f"Filled the pgvector column for {filled} embeddings")
+        return filled
+    
+    @staticmethod
+    @timed("book_embeddings")
+    async def get_book_embedding(db: AsyncSession, book_id: str) -> Optional[np.ndarray]:
         """
         Get the embedding for a specific book.
         
@@ -102,14 +330,19 @@ class VectorStore:
             book_id: The ID of the book
             
         Returns:
-            The embedding vector or None if not found
+            The embedding vector, a read-only view of the stored bytes, or None if not found
         """
         try:
             book_uuid = uuid.UUID(book_id)
-            embedding_doc = db.query(BookEmbedding).filter(BookEmbedding.book_id == book_uuid).first()
+            embedding_doc = await db.scalar(
+                select(BookEmbedding).where(
+                    BookEmbedding.book_id == book_uuid,
+                    BookEmbedding.model == settings.EMBEDDING_MODEL
+                )
+            )
             
             if embedding_doc and embedding_doc.embedding:
-                return embedding_doc.embedding
+                return embedding_doc.vector
             
             return None
         except ValueError:
@@ -117,7 +350,47 @@ class VectorStore:
             return None
     
     @staticmethod
-    def save_embedding(db: Session, book_id: str, embedding: List[float]) -> bool:
+    @timed("book_embeddings")
+    async def get_book_embeddings(db: AsyncSession, book_ids: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Get the embeddings for several books in one query.
+        
+        Args:
+            db: Database session
+            book_ids: The IDs of the books
+            
+        Returns:
+            Mapping of book ID to embedding for the books that have one
+        """
+        book_uuids = []
+        for book_id in book_ids:
+            try:
+                book_uuids.append(uuid.UUID(book_id))
+            except ValueError:
+                logger.error(f"Invalid UUID format for book_id: {book_id}")
+        
+        if not book_uuids:
+            return {}
+        
+        rows = (await db.execute(
+            select(BookEmbedding.book_id, BookEmbedding.embedding, BookEmbedding.embedding_dtype)
+            .where(
+                BookEmbedding.book_id.in_(book_uuids),
+                BookEmbedding.model == settings.EMBEDDING_MODEL
+            )
+        )).all()
+        return {
+            str(book_id): unpack_embedding(embedding, dtype)
+            for book_id, embedding, dtype in rows if embedding
+        }
+    
+    @staticmethod
+    async def save_embedding(
+        db: AsyncSession,
+        book_id: str,
+        embedding: np.ndarray,
+        text_hash: Optional[str] = None
+    ) -> bool:
         """
         Save or update an embedding for a book.
         
@@ -125,6 +398,7 @@ class VectorStore:
             db: Database session
             book_id: The ID of the book
             embedding: The embedding vector
+            text_hash: Hash of the book text that was embedded
             
         Returns:
             True if successful, False otherwise
@@ -133,29 +407,40 @@ class VectorStore:
             book_uuid = uuid.UUID(book_id)
             
             # Check if embedding already exists
-            existing_embedding = db.query(BookEmbedding).filter(BookEmbedding.book_id == book_uuid).first()
+            existing_embedding = await db.scalar(select(BookEmbedding).where(BookEmbedding.book_id == book_uuid))
             
             if existing_embedding:
                 # Update existing embedding
-                existing_embedding.embedding = embedding
-                existing_embedding.updated_at = db.func.now()
+                existing_embedding.vector = embedding
+                existing_embedding.model = settings.EMBEDDING_MODEL
+                existing_embedding.text_hash = text_hash
+                existing_embedding.updated_at = datetime.utcnow()
             else:
                 # Create new embedding
                 new_embedding = BookEmbedding(
                     book_id=book_uuid,
-                    embedding=embedding
+                    model=settings.EMBEDDING_MODEL,
+                    text_hash=text_hash
                 )
+                new_embedding.vector = embedding
                 db.add(new_embedding)
             
-            db.commit()
+            await db.flush()
+            await VectorStore.write_vectors(db, {book_id: embedding})
+            await db.commit()
+            
+            # Keep the resident index in sync once it has been loaded
+            if embedding_index.loaded:
+                embedding_index.upsert(book_id, embedding)
+            
             return True
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Error saving embedding for book {book_id}: {e}")
             return False
     
     @staticmethod
-    def combine_embeddings(embeddings: List[List[float]]) -> List[float]:
+    def combine_embeddings(embeddings: List[np.ndarray]) -> np.ndarray:
         """
         Combine multiple embeddings by averaging them.
         
@@ -168,8 +453,5 @@ class VectorStore:
         if not embeddings:
             raise ValueError("No embeddings provided to combine")
         
-        # Convert to numpy array and compute mean
-        embeddings_np = np.array(embeddings)
-        combined = np.mean(embeddings_np, axis=0).tolist()
-        
-        return combined
\ No newline at end of file
+        # Average in float32, whatever width the embeddings were stored with
+        return np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
\ No newline at end of file
@@ -5,10 +5,16 @@ Main FastAPI application
 import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from app.api.router import api_router
 from app.core.config import settings
-from app.db.database import Base, engine
+from app.core.metrics import MetricsMiddleware, render_metrics
+from app.core.profiling import ProfilingMiddleware
+from app.core.passwords import password_hasher
+from app.db.database import Base, async_engine, engine
+from app.db.embedding_index import embedding_index
+from app.db.pool import pool_stats, render_pool_metrics
 
 # Configure logging
 logging.basicConfig(
@@ -32,19 +38,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profile requests on demand and capture slow ones, when PROFILING_ENABLED is set
+app.add_middleware(ProfilingMiddleware)
+
+# Record request latency and, if enabled, add Server-Timing headers
+app.add_middleware(MetricsMiddleware)
+
 # Register API routes
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 # Event handlers for startup and shutdown
 @app.on_event("startup")
 async def startup_event():
-    """Create tables on startup if they don't exist."""
+    """Create tables on startup if requested, and fill in pgvector copies when that storage mode is used."""
     logger.info("Starting up...")
-    # Create tables if they don't exist
-    Base.metadata.create_all(bind=engine)
-    logger.info("Database tables created/verified")
+    if settings.AUTO_CREATE_TABLES:
+        # Development only: creates missing tables but never alters existing ones
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        logger.info("Database tables created/verified")
+    if settings.VECTOR_STORAGE == "pgvector":
+        from app.db.database import AsyncSessionLocal
+        from app.db.vector_store import VectorStore
 
-# No shutdown handler needed for SQLAlchemy as it's handled automatically
+        # Embeddings saved without the pgvector copy would be missing from every search
+        async with AsyncSessionLocal() as db:
+            await VectorStore.backfill_vectors(db)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Persist the embedding index, close pooled database connections and stop worker threads."""
+    if settings.VECTOR_INDEX_PATH and embedding_index.loaded:
+        embedding_index.save(settings.VECTOR_INDEX_PATH)
+    await async_engine.dispose()
+    password_hasher.shutdown()
 
 @app.get("/")
 async def root():
@@ -57,4 +84,27 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/health/pool")
+async def pool_health():
+    """Connection pool usage, for sizing pools and worker counts."""
+    return {
+        "api": pool_stats(async_engine.sync_engine),
+        "sync": pool_stats(engine),
+    }
+
+@app.get("/health/password-hashing")
+async def password_hashing_health():
+    """Password hashing pool usage: hashes waiting for a worker, in progress and done."""
+    return password_hasher.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency histograms, connection pool usage and password hashing queue depth, in the Prometheus text format."""
+    content = (
+        render_metrics()
+        + render_pool_metrics({"api": async_engine.sync_engine, "sync": engine})
+        + password_hasher.render()
+    )
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
@@ -3,7 +3,7 @@ Models for book data
 """
 
 from typing import Optional, List
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
 
 class BookBase(BaseModel):
@@ -81,4 +81,18 @@ class BorrowedBookWithDetails(BorrowedBook):
 class Recommendation(BaseModel):
     """Book recommendation"""
     recommendations: List[BookWithRecommendationReason] = Field(..., description="Recommended books")
-    explanation: str = Field(..., description="Explanation for the recommendations")
\ No newline at end of file
+    explanation: str = Field(..., description="Explanation for the recommendations")
+    generated_at: Optional[datetime] = Field(None, description="When precomputed recommendations were generated")
+
+class BulkRecommendationRequest(BaseModel):
+    """Request for recommendations for a group of students"""
+    user_ids: Optional[List[str]] = Field(None, description="IDs of the students to recommend for")
+    department: Optional[str] = Field(None, description="Recommend for every student in this department")
+    num_recommendations: int = Field(3, description="Number of recommendations per student", ge=1, le=10)
+    
+    @model_validator(mode="after")
+    def check_target(self):
+        """Exactly one of user_ids and department must be given"""
+        if (self.user_ids is None) == (self.department is None):
+            raise ValueError("Provide either user_ids or department")
+        return self
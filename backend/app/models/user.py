@@ -51,6 +51,11 @@ class Token(BaseModel):
     access_token: str = Field(..., description="JWT access token")
     token_type: str = Field("bearer", description="Token type")
 
+class Principal(BaseModel):
+    """The identity and role a request is authorized as"""
+    id: str = Field(..., description="User ID")
+    role: str = Field(..., description="User role (student or librarian)")
+
 class TokenPayload(BaseModel):
     """Model for JWT token payload"""
     sub: str = Field(..., description="Subject (user ID)")
@@ -0,0 +1,140 @@
+"""
+Content-addressed cache for text embeddings
+"""
+
+import hashlib
+import logging
+import unicodedata
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.db.models import EmbeddingCacheEntry, pack_embedding, unpack_embedding
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by (model, normalized-text hash).
+
+    An in-process LRU sits in front of the persistent embedding_cache
+    table, so identical text is only ever sent to the API once per model.
+    """
+
+    # Maximum number of hashes per IN (...) lookup
+    LOOKUP_CHUNK_SIZE = 500
+
+    def __init__(self, maxsize: int):
+        # Vectors are held as read-only float32 arrays, shared with callers without copying
+        self.memory = LRUCache(maxsize)
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """
+        Hash text after normalizing unicode and whitespace.
+
+        Args:
+            text: The text to hash
+
+        Returns:
+            Hex SHA-256 digest
+        """
+        normalized = " ".join(unicodedata.normalize("NFC", text).split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    async def get_many(self, db: Optional[AsyncSession], model: str, text_hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up cached embeddings.
+
+        Args:
+            db: Database session, or None to use only the in-process tier
+            model: Embedding model name
+            text_hashes: Hashes of the texts to look up
+
+        Returns:
+            Mapping of text hash to embedding for the hashes that were found
+        """
+        found = {}
+        missing = []
+        for text_hash in set(text_hashes):
+            vector = self.memory.get((model, text_hash))
+            if vector is not None:
+                found[text_hash] = vector
+            else:
+                missing.append(text_hash)
+
+        if db is None or not missing:
+            return found
+
+        for start in range(0, len(missing), self.LOOKUP_CHUNK_SIZE):
+            rows = (await db.execute(
+                select(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.embedding, EmbeddingCacheEntry.embedding_dtype)
+                .where(
+                    EmbeddingCacheEntry.model == model,
+                    EmbeddingCacheEntry.text_hash.in_(missing[start:start + self.LOOKUP_CHUNK_SIZE])
+                )
+            )).all()
+            for text_hash, embedding, dtype in rows:
+                vector = self._freeze(unpack_embedding(embedding, dtype))
+                self.memory.set((model, text_hash), vector)
+                found[text_hash] = vector
+
+        return found
+
+    async def put_many(self, db: Optional[AsyncSession], model: str, embeddings: Dict[str, np.ndarray]) -> None:
+        """
+        Store embeddings in both tiers.
+
+        Rows already cached, including ones written concurrently by another
+        worker, are left as they are. The caller commits.
+
+        Args:
+            db: Database session, or None to use only the in-process tier
+            model: Embedding model name
+            embeddings: Mapping of text hash to embedding
+        """
+        for text_hash, embedding in embeddings.items():
+            self.memory.set((model, text_hash), self._freeze(embedding))
+
+        if db is None or not embeddings:
+            return
+
+        rows = []
+        for text_hash, embedding in embeddings.items():
+            packed, dtype = pack_embedding(embedding)
+            rows.append({
+                "id": uuid.uuid4(),
+                "model": model,
+                "text_hash": text_hash,
+                "embedding": packed,
+                "embedding_dtype": dtype,
+                "created_at": datetime.utcnow(),
+            })
+
+        # Another writer's copy of an entry is as good as ours, so conflicts are skipped row by row
+        insert = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+        await db.execute(
+            insert(EmbeddingCacheEntry).on_conflict_do_nothing(index_elements=["model", "text_hash"]),
+            rows
+        )
+
+    @staticmethod
+    def _freeze(embedding: np.ndarray) -> np.ndarray:
+        """A read-only float32 array, copied only if the input is not one already."""
+        if isinstance(embedding, np.ndarray) and embedding.dtype == np.float32 and not embedding.flags.writeable:
+            return embedding
+        vector = np.array(embedding, dtype=np.float32)
+        vector.flags.writeable = False
+        return vector
+
+# Process-wide cache shared by all EmbeddingService instances
+embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_SIZE)
@@ -2,11 +2,18 @@
 Service for creating and managing text embeddings
 """
 
+import asyncio
+import base64
 import logging
+import random
 from typing import List, Dict, Any, Optional
-from openai import OpenAI
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
+from app.core.metrics import timed
+from app.services.embedding_cache import embedding_cache
+from app.services.openai_client import openai_client
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -15,57 +22,248 @@ class EmbeddingService:
     """Service for generating and managing text embeddings"""
     
     def __init__(self):
-        self.openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
         self.model = settings.EMBEDDING_MODEL
     
-    async def create_embedding(self, text: str) -> Optional[List[float]]:
+    @staticmethod
+    def build_book_text(book: Dict[str, Any]) -> str:
+        """
+        Build the text that represents a book for embedding.
+        
+        Args:
+            book: Book data dictionary
+            
+        Returns:
+            Text describing the book
+        """
+        book_text = f"""
+        Title: {book.get('title', '')}
+        Author: {book.get('author', '')}
+        Genre: {book.get('genre', '')}
+        Publication Year: {book.get('publicationYear', '')}
+        Description: {book.get('description', '')}
+        """
+        
+        return book_text.strip()
+    
+    @staticmethod
+    def book_text_hash(book: Dict[str, Any]) -> str:
+        """
+        Hash of the text embedded for a book; changes only when that text does.
+        
+        Args:
+            book: Book data dictionary
+            
+        Returns:
+            Hex digest of the normalized book text
+        """
+        return embedding_cache.text_hash(EmbeddingService.build_book_text(book))
+    
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """Roughly estimate the token count of a text (about 4 characters per token)."""
+        return len(text) // 4 + 1
+    
+    def _pack_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Group text positions into batches bounded by token and input count.
+        
+        Args:
+            texts: The texts to embed
+            
+        Returns:
+            List of batches, each a list of positions into texts
+        """
+        batches = []
+        batch, batch_tokens = [], 0
+        
+        for i, text in enumerate(texts):
+            tokens = self._estimate_tokens(text)
+            if batch and (
+                batch_tokens + tokens > settings.EMBEDDING_BATCH_MAX_TOKENS
+                or len(batch) >= settings.EMBEDDING_BATCH_MAX_INPUTS
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        
+        if batch:
+            batches.append(batch)
+        
+        return batches
+    
+    @staticmethod
+    def _decode_embedding(embedding: Any) -> np.ndarray:
+        """
+        Decode an embedding from the API response.
+        
+        Embeddings are requested as base64-encoded little-endian float32, a
+        quarter of the size of the JSON float list, and decoded without
+        building Python floats. Servers that ignore the encoding format send a list.
+        """
+        if isinstance(embedding, str):
+            return np.frombuffer(base64.b64decode(embedding), dtype="<f4")
+        return np.asarray(embedding, dtype=np.float32)
+    
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        """
+        Seconds to wait before retrying a failed request.
+        
+        Rate-limited requests wait as long as the API's Retry-After header
+        asks; other failures back off exponentially. Jitter keeps concurrent
+        workers from retrying in lockstep.
+        
+        Args:
+            error: The exception the request raised
+            attempt: Number of the attempt that failed, from 0
+            
+        Returns:
+            Delay in seconds
+        """
+        delay = settings.EMBEDDING_RETRY_BACKOFF_SECONDS * 2 ** attempt
+        
+        response = getattr(error, "response", None)
+        if getattr(error, "status_code", None) == 429 and response is not None:
+            try:
+                if "retry-after-ms" in response.headers:
+                    delay = float(response.headers["retry-after-ms"]) / 1000
+                elif "retry-after" in response.headers:
+                    delay = float(response.headers["retry-after"])
+            except ValueError:
+                pass
+        
+        return delay * random.uniform(1.0, 1.25)
+    
+    @timed("embedding_api")
+    async def _embed_batch(self, texts: List[str]) -> Optional[List[np.ndarray]]:
+        """
+        Embed one batch of texts, retrying with exponential backoff.
+        
+        Args:
+            texts: The texts to embed in a single request
+            
+        Returns:
+            Embeddings in input order, or None if every attempt failed
+        """
+        for attempt in range(settings.EMBEDDING_MAX_RETRIES + 1):
+            try:
+                async with openai_client() as client:
+                    # Retries are handled here, with Retry-After aware backoff
+                    response = await client.with_options(max_retries=0).embeddings.create(
+                        input=texts,
+                        model=self.model,
+                        encoding_format="base64",
+                        timeout=settings.EMBEDDING_TIMEOUT_SECONDS
+                    )
+                
+                # The API tags each embedding with its input position
+                data = sorted(response.data, key=lambda item: item.index)
+                return [self._decode_embedding(item.embedding) for item in data]
+            except Exception as e:
+                if attempt == settings.EMBEDDING_MAX_RETRIES:
+                    logger.error(f"Error creating embeddings for a batch of {len(texts)} texts: {e}")
+                    return None
+                
+                delay = self._retry_delay(e, attempt)
+                logger.warning(f"Embedding batch failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
+    @timed("create_embeddings")
+    async def create_embeddings_batch(
+        self,
+        texts: List[str],
+        db: Optional[AsyncSession] = None
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Create embeddings for many texts using as few API calls as possible.
+        
+        Texts already embedded with the current model are served from the
+        embedding cache; only the remaining distinct texts are sent to the API.
+        
+        Args:
+            texts: The texts to embed
+            db: Optional database session for the persistent cache tier
+            
+        Returns:
+            Embeddings aligned with texts; None where a batch could not be embedded
+        """
+        text_hashes = [embedding_cache.text_hash(text) for text in texts]
+        embeddings = await embedding_cache.get_many(db, self.model, text_hashes)
+        
+        # Embed each distinct uncached text once
+        missing = {}
+        for text, text_hash in zip(texts, text_hashes):
+            if text_hash not in embeddings:
+                missing.setdefault(text_hash, text)
+        
+        if missing:
+            missing_hashes = list(missing)
+            missing_texts = [missing[text_hash] for text_hash in missing_hashes]
+            created = {}
+            
+            for batch in self._pack_batches(missing_texts):
+                batch_embeddings = await self._embed_batch([missing_texts[i] for i in batch])
+                if batch_embeddings:
+                    for i, embedding in zip(batch, batch_embeddings):
+                        created[missing_hashes[i]] = embedding
+            
+            await embedding_cache.put_many(db, self.model, created)
+            embeddings.update(created)
+        
+        return [embeddings.get(text_hash) for text_hash in text_hashes]
+    
+    async def create_embedding(self, text: str, db: Optional[AsyncSession] = None) -> Optional[np.ndarray]:
         """
         Create an embedding for the given text.
         
         Args:
             text: The text to embed
+            db: Optional database session for the persistent cache tier
             
         Returns:
             The embedding vector or None if an error occurs
         """
-        try:
-            response = self.openai_client.embeddings.create(
-                input=text,
-                model=self.model
-            )
-            
-            # Extract the embedding from the response
-            embedding = response.data[0].embedding
-            return embedding
-        except Exception as e:
-            logger.error(f"Error creating embedding: {e}")
-            return None
+        return (await self.create_embeddings_batch([text], db=db))[0]
     
-    async def create_embedding_for_book(self, book: Dict[str, Any]) -> Optional[List[float]]:
+    async def create_embedding_for_book(
+        self,
+        book: Dict[str, Any],
+        db: Optional[AsyncSession] = None
+    ) -> Optional[np.ndarray]:
         """
         Create an embedding for a book.
         
         Args:
             book: Book data dictionary
+            db: Optional database session for the persistent cache tier
             
         Returns:
             The embedding vector or None if an error occurs
         """
-        # Create a rich text representation of the book
-        book_text = f"""
-        Title: {book.get('title', '')}
-        Author: {book.get('author', '')}
-        Genre: {book.get('genre', '')}
-        Publication Year: {book.get('publicationYear', '')}
-        Description: {book.get('description', '')}
+        return (await self.create_embeddings_for_books([book], db=db))[0]
+    
+    async def create_embeddings_for_books(
+        self,
+        books: List[Dict[str, Any]],
+        db: Optional[AsyncSession] = None
+    ) -> List[Optional[np.ndarray]]:
         """
+        Create embeddings for several books in batched API calls.
         
-        return await self.create_embedding(book_text.strip())
+        Args:
+            books: Book data dictionaries
+            db: Optional database session for the persistent cache tier
+            
+        Returns:
+            Embeddings aligned with books; None where embedding failed
+        """
+        return await self.create_embeddings_batch([self.build_book_text(book) for book in books], db=db)
     
     async def create_embedding_for_user_preferences(
         self, 
         reading_history: List[Dict[str, Any]]
-    ) -> Optional[List[float]]:
+    ) -> Optional[np.ndarray]:
         """
         Create an embedding representing a user's reading preferences.
         
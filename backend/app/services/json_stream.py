@@ -0,0 +1,96 @@
+"""
+Incremental parsing of JSON produced by streaming LLM responses
+"""
+
+import json
+import logging
+import re
+from typing import Any, List
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class JSONArrayStreamParser:
+    """
+    Extract the items of one array inside a JSON document as it streams in.
+
+    Text is fed chunk by chunk; each object in the array under the given key
+    is returned as soon as its closing brace arrives, long before the whole
+    document is complete. Every character is scanned once.
+    """
+
+    def __init__(self, key: str):
+        """
+        Args:
+            key: Name of the top-level key holding the array
+        """
+        self._key_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._buffer = ""
+        self._position = 0
+        self._in_array = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item_start = None
+
+    @property
+    def text(self) -> str:
+        """All text fed so far."""
+        return self._buffer
+
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        Add streamed text.
+
+        Args:
+            chunk: The next piece of the document
+
+        Returns:
+            Array items completed by this chunk, in order
+        """
+        self._buffer += chunk
+        items = []
+
+        if self._finished:
+            return items
+
+        if not self._in_array:
+            match = self._key_pattern.search(self._buffer)
+            if match is None:
+                return items
+            self._in_array = True
+            self._position = match.end()
+
+        buffer = self._buffer
+        for position in range(self._position, len(buffer)):
+            char = buffer[position]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._item_start = position
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the array itself
+                    self._finished = True
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(json.loads(buffer[self._item_start:position + 1]))
+                    except json.JSONDecodeError:
+                        logger.warning("Skipping malformed item in streamed JSON array")
+                    self._item_start = None
+
+        self._position = len(buffer)
+        return items
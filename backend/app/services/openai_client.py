@@ -0,0 +1,56 @@
+"""
+Shared asynchronous OpenAI client with bounded concurrency
+"""
+
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Tuple
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# One client and semaphore per event loop, since both are bound to the loop they are used on
+_loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[AsyncOpenAI, asyncio.Semaphore]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+def _get_loop_state() -> Tuple["AsyncOpenAI", asyncio.Semaphore]:
+    """Get the client and semaphore for the running event loop, creating them on first use."""
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+
+    if state is None:
+        # The SDK takes about half a second to import, so workers load it on first use rather than at startup
+        from openai import AsyncOpenAI
+
+        client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL
+        )
+        state = (client, asyncio.Semaphore(settings.OPENAI_MAX_CONCURRENCY))
+        _loop_state[loop] = state
+
+    return state
+
+@asynccontextmanager
+async def openai_client() -> AsyncIterator["AsyncOpenAI"]:
+    """
+    Borrow the shared OpenAI client.
+
+    Waits for one of the OPENAI_MAX_CONCURRENCY slots so a burst of
+    requests cannot open an unbounded number of concurrent API calls.
+
+    Yields:
+        The AsyncOpenAI client
+    """
+    client, semaphore = _get_loop_state()
+
+    async with semaphore:
+        yield client
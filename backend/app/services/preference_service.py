@@ -0,0 +1,364 @@
+"""
+Reading preference profiles: a recency-weighted centroid and taste clusters per user
+"""
+
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.metrics import timed
+from app.db.models import Book, BorrowedBook, UserPreferenceProfile
+from app.db.vector_store import VectorStore
+from app.services.embedding_service import EmbeddingService
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+class PreferenceProfile:
+    """
+    A reader's tastes as recency-weighted sums of the embeddings of the books they borrowed.
+
+    Every borrow adds its unit embedding to the centroid and to the nearest
+    taste cluster, or starts a new cluster when no cluster is similar enough
+    and fewer than PREFERENCE_MAX_CLUSTERS exist. Weights halve every
+    PREFERENCE_HALF_LIFE_DAYS of borrow date, so sums are kept decayed to the
+    latest borrow date and adding a borrow costs the same whatever the length
+    of the history; the result does not depend on the order borrows are added in.
+    """
+
+    def __init__(self, dimensions: int):
+        """
+        Args:
+            dimensions: Width of the embeddings
+        """
+        self.centroid = np.zeros(dimensions, dtype=np.float32)
+        self.weight = 0.0
+        self.clusters = np.zeros((0, dimensions), dtype=np.float32)
+        self.cluster_weights: List[float] = []
+        self.reference_date: Optional[datetime] = None
+        self.book_count = 0
+        self.borrowed_through: Optional[datetime] = None
+
+    @classmethod
+    def from_columns(cls, record: Any) -> "PreferenceProfile":
+        """Load a profile from a UserPreferenceProfile row or record."""
+        centroid = np.frombuffer(record.centroid, dtype="<f4")
+        profile = cls(len(centroid))
+        profile.centroid = centroid.copy()
+        profile.weight = record.weight
+        profile.clusters = np.frombuffer(record.clusters, dtype="<f4").reshape(-1, len(centroid)).copy()
+        profile.cluster_weights = list(record.cluster_weights)
+        profile.reference_date = record.reference_date
+        profile.book_count = record.book_count
+        profile.borrowed_through = record.borrowed_through
+        return profile
+
+    def to_columns(self) -> Dict[str, Any]:
+        """The profile as UserPreferenceProfile column values."""
+        return {
+            "model": settings.EMBEDDING_MODEL,
+            "centroid": self.centroid.astype("<f4").tobytes(),
+            "clusters": self.clusters.astype("<f4").tobytes(),
+            "cluster_weights": self.cluster_weights,
+            "weight": self.weight,
+            "reference_date": self.reference_date,
+            "book_count": self.book_count,
+            "borrowed_through": self.borrowed_through,
+            "updated_at": datetime.utcnow(),
+        }
+
+    def add(self, embedding: Optional[np.ndarray], borrow_date: datetime, created_at: Optional[datetime] = None) -> None:
+        """
+        Fold one borrow into the profile.
+
+        Args:
+            embedding: Embedding of the borrowed book, or None to only count the borrow
+            borrow_date: When the book was borrowed
+            created_at: When the borrow record was created, tracked to find later borrows
+        """
+        self.book_count += 1
+        if created_at is not None and (self.borrowed_through is None or created_at > self.borrowed_through):
+            self.borrowed_through = created_at
+        if embedding is None:
+            return
+
+        vector = _unit(np.asarray(embedding, dtype=np.float32))
+        if self.reference_date is None:
+            self.reference_date = borrow_date
+
+        age_days = (borrow_date - self.reference_date).total_seconds() / SECONDS_PER_DAY
+        if age_days >= 0:
+            # A newer borrow: decay what is there to its date
+            decay = 0.5 ** (age_days / settings.PREFERENCE_HALF_LIFE_DAYS)
+            self.centroid *= decay
+            self.weight *= decay
+            self.clusters *= decay
+            self.cluster_weights = [weight * decay for weight in self.cluster_weights]
+            self.reference_date = borrow_date
+            weight = 1.0
+        else:
+            weight = 0.5 ** (-age_days / settings.PREFERENCE_HALF_LIFE_DAYS)
+
+        self.centroid += weight * vector
+        self.weight += weight
+
+        if len(self.clusters):
+            norms = np.linalg.norm(self.clusters, axis=1)
+            similarities = (self.clusters @ vector) / np.where(norms > 0, norms, 1.0)
+            nearest = int(np.argmax(similarities))
+        if not len(self.clusters) or (
+            len(self.clusters) < settings.PREFERENCE_MAX_CLUSTERS
+            and similarities[nearest] < settings.PREFERENCE_CLUSTER_SIMILARITY
+        ):
+            self.clusters = np.vstack([self.clusters, weight * vector[np.newaxis]])
+            self.cluster_weights.append(weight)
+        else:
+            self.clusters[nearest] += weight * vector
+            self.cluster_weights[nearest] += weight
+
+    def queries(self) -> List[Tuple[np.ndarray, float]]:
+        """
+        Query vectors for similarity search.
+
+        Returns:
+            (unit vector, share of the profile weight) pairs: the centroid
+            first, then every cluster when the reader has more than one
+        """
+        queries = [(_unit(self.centroid), 1.0)]
+        if len(self.clusters) > 1 and settings.PREFERENCE_MAX_CLUSTERS > 1:
+            total = sum(self.cluster_weights) or 1.0
+            queries.extend(
+                (_unit(cluster), weight / total)
+                for cluster, weight in zip(self.clusters, self.cluster_weights)
+            )
+        return queries
+
+    @property
+    def empty(self) -> bool:
+        """Whether no borrowed book had an embedding to fold in."""
+        return self.weight == 0.0
+
+def merge_results(results: List[List[Dict[str, Any]]], shares: List[float], n: int) -> List[Dict[str, Any]]:
+    """
+    Merge the similar books found for one profile's queries.
+
+    Each cluster gets slots in proportion to its share of the profile, at
+    least one each while slots last, so a reader's smaller tastes are still
+    represented; slots left over are filled from the centroid's results.
+
+    Args:
+        results: Similar books per query, as from PreferenceProfile.queries
+        shares: Share of the profile weight per query
+        n: Number of books to return
+
+    Returns:
+        Up to n distinct books, most similar first
+    """
+    if len(results) == 1:
+        return results[0][:n]
+
+    cluster_results, cluster_shares = results[1:], shares[1:]
+    slots = [1 if i < n else 0 for i in range(len(cluster_results))]
+    remaining = n - sum(slots)
+    # Share out the remaining slots by largest remainder
+    exact = [share * remaining for share in cluster_shares]
+    slots = [slot + int(value) for slot, value in zip(slots, exact)]
+    for i in sorted(range(len(exact)), key=lambda i: int(exact[i]) - exact[i])[:n - sum(slots)]:
+        slots[i] += 1
+
+    merged: Dict[str, Dict[str, Any]] = {}
+    for books, quota in zip(cluster_results, slots):
+        taken = 0
+        for book in books:
+            if taken == quota:
+                break
+            if book["id"] not in merged:
+                merged[book["id"]] = book
+                taken += 1
+
+    leftovers = sorted((book for books in cluster_results for book in books), key=lambda book: -book["similarity_score"])
+    for book in [*results[0], *leftovers]:
+        if len(merged) >= n:
+            break
+        merged.setdefault(book["id"], book)
+
+    return sorted(merged.values(), key=lambda book: -book["similarity_score"])
+
+class PreferenceService:
+    """Service keeping users' preference profiles up to date"""
+
+    def __init__(self, embedding_service: EmbeddingService, vector_store: VectorStore):
+        self.embedding_service = embedding_service
+        self.vector_store = vector_store
+
+    @timed("preference_profiles")
+    async def get_profiles(self, db: AsyncSession, borrow_counts: Dict[str, int]) -> Dict[str, PreferenceProfile]:
+        """
+        Read users' preference profiles, folding in borrows made since they were stored.
+
+        Borrows created after a stored profile's borrowed_through are added
+        to it in memory, up to PREFERENCE_MAX_PENDING_BORROWS of them, so
+        active readers get their latest borrows without waiting for the
+        precompute job; nothing is written. Profiles further behind, whose
+        borrows were deleted or backfilled, or built with another embedding
+        model are left to refresh_profiles.
+
+        Args:
+            db: Database session
+            borrow_counts: Mapping of user ID to their current number of borrow records
+
+        Returns:
+            Mapping of user ID to profile, for users with an up to date profile
+        """
+        records = (await db.scalars(
+            select(UserPreferenceProfile)
+            .where(UserPreferenceProfile.user_id.in_([uuid.UUID(user_id) for user_id in borrow_counts]))
+            .execution_options(populate_existing=True)
+        )).all()
+
+        profiles, behind = {}, []
+        for record in records:
+            user_id = str(record.user_id)
+            pending = borrow_counts[user_id] - record.book_count
+            if record.model != settings.EMBEDDING_MODEL or not 0 <= pending <= settings.PREFERENCE_MAX_PENDING_BORROWS:
+                continue
+            profiles[user_id] = PreferenceProfile.from_columns(record)
+            if pending:
+                behind.append(record.user_id)
+
+        if behind:
+            # Every pending borrow and its book's stored embedding, without generating missing ones
+            borrowed = (await db.execute(
+                select(BorrowedBook.user_id, BorrowedBook.book_id, BorrowedBook.borrow_date, BorrowedBook.created_at)
+                .join(UserPreferenceProfile, UserPreferenceProfile.user_id == BorrowedBook.user_id)
+                .where(
+                    BorrowedBook.user_id.in_(behind),
+                    BorrowedBook.created_at > func.coalesce(UserPreferenceProfile.borrowed_through, datetime.min)
+                )
+                .order_by(BorrowedBook.created_at)
+            )).all()
+            embeddings = await self.vector_store.get_book_embeddings(db, [str(book_id) for _, book_id, _, _ in borrowed])
+
+            for user_uuid, book_id, borrow_date, created_at in borrowed:
+                profiles[str(user_uuid)].add(embeddings.get(str(book_id)), borrow_date, created_at)
+
+        # A count still off means borrows were changed some other way; the profile needs a rebuild
+        return {
+            user_id: profile for user_id, profile in profiles.items()
+            if profile.book_count == borrow_counts[user_id] and not profile.empty
+        }
+
+    async def refresh_profiles(self, db: AsyncSession, user_ids: List[str]) -> int:
+        """
+        Rebuild the missing and stale profiles of users and save them.
+
+        Embeds any borrowed book without an embedding through the API, so this
+        belongs in batch jobs rather than request handlers.
+
+        Args:
+            db: Database session
+            user_ids: The user IDs
+
+        Returns:
+            Number of profiles rebuilt
+        """
+        user_uuids = [uuid.UUID(user_id) for user_id in user_ids]
+        counts = (
+            select(BorrowedBook.user_id, func.count(BorrowedBook.id).label("book_count"))
+            .where(BorrowedBook.user_id.in_(user_uuids))
+            .group_by(BorrowedBook.user_id)
+            .subquery()
+        )
+        rows = (await db.execute(
+            select(counts.c.user_id, counts.c.book_count, UserPreferenceProfile)
+            .outerjoin(UserPreferenceProfile, UserPreferenceProfile.user_id == counts.c.user_id)
+            .execution_options(populate_existing=True)
+        )).all()
+
+        stale = {
+            user_uuid: record
+            for user_uuid, book_count, record in rows
+            if record is None or record.book_count != book_count or record.model != settings.EMBEDDING_MODEL
+        }
+        if stale:
+            await self._rebuild_profiles(db, stale)
+        return len(stale)
+
+    async def _rebuild_profiles(
+        self,
+        db: AsyncSession,
+        records: Dict[uuid.UUID, Optional[UserPreferenceProfile]]
+    ) -> None:
+        """
+        Build profiles from users' full histories and save them.
+
+        Args:
+            db: Database session
+            records: Mapping of user ID to their stored profile row, or None
+        """
+        borrowed = (await db.execute(
+            select(BorrowedBook.user_id, BorrowedBook.borrow_date, BorrowedBook.created_at, Book)
+            .join(Book, Book.id == BorrowedBook.book_id)
+            .where(BorrowedBook.user_id.in_(list(records)))
+            .order_by(BorrowedBook.borrow_date)
+        )).all()
+        embeddings = await self.get_book_embeddings(db, [book.to_dict() for _, _, _, book in borrowed])
+        dimensions = len(next(iter(embeddings.values()))) if embeddings else settings.EMBEDDING_DIMENSIONS
+
+        profiles = {user_uuid: PreferenceProfile(dimensions) for user_uuid in records}
+        for user_uuid, borrow_date, created_at, book in borrowed:
+            profiles[user_uuid].add(embeddings.get(str(book.id)), borrow_date, created_at)
+
+        for user_uuid, profile in profiles.items():
+            if profile.empty:
+                continue
+            record = records[user_uuid]
+            if record is None:
+                db.add(UserPreferenceProfile(user_id=user_uuid, **profile.to_columns()))
+            else:
+                for column, value in profile.to_columns().items():
+                    setattr(record, column, value)
+        await db.commit()
+
+        logger.info(f"Rebuilt preference profiles for {len(profiles)} users")
+
+    async def get_book_embeddings(self, db: AsyncSession, books: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """
+        Get embeddings for books, generating and saving any that are missing.
+
+        Args:
+            db: Database session
+            books: Book dictionaries, possibly with duplicates
+
+        Returns:
+            Mapping of book ID to embedding for the books that have one
+        """
+        unique_books = list({book["id"]: book for book in books}.values())
+
+        # First try to get existing embeddings
+        embeddings = await self.vector_store.get_book_embeddings(db, [book["id"] for book in unique_books])
+
+        # Generate the missing ones in one batch and save them for future use
+        missing = [book for book in unique_books if book["id"] not in embeddings]
+        if missing:
+            generated = await self.embedding_service.create_embeddings_for_books(missing, db=db)
+            for book, embedding in zip(missing, generated):
+                if embedding is not None:
+                    await self.vector_store.save_embedding(
+                        db, book["id"], embedding, text_hash=EmbeddingService.book_text_hash(book)
+                    )
+                    embeddings[book["id"]] = embedding
+
+        return embeddings
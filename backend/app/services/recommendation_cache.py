@@ -0,0 +1,115 @@
+"""
+Cache for GPT-refined recommendation results
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from app.core.cache import create_cache
+from app.core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class RecommendationCache:
+    """
+    Caches refine_recommendations_with_gpt results.
+
+    Results are keyed on the recent-book IDs, the candidate IDs, the number
+    of recommendations and the chat model, so a repeated request for the
+    same inputs skips the LLM call. Also tracks the latency and tokens of
+    the LLM calls it stands in front of, to estimate what hits save.
+    """
+
+    def __init__(self, store: Any):
+        """
+        Args:
+            store: Cache backend created by app.core.cache.create_cache
+        """
+        self.store = store
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.llm_tokens = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        recent_books: List[Dict[str, Any]],
+        similar_books: List[Dict[str, Any]],
+        num_recommendations: int
+    ) -> str:
+        """
+        Build the cache key for a refinement request.
+
+        Args:
+            recent_books: Books recently read by the user
+            similar_books: Candidate books found by embedding search
+            num_recommendations: Number of recommendations requested
+
+        Returns:
+            Hex digest identifying the request
+        """
+        payload = json.dumps({
+            "model": settings.CHAT_MODEL,
+            "recent": [str(book["id"]) for book in recent_books],
+            "candidates": [str(book["id"]) for book in similar_books],
+            "n": num_recommendations,
+        })
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached result, or None on a miss."""
+        return await self.store.get(key)
+
+    async def set(self, key: str, result: Dict[str, Any]) -> None:
+        """Cache a refined result."""
+        await self.store.set(key, result)
+
+    async def clear(self) -> None:
+        """Remove all cached results and reset the counters."""
+        await self.store.clear()
+        with self._lock:
+            self.llm_calls = 0
+            self.llm_seconds = 0.0
+            self.llm_tokens = 0
+
+    def record_llm_call(self, seconds: float, tokens: int) -> None:
+        """
+        Record the cost of an uncached LLM call.
+
+        Args:
+            seconds: Call latency
+            tokens: Total tokens used
+        """
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += seconds
+            self.llm_tokens += tokens
+
+    async def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters with the estimated LLM latency and tokens saved by hits."""
+        stats = await self.store.stats()
+        hits = stats.get("hits", 0)
+        calls = self.llm_calls or 1
+
+        return {
+            **stats,
+            "llm_calls": self.llm_calls,
+            "llm_seconds": self.llm_seconds,
+            "llm_tokens": self.llm_tokens,
+            "estimated_seconds_saved": hits * self.llm_seconds / calls,
+            "estimated_tokens_saved": int(hits * self.llm_tokens / calls),
+        }
+
+# Process-wide cache shared by all RecommendationService instances
+recommendation_cache = RecommendationCache(
+    create_cache(
+        settings.RECOMMENDATION_CACHE_BACKEND,
+        "recommendations",
+        maxsize=settings.RECOMMENDATION_CACHE_MAX_ENTRIES,
+        ttl=settings.RECOMMENDATION_CACHE_TTL_SECONDS
+    )
+)
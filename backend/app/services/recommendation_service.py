@@ -2,17 +2,27 @@
 Service for generating book recommendations
 """
 
+import asyncio
 import logging
 import json
-from typing import List, Dict, Any, Optional
-from sqlalchemy.orm import Session
+import time
+from contextlib import aclosing
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
 import uuid
-from openai import OpenAI
 
 from app.core.config import settings
+from app.core.metrics import timed
 from app.db.vector_store import VectorStore
 from app.services.embedding_service import EmbeddingService
-from app.db.models import Book, User, BorrowedBook, BookEmbedding
+from app.services.json_stream import JSONArrayStreamParser
+from app.services.openai_client import openai_client
+from app.services.preference_service import PreferenceService, merge_results
+from app.services.recommendation_cache import recommendation_cache
+from app.db.models import Book, User, BorrowedBook, BookEmbedding, UserRecommendation
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -21,11 +31,12 @@ class RecommendationService:
     """Service for generating personalized book recommendations"""
     
     def __init__(self):
-        self.openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
         self.embedding_service = EmbeddingService()
         self.vector_store = VectorStore()
+        self.preference_service = PreferenceService(self.embedding_service, self.vector_store)
     
-    def get_reading_history(self, db: Session, user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+    @timed("reading_history")
+    async def get_reading_history(self, db: AsyncSession, user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
         """
         Get a user's reading history.
         
@@ -40,47 +51,250 @@ class RecommendationService:
         try:
             user_uuid = uuid.UUID(user_id)
             
-            # Get the most recent borrowed books
-            borrowed_records = (
-                db.query(BorrowedBook)
-                .filter(BorrowedBook.user_id == user_uuid)
-                .order_by(BorrowedBook.borrow_date.desc())
-                .limit(limit)
-                .all()
-            )
+            # Get the most recent borrowed books together with their book details
+            borrowed_records = (await db.execute(self.reading_history_query(user_uuid, limit))).all()
             
-            # Get the complete book details for each borrowed book
-            result = []
-            for borrow in borrowed_records:
-                book = db.query(Book).filter(Book.id == borrow.book_id).first()
-                if book:
-                    # Add borrow information to book
-                    book_with_borrow = {
-                        "id": str(book.id),
-                        "title": book.title,
-                        "author": book.author,
-                        "isbn": book.isbn,
-                        "genre": book.genre,
-                        "publicationYear": book.publication_year,
-                        "publisher": book.publisher,
-                        "description": book.description,
-                        "copies": book.copies,
-                        "copiesAvailable": book.copies_available,
-                        "coverImage": book.cover_image,
-                        "borrowDate": borrow.borrow_date,
-                        "returnDate": borrow.return_date,
-                        "status": borrow.status
-                    }
-                    result.append(book_with_borrow)
+            # Add borrow information to each book
+            result = [
+                {
+                    **book.to_dict(),
+                    "borrowDate": borrow.borrow_date,
+                    "returnDate": borrow.return_date,
+                    "status": borrow.status
+                }
+                for borrow, book in borrowed_records
+            ]
             
             return result
         except ValueError:
             logger.error(f"Invalid UUID format for user_id: {user_id}")
             return []
     
+    @staticmethod
+    def reading_history_query(user_uuid: uuid.UUID, limit: int) -> Select:
+        """
+        Build the query for a user's most recent borrows and their books.
+        
+        It is served by the (user_id, borrow_date DESC) index on borrowed_books.
+        
+        Args:
+            user_uuid: The user ID
+            limit: Maximum number of borrows to return
+            
+        Returns:
+            A SELECT of (BorrowedBook, Book) rows, most recent first
+        """
+        return (
+            select(BorrowedBook, Book)
+            .join(Book, Book.id == BorrowedBook.book_id)
+            .where(BorrowedBook.user_id == user_uuid)
+            .order_by(BorrowedBook.borrow_date.desc())
+            .limit(limit)
+        )
+    
+    @timed("reading_history")
+    async def get_reading_histories(
+        self,
+        db: AsyncSession,
+        user_ids: List[str],
+        limit: int = 5
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Get the reading histories of several users in one query.
+        
+        Args:
+            db: Database session
+            user_ids: The user IDs
+            limit: Maximum number of books to return per user
+            
+        Returns:
+            Mapping of user ID to the books they borrowed, most recent first
+        """
+        user_uuids = []
+        for user_id in user_ids:
+            try:
+                user_uuids.append(uuid.UUID(user_id))
+            except ValueError:
+                logger.error(f"Invalid UUID format for user_id: {user_id}")
+        
+        if not user_uuids:
+            return {}
+        
+        # Rank each user's borrows by recency so only the latest few are joined
+        ranked = (
+            select(
+                BorrowedBook.id.label("borrow_id"),
+                func.row_number().over(
+                    partition_by=BorrowedBook.user_id,
+                    order_by=BorrowedBook.borrow_date.desc()
+                ).label("rank")
+            )
+            .where(BorrowedBook.user_id.in_(user_uuids))
+            .subquery()
+        )
+        borrowed_records = (await db.execute(
+            select(BorrowedBook, Book)
+            .join(ranked, ranked.c.borrow_id == BorrowedBook.id)
+            .join(Book, Book.id == BorrowedBook.book_id)
+            .where(ranked.c.rank <= limit)
+            .order_by(BorrowedBook.user_id, ranked.c.rank)
+        )).all()
+        
+        histories: Dict[str, List[Dict[str, Any]]] = {}
+        for borrow, book in borrowed_records:
+            histories.setdefault(str(borrow.user_id), []).append({
+                **book.to_dict(),
+                "borrowDate": borrow.borrow_date,
+                "returnDate": borrow.return_date,
+                "status": borrow.status
+            })
+        
+        return histories
+    
+    async def get_history_versions(
+        self,
+        db: AsyncSession,
+        user_ids: Optional[List[uuid.UUID]] = None
+    ) -> Dict[uuid.UUID, Tuple[int, Optional[datetime]]]:
+        """
+        Summarize the state of users' borrowed_books rows.
+        
+        Any borrow being added, removed or updated changes a user's version.
+        
+        Args:
+            db: Database session
+            user_ids: Users to summarize, or None for every user with a history
+            
+        Returns:
+            Mapping of user ID to (number of borrow records, latest record change)
+        """
+        query = select(
+            BorrowedBook.user_id,
+            func.count(BorrowedBook.id),
+            func.max(func.coalesce(BorrowedBook.updated_at, BorrowedBook.created_at))
+        )
+        if user_ids is not None:
+            query = query.where(BorrowedBook.user_id.in_(user_ids))
+        
+        return {
+            user_id: (count, updated_at)
+            for user_id, count, updated_at in (await db.execute(query.group_by(BorrowedBook.user_id))).all()
+        }
+    
+    async def get_borrowed_book_ids(self, db: AsyncSession, user_ids: List[str]) -> Dict[str, List[str]]:
+        """
+        Get the IDs of every book users have borrowed, in one query.
+        
+        Args:
+            db: Database session
+            user_ids: The user IDs
+            
+        Returns:
+            Mapping of user ID to the IDs of the books in their whole borrow history
+        """
+        rows = (await db.execute(
+            select(BorrowedBook.user_id, BorrowedBook.book_id)
+            .where(BorrowedBook.user_id.in_([uuid.UUID(user_id) for user_id in user_ids]))
+        )).all()
+        
+        borrowed = {}
+        for user_id, book_id in rows:
+            borrowed.setdefault(str(user_id), []).append(str(book_id))
+        return borrowed
+    
+    async def get_stale_student_ids(self, db: AsyncSession) -> List[uuid.UUID]:
+        """
+        Find students whose precomputed recommendations are missing or out of date.
+        
+        Args:
+            db: Database session
+            
+        Returns:
+            IDs of students with a reading history that changed since their recommendations were computed
+        """
+        student_ids = (await db.scalars(select(User.id).where(User.role == "student"))).all()
+        versions = await self.get_history_versions(db, student_ids)
+        stored = {
+            user_id: (count, updated_at)
+            for user_id, count, updated_at in (await db.execute(select(
+                UserRecommendation.user_id,
+                UserRecommendation.history_count,
+                UserRecommendation.history_updated_at
+            ))).all()
+        }
+        
+        return [user_id for user_id, version in versions.items() if stored.get(user_id) != version]
+    
+    async def get_precomputed_recommendations(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        num_recommendations: int = settings.NUM_RECOMMENDATIONS
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get stored recommendations for a user.
+        
+        Args:
+            db: Database session
+            user_id: The user ID
+            num_recommendations: Number of recommendations needed
+            
+        Returns:
+            The stored recommendations, or None if there are none or too few were computed
+        """
+        try:
+            row = await db.get(UserRecommendation, uuid.UUID(user_id))
+        except ValueError:
+            logger.error(f"Invalid UUID format for user_id: {user_id}")
+            return None
+        
+        if row is None or row.num_recommendations < num_recommendations:
+            return None
+        
+        return {
+            "recommendations": row.recommendations["recommendations"][:num_recommendations],
+            "explanation": row.recommendations["explanation"],
+            "generated_at": row.generated_at
+        }
+    
+    async def save_recommendations(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        recommendations: Dict[str, Any],
+        num_recommendations: int
+    ) -> None:
+        """
+        Store recommendations along with the history version they were computed from.
+        
+        Args:
+            db: Database session
+            user_id: The user ID
+            recommendations: Result of generate_recommendations
+            num_recommendations: Number of recommendations that were requested
+        """
+        user_uuid = uuid.UUID(user_id)
+        versions = await self.get_history_versions(db, [user_uuid])
+        history_count, history_updated_at = versions.get(user_uuid, (0, None))
+        
+        row = await db.get(UserRecommendation, user_uuid)
+        if row is None:
+            row = UserRecommendation(user_id=user_uuid)
+            db.add(row)
+        
+        row.recommendations = {
+            "recommendations": recommendations["recommendations"],
+            "explanation": recommendations["explanation"]
+        }
+        row.num_recommendations = num_recommendations
+        row.history_count = history_count
+        row.history_updated_at = history_updated_at
+        row.generated_at = datetime.utcnow()
+        await db.commit()
+    
     async def generate_recommendations(
         self, 
-        db: Session,
+        db: AsyncSession,
         user_id: str, 
         num_recommendations: int = settings.NUM_RECOMMENDATIONS
     ) -> Dict[str, Any]:
@@ -95,66 +309,190 @@ class RecommendationService:
         Returns:
             Dictionary containing recommendations and explanation
         """
-        # Get the user's reading history
-        reading_history = self.get_reading_history(db, user_id, limit=5)
-        
-        if not reading_history:
-            logger.warning(f"No reading history found for user {user_id}")
-            return {
-                "recommendations": [],
-                "explanation": "Unable to generate recommendations as the student has no reading history."
-            }
+        async with aclosing(self.generate_recommendations_bulk(db, [user_id], num_recommendations)) as results:
+            async for _, result in results:
+                return result
+    
+    async def generate_recommendations_bulk(
+        self,
+        db: AsyncSession,
+        user_ids: List[str],
+        num_recommendations: int = settings.NUM_RECOMMENDATIONS,
+        concurrency: int = settings.BULK_RECOMMENDATION_CONCURRENCY
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Generate book recommendations for many users at once.
         
-        # Get the most recent two books
-        recent_books = reading_history[:2] if len(reading_history) >= 2 else reading_history
-        
-        # Get embeddings for the recent books
-        book_embeddings = []
-        for book in recent_books:
-            # First try to get existing embedding
-            embedding = self.vector_store.get_book_embedding(db, book["id"])
-            
-            # If not found, generate a new one
-            if not embedding:
-                embedding = await self.embedding_service.create_embedding_for_book(book)
-                # Save the embedding for future use
-                if embedding:
-                    self.vector_store.save_embedding(db, book["id"], embedding)
-            
-            if embedding:
-                book_embeddings.append(embedding)
-        
-        # If we couldn't get any embeddings, return empty recommendations
-        if not book_embeddings:
-            logger.warning(f"Could not generate embeddings for books read by user {user_id}")
-            return {
-                "recommendations": [],
-                "explanation": "Unable to generate recommendations due to a technical issue."
-            }
+        Reading histories and stored embeddings are loaded with one query each,
+        the similarity search for all users is a single matrix-matrix product,
+        and the GPT refinements run concurrently. Database work finishes before
+        the refinements start, so the session is never used concurrently.
+        
+        Args:
+            db: Database session
+            user_ids: The user IDs
+            num_recommendations: Number of recommendations to generate per user
+            concurrency: Maximum number of refinements in flight at once
+            
+        Yields:
+            (user ID, recommendations) pairs in the order they complete
+        """
+        unavailable, candidates = await self.find_candidates(db, user_ids)
+        
+        # Users who cannot get recommendations need no refinement
+        for user_id, result in unavailable.items():
+            yield user_id, result
+        
+        semaphore = asyncio.Semaphore(concurrency)
         
-        # Combine embeddings from recent books to create a preference vector
-        preference_embedding = self.vector_store.combine_embeddings(book_embeddings)
+        async def refine(user_id: str, recent_books: List[Dict[str, Any]], similar_books: List[Dict[str, Any]]):
+            # Use GPT to refine the recommendations and provide an explanation
+            async with semaphore:
+                return user_id, await self.refine_recommendations_with_gpt(
+                    recent_books, similar_books, num_recommendations
+                )
         
-        # Get similar books based on the preference embedding
-        exclude_ids = [book["id"] for book in reading_history]  # Exclude books the user has already read
-        similar_books = await self.vector_store.find_similar_books(
+        tasks = [
+            asyncio.ensure_future(refine(user_id, recent_books, similar_books))
+            for user_id, (recent_books, similar_books) in candidates.items()
+        ]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            # Stop outstanding refinements if the consumer goes away early
+            for task in tasks:
+                task.cancel()
+    
+    async def stream_recommendations(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        num_recommendations: int = settings.NUM_RECOMMENDATIONS
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Generate book recommendations for a user, reporting progress as it happens.
+        
+        The similarity-search candidates are reported first, then each refined
+        recommendation as soon as GPT has written it.
+        
+        Args:
+            db: Database session
+            user_id: The user ID
+            num_recommendations: Number of recommendations to generate
+            
+        Yields:
+            (event, data) pairs: one 'candidates' event with the similar books,
+            a 'recommendation' event per refined book, and a final 'done' event
+            with the complete result
+        """
+        unavailable, candidates = await self.find_candidates(db, [user_id])
+        
+        if user_id in unavailable:
+            yield "done", unavailable[user_id]
+            return
+        
+        recent_books, similar_books = candidates[user_id]
+        yield "candidates", {"candidates": similar_books}
+        
+        async for event in self.stream_refinement_with_gpt(recent_books, similar_books, num_recommendations):
+            yield event
+    
+    @timed("candidates")
+    async def find_candidates(
+        self,
+        db: AsyncSession,
+        user_ids: List[str]
+    ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]]:
+        """
+        Find candidate books for users by embedding similarity.
+        
+        Args:
+            db: Database session
+            user_ids: The user IDs
+            
+        Returns:
+            Tuple of (final results for users who cannot get recommendations,
+            mapping of every other user ID to their (recent books, similar books))
+        """
+        unavailable = {}
+        
+        # Get every user's reading history
+        histories = await self.get_reading_histories(db, user_ids, limit=5)
+        
+        pending = []
+        for user_id in user_ids:
+            if histories.get(user_id):
+                pending.append(user_id)
+            else:
+                logger.warning(f"No reading history found for user {user_id}")
+                unavailable[user_id] = {
+                    "recommendations": [],
+                    "explanation": "Unable to generate recommendations as the student has no reading history."
+                }
+        
+        # The most recent two books describe the reader in the refinement prompt
+        recent_books = {user_id: histories[user_id][:2] for user_id in pending}
+        borrowed_book_ids = await self.get_borrowed_book_ids(db, pending)
+        
+        # Search with every user's preference profile: its centroid and each of its taste clusters
+        profiles = await self.preference_service.get_profiles(
+            db, {user_id: len(borrowed_book_ids.get(user_id, [])) for user_id in pending}
+        )
+        queries = {user_id: profiles[user_id].queries() for user_id in pending if user_id in profiles}
+        
+        # Users without an up to date profile fall back to the centroid of their recent books
+        fallback = [user_id for user_id in pending if user_id not in profiles]
+        embeddings = await self.preference_service.get_book_embeddings(
+            db, [book for user_id in fallback for book in recent_books[user_id]]
+        ) if fallback else {}
+        for user_id in fallback:
+            book_embeddings = [embeddings[book["id"]] for book in recent_books[user_id] if book["id"] in embeddings]
+            
+            if not book_embeddings:
+                logger.warning(f"Could not generate embeddings for books read by user {user_id}")
+                unavailable[user_id] = {
+                    "recommendations": [],
+                    "explanation": "Unable to generate recommendations due to a technical issue."
+                }
+                continue
+            
+            queries[user_id] = [(self.vector_store.combine_embeddings(book_embeddings), 1.0)]
+        
+        if not queries:
+            return unavailable, {}
+        
+        # Run all users' queries as one batch, excluding every book each user has borrowed
+        searched = [(user_id, embedding) for user_id, user_queries in queries.items() for embedding, _ in user_queries]
+        results = await self.vector_store.find_similar_books_many(
             db,
-            preference_embedding, 
+            [embedding for _, embedding in searched],
             n=settings.NUM_SIMILAR_BOOKS,
-            exclude_book_ids=exclude_ids
+            exclude_book_ids=[borrowed_book_ids[user_id] for user_id, _ in searched]
         )
         
-        # If no similar books found, return empty recommendations
-        if not similar_books:
-            logger.warning(f"No similar books found for user {user_id}")
-            return {
-                "recommendations": [],
-                "explanation": "No suitable recommendations found based on the student's reading history."
-            }
+        candidates = {}
+        offset = 0
+        for user_id, user_queries in queries.items():
+            books = merge_results(
+                results[offset:offset + len(user_queries)],
+                [share for _, share in user_queries],
+                settings.NUM_SIMILAR_BOOKS
+            )
+            offset += len(user_queries)
+            
+            if not books:
+                logger.warning(f"No similar books found for user {user_id}")
+                unavailable[user_id] = {
+                    "recommendations": [],
+                    "explanation": "No suitable recommendations found based on the student's reading history."
+                }
+            else:
+                candidates[user_id] = (recent_books[user_id], books)
         
-        # Use GPT to refine the recommendations and provide an explanation
-        return await self.refine_recommendations_with_gpt(recent_books, similar_books, num_recommendations)
+        return unavailable, candidates
     
+    @timed("gpt_refinement")
     async def refine_recommendations_with_gpt(
         self, 
         recent_books: List[Dict[str, Any]], 
@@ -172,27 +510,159 @@ class RecommendationService:
         Returns:
             Dictionary with refined recommendations and explanation
         """
+        # Reuse the result of an identical recent request
+        cache_key = recommendation_cache.make_key(recent_books, similar_books, num_recommendations)
+        cached = await recommendation_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            # Prepare the data for GPT
-            recent_books_json = json.dumps([{
-                "id": book["id"],
-                "title": book["title"],
-                "author": book["author"],
-                "genre": book["genre"],
-                "description": book["description"]
-            } for book in recent_books], indent=2)
-            
-            similar_books_json = json.dumps([{
-                "id": book["id"],
-                "title": book["title"],
-                "author": book["author"],
-                "genre": book["genre"],
-                "description": book["description"],
-                "similarity_score": book.get("similarity_score", 0)
-            } for book in similar_books], indent=2)
-            
-            # Create the prompt for GPT
-            prompt = f"""
+            # Call GPT to get recommendations
+            started = time.perf_counter()
+            async with openai_client() as client:
+                # The SDK retries transient failures, within the same overall deadline
+                response = await asyncio.wait_for(client.chat.completions.create(
+                    model=settings.CHAT_MODEL,
+                    messages=self._build_refinement_messages(recent_books, similar_books, num_recommendations),
+                    temperature=0.7,
+                    response_format={"type": "json_object"},
+                    timeout=settings.CHAT_TIMEOUT_SECONDS
+                ), settings.CHAT_TIMEOUT_SECONDS)
+            recommendation_cache.record_llm_call(
+                time.perf_counter() - started,
+                response.usage.total_tokens if response.usage else 0
+            )
+            
+            # Parse the response
+            result = json.loads(response.choices[0].message.content)
+            
+            refined = {
+                "recommendations": self._add_book_details(result.get("recommendations", []), similar_books),
+                "explanation": result.get("explanation", "")
+            }
+            
+            # Only successful refinements are cached; fallbacks are retried next time
+            await recommendation_cache.set(cache_key, refined)
+            return refined
+            
+        except Exception as e:
+            logger.error(f"Error refining recommendations with GPT: {e}")
+            return self._fallback_recommendations(similar_books, num_recommendations)
+    
+    @timed("gpt_refinement")
+    async def stream_refinement_with_gpt(
+        self,
+        recent_books: List[Dict[str, Any]],
+        similar_books: List[Dict[str, Any]],
+        num_recommendations: int
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Use GPT to refine book recommendations, reporting each one as it is written.
+        
+        Uses the chat API's streaming mode and parses the JSON response
+        incrementally, so the first recommendation is available long before
+        the whole response is.
+        
+        Args:
+            recent_books: Books recently read by the user
+            similar_books: Similar books found by embedding search
+            num_recommendations: Number of recommendations to return
+            
+        Yields:
+            ('recommendation', book) for each refined book, then ('done', result)
+            with the same dictionary refine_recommendations_with_gpt returns. If
+            the response fails after some picks were sent, result holds just
+            those picks and 'error': True
+        """
+        # Reuse the result of an identical recent request
+        cache_key = recommendation_cache.make_key(recent_books, similar_books, num_recommendations)
+        cached = await recommendation_cache.get(cache_key)
+        if cached is not None:
+            for recommendation in cached["recommendations"]:
+                yield "recommendation", recommendation
+            yield "done", cached
+            return
+        
+        parser = JSONArrayStreamParser("recommendations")
+        recommendations = []
+        
+        try:
+            started = time.perf_counter()
+            total_tokens = 0
+            async with openai_client() as client:
+                # The SDK retries opening the stream, within the same overall deadline
+                stream = await asyncio.wait_for(client.chat.completions.create(
+                    model=settings.CHAT_MODEL,
+                    messages=self._build_refinement_messages(recent_books, similar_books, num_recommendations),
+                    temperature=0.7,
+                    response_format={"type": "json_object"},
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=settings.CHAT_TIMEOUT_SECONDS
+                ), settings.CHAT_TIMEOUT_SECONDS)
+                async for chunk in stream:
+                    if chunk.usage:
+                        total_tokens = chunk.usage.total_tokens
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    
+                    # Report each recommendation as soon as its JSON object is complete
+                    for recommendation in self._add_book_details(
+                        parser.feed(chunk.choices[0].delta.content), similar_books
+                    ):
+                        recommendations.append(recommendation)
+                        yield "recommendation", recommendation
+            recommendation_cache.record_llm_call(time.perf_counter() - started, total_tokens)
+            
+            refined = {
+                "recommendations": recommendations,
+                "explanation": json.loads(parser.text).get("explanation", "")
+            }
+            
+            # Only successful refinements are cached; fallbacks are retried next time
+            await recommendation_cache.set(cache_key, refined)
+            
+        except Exception as e:
+            logger.error(f"Error streaming recommendations from GPT: {e}")
+            if recommendations:
+                # Picks already sent cannot be replaced, so finish with them and flag the cut-off
+                refined = {
+                    "recommendations": recommendations,
+                    "explanation": "",
+                    "error": True
+                }
+            else:
+                refined = self._fallback_recommendations(similar_books, num_recommendations)
+        
+        yield "done", refined
+    
+    @staticmethod
+    def _build_refinement_messages(
+        recent_books: List[Dict[str, Any]],
+        similar_books: List[Dict[str, Any]],
+        num_recommendations: int
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages asking GPT to pick and explain recommendations."""
+        # Prepare the data for GPT
+        recent_books_json = json.dumps([{
+            "id": book["id"],
+            "title": book["title"],
+            "author": book["author"],
+            "genre": book["genre"],
+            "description": book["description"]
+        } for book in recent_books], indent=2)
+        
+        similar_books_json = json.dumps([{
+            "id": book["id"],
+            "title": book["title"],
+            "author": book["author"],
+            "genre": book["genre"],
+            "description": book["description"],
+            "similarity_score": book.get("similarity_score", 0)
+        } for book in similar_books], indent=2)
+        
+        # Create the prompt for GPT
+        prompt = f"""
             You are a skilled librarian helping a student find their next book to read.
             
             The student has recently read these books:
@@ -222,45 +692,37 @@ class RecommendationService:
             
             Only include the JSON in your response, nothing else.
             """
+        
+        return [
+            {"role": "system", "content": "You are a helpful librarian assistant."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    @staticmethod
+    def _add_book_details(
+        recommendations: List[Dict[str, Any]],
+        similar_books: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Combine GPT's picks with the full details of the matching similar books."""
+        enhanced_recommendations = []
+        for rec in recommendations:
+            # Find the full book details
+            book_id = rec.get("id")
+            book_details = next((book for book in similar_books if str(book["id"]) == str(book_id)), None)
             
-            # Call GPT to get recommendations
-            response = self.openai_client.chat.completions.create(
-                model=settings.CHAT_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a helpful librarian assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                response_format={"type": "json_object"}
-            )
-            
-            # Parse the response
-            result = json.loads(response.choices[0].message.content)
-            
-            # Add full book details to recommendations
-            enhanced_recommendations = []
-            for rec in result.get("recommendations", []):
-                # Find the full book details
-                book_id = rec.get("id")
-                book_details = next((book for book in similar_books if str(book["id"]) == str(book_id)), None)
-                
-                if book_details:
-                    # Combine the recommendation reason with full book details
-                    enhanced_rec = {
-                        **book_details,
-                        "recommendation_reason": rec.get("reason", "")
-                    }
-                    enhanced_recommendations.append(enhanced_rec)
-            
-            return {
-                "recommendations": enhanced_recommendations,
-                "explanation": result.get("explanation", "")
-            }
-            
-        except Exception as e:
-            logger.error(f"Error refining recommendations with GPT: {e}")
-            # Return a subset of the similar books as a fallback
-            return {
-                "recommendations": similar_books[:num_recommendations],
-                "explanation": "Recommendations based on books with similar themes and styles to your recent reads."
-            }
\ No newline at end of file
+            if book_details:
+                # Combine the recommendation reason with full book details
+                enhanced_recommendations.append({
+                    **book_details,
+                    "recommendation_reason": rec.get("reason", "")
+                })
+        
+        return enhanced_recommendations
+    
+    @staticmethod
+    def _fallback_recommendations(similar_books: List[Dict[str, Any]], num_recommendations: int) -> Dict[str, Any]:
+        """Return a subset of the similar books when GPT is unavailable."""
+        return {
+            "recommendations": similar_books[:num_recommendations],
+            "explanation": "Recommendations based on books with similar themes and styles to your recent reads."
+        }
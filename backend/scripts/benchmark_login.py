@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Script to benchmark password verification during a login storm.
+Verifies the same burst of passwords inline on the event loop, as the login
+handler used to, and on the password hashing pool with an increasing number
+of workers, and reports logins per second and the event loop's worst stall.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+
+# Add the parent directory to sys.path to allow importing from the app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings
+from app.core.passwords import PasswordHasher
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+async def login_storm(hasher, hashed_password, logins, inline):
+    """
+    Verify a burst of concurrent logins while measuring event loop stalls.
+
+    Args:
+        hasher: PasswordHasher to verify with
+        hashed_password: Stored hash every login is checked against
+        logins: Number of concurrent logins
+        inline: Verify on the event loop instead of the worker pool
+
+    Returns:
+        Tuple of (seconds for the whole burst, longest event loop stall in seconds)
+    """
+    stalls = []
+
+    async def ticker():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            stalls.append(time.perf_counter() - start - 0.005)
+
+    async def login():
+        if inline:
+            return hasher.verify_sync("correct horse battery staple", hashed_password)
+        return await hasher.verify("correct horse battery staple", hashed_password)
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[login() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    # Let the ticker record the stall of the last burst before stopping it
+    await asyncio.sleep(0.01)
+    ticker_task.cancel()
+
+    assert all(results)
+    return elapsed, max(stalls, default=0.0)
+
+def main():
+    """
+    Main function to run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=32, help="Concurrent logins per run")
+    parser.add_argument("--rounds", type=int, default=settings.BCRYPT_ROUNDS, help="bcrypt cost factor")
+    parser.add_argument(
+        "--workers", type=int, nargs="+",
+        default=sorted({1, 2, os.cpu_count() or 1}), help="Pool sizes to try"
+    )
+    args = parser.parse_args()
+
+    hashed_password = PasswordHasher(args.rounds, 1).hash_sync("correct horse battery staple")
+    logger.info(f"Benchmarking {args.logins} concurrent logins at bcrypt cost {args.rounds} on {os.cpu_count()} CPUs")
+
+    runs = [("inline", 1, True)] + [(f"pool, {workers} workers", workers, False) for workers in args.workers]
+    print(f"{'verification':<24} {'logins/s':>10} {'max stall ms':>14}")
+    for name, workers, inline in runs:
+        hasher = PasswordHasher(args.rounds, workers)
+        elapsed, stall = asyncio.run(login_storm(hasher, hashed_password, args.logins, inline))
+        hasher.shutdown()
+        print(f"{name:<24} {args.logins / elapsed:>10.1f} {stall * 1000:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Script to benchmark similarity search with pgvector against the default storage path.
+Runs the same queries through the resident index built from the stored embeddings and
+through PostgreSQL's top-k query on the pgvector column, and reports recall@k and
+latency. Requires a PostgreSQL database migrated to revision 0004 with the
+pgvector extension and stored embeddings.
+"""
+
+import sys
+import asyncio
+import time
+import json
+import argparse
+import logging
+from pathlib import Path
+import numpy as np
+from sqlalchemy import inspect
+
+# Add the parent directory to sys.path to allow importing from the app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings
+from app.db.database import AsyncSessionLocal, SessionLocal
+from app.db.embedding_index import EmbeddingIndex
+from app.db.models import BookEmbedding, unpack_embedding
+from app.db.vector_store import VectorStore
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def summarize(name, latencies, recalls):
+    """Summarize one benchmark run as a result row."""
+    return {
+        "storage": name,
+        "recall": float(np.mean(recalls)),
+        "mean_ms": float(np.mean(latencies)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+async def benchmark_pgvector(queries, excluded, expected, k, ef_search_values):
+    """
+    Run the queries through pgvector's top-k search at each ef_search value.
+
+    Args:
+        queries: Query embeddings
+        excluded: Book IDs excluded from each query's results
+        expected: Book IDs the exact search returned for each query
+        k: Number of neighbours per query
+        ef_search_values: HNSW ef_search values to try
+
+    Returns:
+        One result row per ef_search value
+    """
+    results = []
+    async with AsyncSessionLocal() as db:
+        for ef_search in ef_search_values:
+            settings.PGVECTOR_EF_SEARCH = ef_search
+            latencies, recalls = [], []
+            for query, exclude, truth in zip(queries, excluded, expected):
+                start = time.perf_counter()
+                found = await VectorStore._pgvector_search(db, query, k, exclude)
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(truth & {book_id for book_id, _ in found}) / k)
+            await db.rollback()
+            results.append(summarize(f"pgvector ef_search={ef_search}", latencies, recalls))
+    return results
+
+def main():
+    """
+    Main function to run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("-k", type=int, default=10, help="Number of neighbours per query")
+    parser.add_argument("--exclude", type=int, default=5, help="Books excluded per query, like a reading history")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200], help="HNSW ef_search values to try")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+
+    try:
+        if db.get_bind().dialect.name != "postgresql":
+            sys.exit("The pgvector benchmark needs a PostgreSQL DATABASE_URL")
+        columns = {column["name"] for column in inspect(db.get_bind()).get_columns("book_embeddings")}
+        if "embedding_vector" not in columns:
+            sys.exit("book_embeddings.embedding_vector is missing; run 'alembic upgrade head' with pgvector installed")
+
+        # The default path: load every stored vector into Python, then rank in memory
+        start = time.perf_counter()
+        rows = (
+            db.query(BookEmbedding.book_id, BookEmbedding.embedding, BookEmbedding.embedding_dtype)
+            .filter(BookEmbedding.model == settings.EMBEDDING_MODEL)
+            .all()
+        )
+        book_ids = [str(book_id) for book_id, _, _ in rows]
+        vectors = np.asarray([unpack_embedding(embedding, dtype) for _, embedding, dtype in rows], dtype=np.float32)
+        index = EmbeddingIndex()
+        index.load(book_ids, vectors)
+        load_seconds = time.perf_counter() - start
+        logger.info(f"Loaded {len(book_ids)} embeddings into memory in {load_seconds:.2f}s")
+
+        if len(book_ids) <= args.k + args.exclude:
+            sys.exit("Not enough stored embeddings to benchmark")
+
+        # Queries are perturbed catalog vectors, each excluding some books like a reading history
+        rng = np.random.default_rng(0)
+        picks = rng.choice(len(vectors), size=args.queries)
+        queries = vectors[picks] + 0.3 * rng.normal(size=(args.queries, vectors.shape[1])) / np.sqrt(vectors.shape[1])
+        excluded = [[book_ids[i] for i in rng.choice(len(book_ids), size=args.exclude, replace=False)] for _ in picks]
+
+        expected, latencies = [], []
+        for query, exclude in zip(queries, excluded):
+            start = time.perf_counter()
+            found = index.search(query, args.k, exclude_book_ids=exclude)
+            latencies.append((time.perf_counter() - start) * 1000)
+            expected.append({book_id for book_id, _ in found})
+        results = [summarize("resident index", latencies, [1.0] * len(latencies))]
+
+        results.extend(asyncio.run(benchmark_pgvector(queries, excluded, expected, args.k, args.ef_search)))
+
+        print(f"Load into memory: {load_seconds * 1000:.1f} ms for {len(book_ids)} embeddings")
+        print(f"{'storage':<28} {'recall@' + str(args.k):>10} {'mean ms':>10} {'p95 ms':>10}")
+        for row in results:
+            print(f"{row['storage']:<28} {row['recall']:>10.3f} {row['mean_ms']:>10.3f} {row['p95_ms']:>10.3f}")
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({
+                    "num_books": len(book_ids),
+                    "k": args.k,
+                    "load_ms": load_seconds * 1000,
+                    "results": results
+                }, f, indent=2)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+"""
+Script to benchmark the recommendation hot paths on synthetic catalogs.
+Generates reproducible catalogs of books with unit-norm embeddings, users and
+circulation histories into a SQLite file (or any database URL), then times
+VectorStore.find_similar_books, VectorStore.combine_embeddings,
+RecommendationService.get_reading_history and the full generate_recommendations
+with a stubbed LLM. Results are written as JSON, and --compare reports the
+change against the results of an earlier run.
+"""
+
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import logging
+import platform
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+import sqlalchemy
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+# Add the parent directory to sys.path to allow importing from the app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings
+from app.core.metrics import stage_latency
+from app.db.database import Base, async_database_url
+from app.db.embedding_index import embedding_index
+from app.db.models import Book, BookEmbedding, BorrowedBook, User, pack_embedding
+from app.db.vector_store import VectorStore
+from app.services import recommendation_service as recommendation_module
+from app.services.recommendation_cache import recommendation_cache
+from app.services.recommendation_service import RecommendationService
+from fake_openai_server import recommendation_reply
+from seed_data import bulk_insert
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+GENRES = ["Fiction", "Science Fiction", "Fantasy", "Mystery", "History", "Biography", "Poetry", "Science"]
+
+# Rows generated and inserted at a time
+GENERATION_CHUNK = 10000
+
+def synthetic_catalog(num_books, dim, seed, num_topics=64, noise=0.6):
+    """
+    Generate a reproducible catalog of books with clustered unit-norm embeddings, chunk by chunk.
+
+    Args:
+        num_books: Number of books
+        dim: Embedding dimension
+        seed: Random seed; the same seed always gives the same catalog
+        num_topics: Number of topic clusters
+        noise: Spread of books around their topic
+
+    Yields:
+        Lists of (book row, embedding, topic) tuples
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(num_topics, dim))
+    now = datetime(2026, 1, 1)
+
+    for start in range(0, num_books, GENERATION_CHUNK):
+        size = min(GENERATION_CHUNK, num_books - start)
+        labels = rng.integers(0, num_topics, size=size)
+        vectors = topics[labels] + noise * rng.normal(size=(size, dim))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = rng.integers(0, 2 ** 63, size=(size, 2))
+
+        yield [
+            ({
+                "id": uuid.UUID(int=(int(high) << 64) | int(low)),
+                "title": f"Book {start + i}",
+                "author": f"Author {int(label)}",
+                "isbn": None,
+                "genre": GENRES[int(label) % len(GENRES)],
+                "publication_year": 1900 + (start + i) % 125,
+                "publisher": None,
+                "description": f"Synthetic book {start + i} about topic {int(label)}.",
+                "copies": 1,
+                "copies_available": 1,
+                "cover_image": None,
+                "created_at": now,
+                "updated_at": now,
+            }, vector, int(label))
+            for i, ((high, low), label, vector) in enumerate(zip(ids, labels, vectors))
+        ]
+
+def circulation(topic_books, num_users, loans_per_user, seed):
+    """
+    Generate reproducible students and their borrowing histories.
+
+    Each student reads within one topic, so preference vectors are meaningful.
+
+    Args:
+        topic_books: Book IDs of each topic
+        num_users: Number of students
+        loans_per_user: Borrowed books per student
+        seed: Random seed
+
+    Returns:
+        Tuple of (user rows, borrowed book rows)
+    """
+    rng = np.random.default_rng(seed + 1)
+    now = datetime(2026, 1, 1)
+    users, loans = [], []
+
+    for i in range(num_users):
+        user_id = uuid.UUID(int=int(rng.integers(0, 2 ** 63)) << 64 | i)
+        users.append({
+            "id": user_id,
+            "email": f"student{i}@example.com",
+            "first_name": "Student",
+            "last_name": str(i),
+            # Never used to log in, so no real hash is needed
+            "hashed_password": "!",
+            "role": "student",
+            "student_id": f"S{i:07d}",
+            "department": None,
+            "avatar": None,
+            "join_date": now,
+            "created_at": now,
+            "updated_at": now,
+        })
+
+        books = topic_books[int(rng.integers(0, len(topic_books)))]
+        for j in range(loans_per_user):
+            book_id = books[int(rng.integers(0, len(books)))]
+            borrow_date = now - timedelta(days=int(rng.integers(1, 365)))
+            returned = j < loans_per_user - 1
+            loans.append({
+                "id": uuid.UUID(int=int(rng.integers(0, 2 ** 63)) << 64 | (i * loans_per_user + j)),
+                "book_id": book_id,
+                "user_id": user_id,
+                "borrow_date": borrow_date,
+                "due_date": borrow_date + timedelta(days=14),
+                "return_date": borrow_date + timedelta(days=7) if returned else None,
+                "status": "returned" if returned else "borrowed",
+                "created_at": now,
+                "updated_at": now,
+            })
+
+    return users, loans
+
+def generate(url, num_books, dim, num_users, loans_per_user, seed):
+    """
+    Create the schema and load a synthetic catalog, unless the database already holds it.
+
+    Returns:
+        Seconds spent generating, or 0 if an existing catalog was reused
+    """
+    engine = create_engine(url)
+    try:
+        Base.metadata.create_all(engine)
+        with engine.connect() as connection:
+            existing = connection.scalar(select(func.count()).select_from(Book))
+        if existing == num_books:
+            logger.info(f"Reusing the existing catalog of {num_books} books")
+            return 0.0
+        if existing:
+            sys.exit(f"{url} holds {existing} books, not {num_books}; remove it or pass another --database-url")
+
+        started = time.perf_counter()
+        topic_books = {}
+        now = datetime(2026, 1, 1)
+
+        for chunk in synthetic_catalog(num_books, dim, seed):
+            bulk_insert(engine, Book.__table__, [book for book, _, _ in chunk], GENERATION_CHUNK)
+            embeddings = []
+            for book, vector, topic in chunk:
+                packed, dtype = pack_embedding(vector)
+                embeddings.append({
+                    "id": book["id"],
+                    "book_id": book["id"],
+                    "embedding": packed,
+                    "embedding_dtype": dtype,
+                    "model": settings.EMBEDDING_MODEL,
+                    "text_hash": None,
+                    "created_at": now,
+                    "updated_at": now,
+                })
+                topic_books.setdefault(topic, []).append(book["id"])
+            bulk_insert(engine, BookEmbedding.__table__, embeddings, GENERATION_CHUNK)
+
+        users, loans = circulation(list(topic_books.values()), num_users, loans_per_user, seed)
+        bulk_insert(engine, User.__table__, users, GENERATION_CHUNK)
+        bulk_insert(engine, BorrowedBook.__table__, loans, GENERATION_CHUNK)
+        return time.perf_counter() - started
+    finally:
+        engine.dispose()
+
+def summarize(latencies):
+    """Latency statistics of one benchmark, in milliseconds."""
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "iterations": int(len(latencies)),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "min_ms": float(latencies.min()),
+    }
+
+async def measure(function, arguments, warmup=3):
+    """
+    Time an async function once per argument tuple, after a few untimed warmup calls.
+
+    Returns:
+        Latency statistics
+    """
+    for args in arguments[:warmup]:
+        await function(*args)
+
+    latencies = []
+    for args in arguments:
+        started = time.perf_counter()
+        await function(*args)
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+def stub_openai_client(latency):
+    """
+    A stand-in for openai_client whose chat completions answer after a fixed latency.
+
+    The stub answers like the fake OpenAI server, recommending similarity search candidates from the prompt.
+    """
+    async def create(messages, **kwargs):
+        await asyncio.sleep(latency)
+        content = recommendation_reply(messages[-1]["content"])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    @asynccontextmanager
+    async def stub():
+        yield client
+
+    return stub
+
+async def run_benchmarks(url, iterations, llm_latency, seed):
+    """
+    Time the hot paths against a generated catalog.
+
+    Returns:
+        Mapping of benchmark name to its statistics
+    """
+    engine = create_async_engine(async_database_url(url))
+    session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    service = RecommendationService()
+    rng = np.random.default_rng(seed + 2)
+    results = {}
+
+    try:
+        async with session_factory() as db:
+            user_ids = [str(user_id) for user_id in (await db.scalars(select(User.id).order_by(User.id))).all()]
+            users = [user_ids[i] for i in rng.integers(0, len(user_ids), size=iterations)]
+
+            # Loading the resident index is paid once per worker; report it separately
+            embedding_index.clear()
+            started = time.perf_counter()
+            await VectorStore._get_index(db)
+            results["index_load"] = summarize([time.perf_counter() - started])
+
+            histories = {user_id: await service.get_reading_history(db, user_id, limit=5) for user_id in set(users)}
+            embeddings = await VectorStore.get_book_embeddings(
+                db, list({book["id"] for history in histories.values() for book in history})
+            )
+            preferences = [
+                (VectorStore.combine_embeddings([embeddings[book["id"]] for book in histories[user_id][:2]]), histories[user_id])
+                for user_id in users
+            ]
+
+            results["get_reading_history"] = await measure(
+                service.get_reading_history, [(db, user_id) for user_id in users]
+            )
+
+            async def combine(vectors):
+                return VectorStore.combine_embeddings(vectors)
+
+            results["combine_embeddings"] = await measure(
+                combine, [([embeddings[book["id"]] for book in histories[user_id][:2]],) for user_id in users]
+            )
+
+            async def find_similar(query, history):
+                return await VectorStore.find_similar_books(
+                    db, query, n=settings.NUM_SIMILAR_BOOKS, exclude_book_ids=[book["id"] for book in history]
+                )
+
+            results["find_similar_books"] = await measure(find_similar, preferences)
+
+            # The full pipeline, with the LLM replaced by a stub and nothing served from the result cache
+            openai_client = recommendation_module.openai_client
+            recommendation_module.openai_client = stub_openai_client(llm_latency)
+
+            async def generate_recommendations(user_id):
+                await recommendation_cache.clear()
+                return await service.generate_recommendations(db, user_id)
+
+            try:
+                stage_latency.clear()
+                results["generate_recommendations"] = await measure(generate_recommendations, [(user_id,) for user_id in users])
+                results["generate_recommendations"]["stages_mean_ms"] = {
+                    stage: total / count * 1000 for stage, (_, total, count) in sorted(stage_latency.snapshot().items())
+                }
+            finally:
+                recommendation_module.openai_client = openai_client
+    finally:
+        embedding_index.clear()
+        await engine.dispose()
+
+    return results
+
+def compare(results, baseline):
+    """Print the change in mean latency of every benchmark against an earlier run."""
+    print(f"{'catalog':>10} {'benchmark':<26} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for size, benchmarks in results["catalogs"].items():
+        for name, stats in benchmarks["benchmarks"].items():
+            before = baseline.get("catalogs", {}).get(size, {}).get("benchmarks", {}).get(name)
+            if before is None:
+                continue
+            change = (stats["mean_ms"] - before["mean_ms"]) / before["mean_ms"] * 100 if before["mean_ms"] else 0.0
+            print(f"{size:>10} {name:<26} {before['mean_ms']:>12.3f} {stats['mean_ms']:>12.3f} {change:>+7.1f}%")
+
+def main():
+    """
+    Main function to run the benchmark suite.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000], help="Catalog sizes, e.g. 1000 100000 1000000")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension")
+    parser.add_argument("--users", type=int, default=1000, help="Students per catalog")
+    parser.add_argument("--loans-per-user", type=int, default=8, help="Borrowed books per student")
+    parser.add_argument("--iterations", type=int, default=100, help="Timed calls per benchmark")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stubbed LLM takes to answer")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the catalogs and queries")
+    parser.add_argument(
+        "--database-url", type=str, default=f"sqlite:///{Path(settings.CACHE_DIR) / 'benchmark_{size}.db'}",
+        help="Database per catalog; {size} is replaced by the catalog size"
+    )
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file")
+    parser.add_argument("--compare", type=str, help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    Path(settings.CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "sqlalchemy": sqlalchemy.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "catalogs": {},
+    }
+
+    for size in args.sizes:
+        url = args.database_url.replace("{size}", str(size))
+        logger.info(f"Catalog of {size} books in {url}")
+        generate_seconds = generate(url, size, args.dim, args.users, args.loans_per_user, args.seed)
+        benchmarks = asyncio.run(run_benchmarks(url, args.iterations, args.llm_latency, args.seed))
+        results["catalogs"][str(size)] = {
+            "dialect": sqlalchemy.engine.make_url(url).get_backend_name(),
+            "generate_seconds": generate_seconds,
+            "benchmarks": benchmarks,
+        }
+
+        print(f"\n{size} books")
+        print(f"{'benchmark':<26} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+        for name, stats in benchmarks.items():
+            print(f"{name:<26} {stats['mean_ms']:>10.3f} {stats['p50_ms']:>10.3f} {stats['p95_ms']:>10.3f} {stats['p99_ms']:>10.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
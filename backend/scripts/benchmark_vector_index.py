@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Script to benchmark the approximate (IVF) embedding index against exact search.
+Reports recall@k and query latency for a range of nprobe values, using either
+synthetic embeddings or the embeddings stored in the database.
+"""
+
+import sys
+import time
+import json
+import argparse
+import logging
+from pathlib import Path
+import numpy as np
+
+# Add the parent directory to sys.path to allow importing from the app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.db.embedding_index import EmbeddingIndex, IVFFlatIndex
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def synthetic_embeddings(num_books, dim, num_topics=64, noise=0.6, seed=0):
+    """
+    Generate clustered unit-norm embeddings that loosely mimic a book catalog.
+
+    Args:
+        num_books: Number of embeddings to generate
+        dim: Embedding dimension
+        num_topics: Number of topic clusters
+        noise: Spread of books around their topic
+        seed: Random seed
+
+    Returns:
+        Tuple of (book IDs, float32 embedding matrix)
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(num_topics, dim))
+    labels = rng.integers(0, num_topics, size=num_books)
+    vectors = topics[labels] + noise * rng.normal(size=(num_books, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return [f"book-{i}" for i in range(num_books)], vectors.astype(np.float32)
+
+def database_embeddings():
+    """Load every stored embedding from the database."""
+    from app.db.database import SessionLocal
+    from app.db.models import BookEmbedding, unpack_embedding
+
+    db = SessionLocal()
+    try:
+        rows = db.query(BookEmbedding.book_id, BookEmbedding.embedding, BookEmbedding.embedding_dtype).all()
+    finally:
+        db.close()
+
+    return (
+        [str(book_id) for book_id, _, _ in rows],
+        np.asarray([unpack_embedding(embedding, dtype) for _, embedding, dtype in rows], dtype=np.float32)
+    )
+
+def recall_at_k(index, exact, queries, k):
+    """
+    Measure recall@k and latency of an index against exact search.
+
+    Returns:
+        Tuple of (mean recall, mean latency in ms, p95 latency in ms)
+    """
+    recalls, latencies = [], []
+    for query in queries:
+        expected = {book_id for book_id, _ in exact.search(query, k)}
+        start = time.perf_counter()
+        found = index.search(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(expected & {book_id for book_id, _ in found}) / k)
+
+    return float(np.mean(recalls)), float(np.mean(latencies)), float(np.percentile(latencies, 95))
+
+def main():
+    """
+    Main function to run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-books", type=int, default=100000, help="Synthetic catalog size")
+    parser.add_argument("--dim", type=int, default=256, help="Synthetic embedding dimension")
+    parser.add_argument("--from-db", action="store_true", help="Use embeddings stored in the database")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("-k", type=int, default=10, help="Number of neighbours per query")
+    parser.add_argument("--nlist", type=int, default=0, help="Number of IVF lists, 0 for sqrt(n)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32], help="nprobe values to try")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.from_db:
+        book_ids, vectors = database_embeddings()
+    else:
+        book_ids, vectors = synthetic_embeddings(args.num_books, args.dim)
+    logger.info(f"Benchmarking {len(book_ids)} embeddings of dimension {vectors.shape[1]}")
+
+    # Queries are perturbed catalog vectors, like a preference vector built from read books
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(vectors), size=args.queries)
+    queries = vectors[picks] + 0.3 * rng.normal(size=(args.queries, vectors.shape[1])) / np.sqrt(vectors.shape[1])
+
+    exact = EmbeddingIndex()
+    exact.load(book_ids, vectors)
+
+    ivf = IVFFlatIndex(nlist=args.nlist, min_train_size=0)
+    start = time.perf_counter()
+    ivf.load(book_ids, vectors)
+    logger.info(f"Built IVF index in {time.perf_counter() - start:.2f}s")
+
+    _, exact_mean, exact_p95 = recall_at_k(exact, exact, queries, args.k)
+    results = [{"index": "exact", "recall": 1.0, "mean_ms": exact_mean, "p95_ms": exact_p95}]
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        recall, mean_ms, p95_ms = recall_at_k(ivf, exact, queries, args.k)
+        results.append({"index": f"ivf nprobe={nprobe}", "recall": recall, "mean_ms": mean_ms, "p95_ms": p95_ms})
+
+    print(f"{'index':<18} {'recall@' + str(args.k):>10} {'mean ms':>10} {'p95 ms':>10}")
+    for row in results:
+        print(f"{row['index']:<18} {row['recall']:>10.3f} {row['mean_ms']:>10.3f} {row['p95_ms']:>10.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"num_books": len(book_ids), "k": args.k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Script to check how long a fresh worker takes to import the API.
+Runs 'python -X importtime -c "import app.main"' in new interpreters, reports
+the median cumulative import time and the modules that cost the most, and
+exits with an error if the time is over budget or a module kept off the
+startup path (such as the OpenAI SDK, which is loaded on first use) is imported.
+"""
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Modules that must not be imported when a worker starts
+DEFAULT_FORBIDDEN = ["sklearn", "pandas", "scipy", "openai"]
+
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+def measure(module):
+    """
+    Import a module in a new interpreter with -X importtime.
+
+    Args:
+        module: Module to import
+
+    Returns:
+        Mapping of every imported module to its (self, cumulative) time in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    )
+    if result.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            timings[name] = (int(self_us), int(cumulative_us))
+    return timings
+
+def main():
+    """
+    Main function to check the import time budget.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="app.main", help="Module to import")
+    parser.add_argument(
+        "--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", 1500)),
+        help="Maximum median cumulative import time"
+    )
+    parser.add_argument("--runs", type=int, default=3, help="Interpreters to start; the median is compared")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest modules to list")
+    parser.add_argument("--forbid", nargs="*", default=DEFAULT_FORBIDDEN, help="Top-level packages that must not be imported")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    total_ms = statistics.median(timings[args.module][1] for timings in runs) / 1000
+    timings = runs[-1]
+
+    print(f"{args.module} imports in {total_ms:.0f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    print(f"{'module':<50} {'self ms':>10} {'total ms':>10}")
+    for name, (self_us, cumulative_us) in sorted(timings.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"{name:<50} {self_us / 1000:>10.1f} {cumulative_us / 1000:>10.1f}")
+
+    failed = False
+    forbidden = sorted({name.split(".")[0] for name in timings} & set(args.forbid))
+    if forbidden:
+        print(f"Imported at startup but should be loaded lazily or not at all: {', '.join(forbidden)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"Import time is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+"""
+Script to serve a local stand-in for the OpenAI embeddings and chat completions APIs.
+Embeddings are deterministic unit vectors derived from the input text, and chat
+completions recommend the candidate books listed in the prompt, so the API can be
+load-tested without API credits or rate limits. Latency, errors and rate limiting
+are configurable. Point the app at it with OPENAI_BASE_URL=http://HOST:PORT/v1.
+"""
+
+import re
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Add the parent directory to sys.path to allow importing from the app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings
+from generate_embeddings import LocalEmbedder
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+BOOK_ID_PATTERN = re.compile(r'"id": "([0-9a-f-]{36})"')
+COUNT_PATTERN = re.compile(r"Select exactly (\d+) books")
+
+def recommendation_reply(prompt):
+    """
+    A chat reply recommending books from a refinement prompt.
+
+    The last books listed in the prompt are the similarity search candidates,
+    so the reply picks as many of those as the prompt asks for.
+
+    Args:
+        prompt: The user message sent by RecommendationService
+
+    Returns:
+        JSON text in the format the prompt asks for
+    """
+    match = COUNT_PATTERN.search(prompt)
+    count = int(match.group(1)) if match else settings.NUM_RECOMMENDATIONS
+    book_ids = BOOK_ID_PATTERN.findall(prompt)
+    return json.dumps({
+        "recommendations": [{"id": book_id, "reason": "Similar themes"} for book_id in book_ids[-count:]],
+        "explanation": "Books close to the student's recent reading."
+    })
+
+class FakeOpenAIConfig:
+    """Behaviour of the fake server, and counters of what it has served."""
+
+    def __init__(
+        self,
+        embedding_latency=0.05,
+        chat_latency=1.0,
+        jitter=0.2,
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        retry_after=1.0,
+        dimensions=settings.EMBEDDING_DIMENSIONS,
+        seed=0
+    ):
+        """
+        Args:
+            embedding_latency: Mean seconds to answer an embeddings request
+            chat_latency: Mean seconds to answer a chat completion
+            jitter: Latencies vary uniformly by this fraction either way
+            error_rate: Fraction of requests answered with a 500
+            rate_limit_rate: Fraction of requests answered with a 429
+            retry_after: Seconds sent in the Retry-After header of a 429
+            dimensions: Width of the embeddings
+            seed: Random seed for latencies and injected failures
+        """
+        self.embedding_latency = embedding_latency
+        self.chat_latency = chat_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.embedder = LocalEmbedder(dimensions, latency=0)
+        self.counts = {"embeddings": 0, "chat": 0, "errors": 0, "rate_limited": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def latency(self, mean):
+        """A latency around mean."""
+        with self._lock:
+            return mean * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def failure(self):
+        """The status of an injected failure for the next request, or None."""
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.error_rate:
+            return 500
+        if draw < self.error_rate + self.rate_limit_rate:
+            return 429
+        return None
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+def make_handler(config):
+    """A request handler class serving the fake API with the given configuration."""
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep connections open, like the real API, so client connection pools are exercised
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._respond(200, config.counts)
+            else:
+                self._respond(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+            if self.path.endswith("/embeddings"):
+                time.sleep(config.latency(config.embedding_latency))
+            elif self.path.endswith("/chat/completions"):
+                time.sleep(config.latency(config.chat_latency))
+            else:
+                self._respond(404, {"error": {"message": "not found"}})
+                return
+
+            status = config.failure()
+            if status == 500:
+                config.count("errors")
+                self._respond(500, {"error": {"message": "injected failure", "type": "server_error"}})
+                return
+            if status == 429:
+                config.count("rate_limited")
+                self._respond(
+                    429,
+                    {"error": {"message": "rate limited", "type": "rate_limit_exceeded"}},
+                    {"retry-after": str(config.retry_after)}
+                )
+                return
+
+            if self.path.endswith("/embeddings"):
+                self._embeddings(body)
+            else:
+                self._chat(body)
+
+        def _embeddings(self, body):
+            config.count("embeddings")
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            data = []
+            for i, text in enumerate(texts):
+                embedding = config.embedder.embed(text)
+                if body.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(embedding.astype("<f4").tobytes()).decode("ascii")
+                else:
+                    embedding = embedding.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+            tokens = sum(len(text) // 4 + 1 for text in texts)
+            self._respond(200, {
+                "object": "list",
+                "data": data,
+                "model": body["model"],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+
+        def _chat(self, body):
+            config.count("chat")
+            content = recommendation_reply(body["messages"][-1]["content"])
+            usage = {"prompt_tokens": 1000, "completion_tokens": 150, "total_tokens": 1150}
+
+            if not body.get("stream"):
+                self._respond(200, {
+                    "id": "chatcmpl-local",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }],
+                    "usage": usage,
+                })
+                return
+
+            # Server-sent events in a few pieces, then a usage-only chunk; the connection is closed to end the stream
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            chunk = {"id": "chatcmpl-local", "object": "chat.completion.chunk", "created": int(time.time()), "model": body["model"]}
+            size = max(1, len(content) // 8)
+            for start in range(0, len(content), size):
+                delta = {"content": content[start:start + size]}
+                self._send_event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            self._send_event({**chunk, "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def _send_event(self, payload):
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+            self.wfile.flush()
+
+        def _respond(self, status, payload, headers=None):
+            content = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def serve(config, host="127.0.0.1", port=8100):
+    """
+    Start the fake API on a background thread.
+
+    Args:
+        config: FakeOpenAIConfig
+        host: Interface to listen on
+        port: Port to listen on, 0 for any free port
+
+    Returns:
+        The running ThreadingHTTPServer; call shutdown() to stop it
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    """
+    Main function to run the fake API until interrupted.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8100, help="Port to listen on")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Mean seconds per embeddings request")
+    parser.add_argument("--chat-latency", type=float, default=1.0, help="Mean seconds per chat completion")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency variation as a fraction of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests rejected with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--dimensions", type=int, default=settings.EMBEDDING_DIMENSIONS, help="Embedding width")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for latencies and failures")
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(
+        embedding_latency=args.embedding_latency,
+        chat_latency=args.chat_latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        dimensions=args.dimensions,
+        seed=args.seed
+    )
+    server = serve(config, args.host, args.port)
+    logger.info(f"Serving a fake OpenAI API; set OPENAI_BASE_URL=http://{args.host}:{server.server_port}/v1")
+
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Served {config.counts}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
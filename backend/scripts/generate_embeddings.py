@@ -1,24 +1,35 @@
 #!/usr/bin/env python
 """
 Script to generate and store embeddings for books in the database.
-This script reads book data, generates embeddings using OpenAI's API,
-and stores them in the PostgreSQL database.
+This script streams books from the database in chunks, generates embeddings
+using OpenAI's API with several concurrent workers, and bulk-writes them to
+the PostgreSQL database. Progress is checkpointed after every chunk, so an
+interrupted run resumes where it stopped. With --dry-run a deterministic local
+embedder replaces the API and nothing is written, to benchmark the pipeline offline.
 """
 
-import os
 import sys
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import argparse
 import logging
+from datetime import datetime
 from pathlib import Path
 import numpy as np
 from dotenv import load_dotenv
-from openai import OpenAI
+from sqlalchemy import func, insert, select, update
 
 # Add the parent directory to sys.path to allow importing from the app
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from app.core.config import settings
-from app.db.database import SessionLocal
-from app.db.models import Book, BookEmbedding
+from app.db.database import AsyncSessionLocal
+from app.db.models import Book, BookEmbedding, pack_embedding
+from app.db.vector_store import VectorStore
+from app.services.embedding_service import EmbeddingService
 
 # Configure logging
 logging.basicConfig(
@@ -31,88 +42,319 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-def create_book_embedding(client, book):
+# Number of books read, embedded and committed together
+CHUNK_SIZE = 256
+
+# Where progress is recorded between runs
+CHECKPOINT_PATH = Path(settings.CACHE_DIR) / "generate_embeddings.checkpoint.json"
+
+class LocalEmbedder:
+    """
+    Deterministic stand-in for the embeddings API, used by --dry-run.
+    
+    Each text always maps to the same unit vector, and every call sleeps
+    for a fixed latency to imitate an API round trip.
     """
-    Generate embedding for a book's description using OpenAI's API.
+    
+    def __init__(self, dimensions, latency):
+        """
+        Args:
+            dimensions: Width of the generated vectors
+            latency: Seconds each call takes
+        """
+        self.dimensions = dimensions
+        self.latency = latency
+    
+    def embed(self, text):
+        """The embedding of one text."""
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+    
+    async def create_embeddings_batch(self, texts, db=None):
+        """Embed texts like EmbeddingService.create_embeddings_batch."""
+        await asyncio.sleep(self.latency)
+        return [self.embed(text) for text in texts]
+
+class Checkpoint:
+    """
+    Last book of the longest run of completed chunks, persisted as JSON.
+    
+    Chunks are finished by concurrent workers in any order; the checkpoint
+    only moves past a chunk once every chunk before it has been committed.
+    """
+    
+    def __init__(self, path, model, last_book_id=None, counts=None):
+        self.path = path
+        self.model = model
+        self.last_book_id = last_book_id
+        self.counts = counts or {"embedded": 0, "skipped": 0, "failed": 0}
+        self._next_chunk = 0
+        self._finished = {}
+    
+    @classmethod
+    def load(cls, path, model):
+        """Load the checkpoint of an interrupted run with the same model, or start a new one."""
+        if path.exists():
+            state = json.loads(path.read_text())
+            if state.get("model") == model:
+                return cls(path, model, uuid.UUID(state["last_book_id"]), state["counts"])
+            logger.info(f"Ignoring checkpoint for model {state.get('model')}")
+        return cls(path, model)
+    
+    def finish(self, chunk, last_book_id, counts, save=True):
+        """
+        Record a committed chunk.
+        
+        Args:
+            chunk: Sequence number of the chunk, from 0
+            last_book_id: ID of the last book in the chunk
+            counts: Books embedded, skipped and failed in the chunk
+            save: Write the checkpoint file
+        """
+        for key, value in counts.items():
+            self.counts[key] += value
+        self._finished[chunk] = last_book_id
+        
+        advanced = False
+        while self._next_chunk in self._finished:
+            self.last_book_id = self._finished.pop(self._next_chunk)
+            self._next_chunk += 1
+            advanced = True
+        
+        if advanced and save:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = self.path.with_suffix(".tmp")
+            temporary.write_text(json.dumps({
+                "model": self.model,
+                "last_book_id": str(self.last_book_id),
+                "counts": self.counts,
+            }))
+            temporary.replace(self.path)
+    
+    def clear(self):
+        """Remove the checkpoint file after a complete run."""
+        self.path.unlink(missing_ok=True)
+
+async def read_chunks(session_factory, queue, after_book_id, chunk_size, workers):
+    """
+    Stream books in ID order and queue the ones needing an embedding, chunk by chunk.
     
     Args:
-        client: OpenAI client instance
-        book: Book object
+        session_factory: Creates database sessions
+        queue: Queue receiving (chunk number, last book ID, books to embed, chunk size)
+        after_book_id: Resume after this book, or None to start from the first
+        chunk_size: Number of books per chunk
+        workers: Number of workers, each sent a final None
+    """
+    async with session_factory() as db:
+        # What is already stored, loaded once instead of checked per book
+        stored = {
+            book_id: (embedding_id, model, text_hash)
+            for embedding_id, book_id, model, text_hash in
+            (await db.execute(
+                select(BookEmbedding.id, BookEmbedding.book_id, BookEmbedding.model, BookEmbedding.text_hash)
+            )).all()
+        }
+        
+        query = select(Book).order_by(Book.id).execution_options(yield_per=chunk_size)
+        if after_book_id is not None:
+            query = query.where(Book.id > after_book_id)
+        
+        result = await db.stream_scalars(query)
+        chunk = 0
+        async for books in result.partitions():
+            pending = []
+            for book in books:
+                book_dict = book.to_dict()
+                text_hash = EmbeddingService.book_text_hash(book_dict)
+                embedding_id, model, stored_hash = stored.get(book.id, (None, None, None))
+                if (model, stored_hash) != (settings.EMBEDDING_MODEL, text_hash):
+                    pending.append((book.id, embedding_id, EmbeddingService.build_book_text(book_dict), text_hash))
+            await queue.put((chunk, books[-1].id, pending, len(books)))
+            chunk += 1
     
-    Returns:
-        Tuple containing the book and its embedding
+    for _ in range(workers):
+        await queue.put(None)
+
+async def embed_chunks(session_factory, embedder, queue, checkpoint, progress, dry_run):
     """
-    # Create a rich text to generate embeddings for
-    text_for_embedding = f"""
-    Title: {book.title}
-    Author: {book.author}
-    Genre: {book.genre}
-    Description: {book.description}
-    Publication Year: {book.publication_year}
+    Embed and store queued chunks until the reader is done.
+    
+    Args:
+        session_factory: Creates database sessions
+        embedder: EmbeddingService, or LocalEmbedder for dry runs
+        queue: Queue filled by read_chunks
+        checkpoint: Checkpoint recording committed chunks
+        progress: Progress report to update
+        dry_run: Roll back instead of committing
     """
+    while (item := await queue.get()) is not None:
+        chunk, last_book_id, pending, size = item
+        counts = {"embedded": 0, "skipped": size - len(pending), "failed": 0}
+        
+        if pending:
+            async with session_factory() as db:
+                embeddings = await embedder.create_embeddings_batch(
+                    [text for _, _, text, _ in pending], db=None if dry_run else db
+                )
+                
+                now = datetime.utcnow()
+                inserts, updates, saved = [], [], {}
+                for (book_id, embedding_id, _, text_hash), embedding in zip(pending, embeddings):
+                    if embedding is None:
+                        counts["failed"] += 1
+                        continue
+                    
+                    packed, dtype = pack_embedding(embedding)
+                    row = {
+                        "embedding": packed,
+                        "embedding_dtype": dtype,
+                        "model": settings.EMBEDDING_MODEL,
+                        "text_hash": text_hash,
+                        "updated_at": now,
+                    }
+                    if embedding_id is None:
+                        inserts.append({**row, "id": uuid.uuid4(), "book_id": book_id, "created_at": now})
+                    else:
+                        updates.append({**row, "id": embedding_id})
+                    saved[str(book_id)] = embedding
+                
+                # One multi-row statement each for new rows and stale rows
+                if inserts:
+                    await db.execute(insert(BookEmbedding), inserts)
+                if updates:
+                    await db.execute(update(BookEmbedding), updates)
+                await VectorStore.write_vectors(db, saved)
+                
+                if dry_run:
+                    await db.rollback()
+                else:
+                    await db.commit()
+                counts["embedded"] = len(saved)
+        
+        checkpoint.finish(chunk, last_book_id, counts, save=not dry_run)
+        progress.update(size, counts)
+
+class Progress:
+    """Periodic log of books processed, throughput and time remaining."""
+    
+    def __init__(self, total, interval=5.0):
+        """
+        Args:
+            total: Number of books this run will process
+            interval: Minimum seconds between log lines
+        """
+        self.total = total
+        self.interval = interval
+        self.processed = 0
+        self.counts = {"embedded": 0, "skipped": 0, "failed": 0}
+        self.started = time.perf_counter()
+        self._logged = self.started
     
-    try:
-        response = client.embeddings.create(
-            input=text_for_embedding.strip(),
-            model="text-embedding-3-small"  # Using the latest embedding model
+    def update(self, size, counts):
+        """Add a finished chunk and log if the interval has passed."""
+        self.processed += size
+        for key, value in counts.items():
+            self.counts[key] += value
+        
+        now = time.perf_counter()
+        if now - self._logged >= self.interval or self.processed == self.total:
+            self._logged = now
+            logger.info(self.report())
+    
+    def report(self):
+        """One line describing progress so far."""
+        elapsed = time.perf_counter() - self.started
+        rate = self.processed / elapsed if elapsed else 0.0
+        remaining = (self.total - self.processed) / rate if rate else 0.0
+        return (
+            f"{self.processed}/{self.total} books, {self.counts['embedded']} embedded, "
+            f"{self.counts['skipped']} up to date, {self.counts['failed']} failed - "
+            f"{rate:.1f} books/s, {self.counts['embedded'] / elapsed if elapsed else 0.0:.1f} embeddings/s, "
+            f"about {remaining:.0f}s left"
         )
-        embedding = response.data[0].embedding
-        return book, embedding
-    except Exception as e:
-        logger.error(f"Error generating embedding for book {book.title}: {e}")
-        return book, None
+
+async def backfill(
+    embedder,
+    session_factory=AsyncSessionLocal,
+    checkpoint_path=CHECKPOINT_PATH,
+    chunk_size=CHUNK_SIZE,
+    workers=settings.OPENAI_MAX_CONCURRENCY,
+    dry_run=False,
+    restart=False
+):
+    """
+    Generate and store embeddings for every book missing an up-to-date one.
+    
+    Args:
+        embedder: EmbeddingService, or LocalEmbedder for dry runs
+        session_factory: Creates database sessions
+        checkpoint_path: File recording progress between runs
+        chunk_size: Number of books per chunk
+        workers: Number of chunks embedded concurrently
+        dry_run: Embed without writing anything
+        restart: Ignore the checkpoint of an interrupted run
+    
+    Returns:
+        The final Progress
+    """
+    checkpoint = Checkpoint(checkpoint_path, settings.EMBEDDING_MODEL)
+    if not restart and not dry_run:
+        checkpoint = Checkpoint.load(checkpoint_path, settings.EMBEDDING_MODEL)
+        if checkpoint.last_book_id is not None:
+            logger.info(f"Resuming after book {checkpoint.last_book_id}: {checkpoint.counts}")
+    
+    async with session_factory() as db:
+        query = select(func.count(Book.id))
+        if checkpoint.last_book_id is not None:
+            query = query.where(Book.id > checkpoint.last_book_id)
+        total = await db.scalar(query)
+    logger.info(f"{total} books to check with {workers} workers")
+    
+    progress = Progress(total)
+    # Bounded, so reading never runs far ahead of embedding
+    queue = asyncio.Queue(maxsize=workers * 2)
+    await asyncio.gather(
+        read_chunks(session_factory, queue, checkpoint.last_book_id, chunk_size, workers),
+        *[
+            embed_chunks(session_factory, embedder, queue, checkpoint, progress, dry_run)
+            for _ in range(workers)
+        ]
+    )
+    
+    if not dry_run:
+        checkpoint.clear()
+    if progress.counts["failed"]:
+        logger.warning(f"{progress.counts['failed']} books could not be embedded; run the script again to retry them")
+    return progress
 
 def main():
     """
     Main function to generate and store embeddings for all books.
     """
-    # Initialize OpenAI client
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    if not openai_api_key:
-        logger.error("OpenAI API key not found. Please set OPENAI_API_KEY in your environment.")
-        sys.exit(1)
-    
-    client = OpenAI(api_key=openai_api_key)
-    logger.info("OpenAI client initialized")
-    
-    # Initialize database session
-    db = SessionLocal()
-    
-    try:
-        # Get all books from the database
-        books = db.query(Book).all()
-        logger.info(f"Found {len(books)} books in the database")
-        
-        if not books:
-            logger.error("No books found in database")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Books read, embedded and committed together")
+    parser.add_argument("--workers", type=int, default=settings.OPENAI_MAX_CONCURRENCY, help="Chunks embedded concurrently")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint of an interrupted run")
+    parser.add_argument("--dry-run", action="store_true", help="Use a local embedder and write nothing")
+    parser.add_argument("--dry-run-latency", type=float, default=0.2, help="Seconds per local embedding call")
+    args = parser.parse_args()
+    
+    if args.dry_run:
+        embedder = LocalEmbedder(settings.EMBEDDING_DIMENSIONS, args.dry_run_latency)
+    else:
+        # Check the OpenAI API key
+        if not settings.OPENAI_API_KEY:
+            logger.error("OpenAI API key not found. Please set OPENAI_API_KEY in your environment.")
             sys.exit(1)
-        
-        # Generate embeddings for each book
-        for book in books:
-            # Skip if embedding already exists
-            existing_embedding = db.query(BookEmbedding).filter(BookEmbedding.book_id == book.id).first()
-            if existing_embedding:
-                logger.info(f"Embedding already exists for book {book.title}")
-                continue
-            
-            logger.info(f"Generating embedding for book: {book.title}")
-            book_obj, embedding = create_book_embedding(client, book)
-            
-            if embedding:
-                # Store the embedding in the database
-                new_embedding = BookEmbedding(
-                    book_id=book.id,
-                    embedding=embedding
-                )
-                db.add(new_embedding)
-                db.commit()
-                logger.info(f"Stored embedding for book: {book.title}")
-            else:
-                logger.warning(f"Failed to generate embedding for book: {book.title}")
-        
-        logger.info("Embedding generation complete")
-    finally:
-        db.close()
+        embedder = EmbeddingService()
+    logger.info("Embedding service initialized")
+    
+    progress = asyncio.run(backfill(
+        embedder, chunk_size=args.chunk_size, workers=args.workers, dry_run=args.dry_run, restart=args.restart
+    ))
+    logger.info(f"Embedding generation complete: {progress.report()}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
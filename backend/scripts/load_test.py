@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+Script to load-test a running API with the librarian recommendation scenario.
+Each virtual user logs in, then repeatedly picks a student and requests their
+reading history, their recommendations and books similar to their latest read.
+Reports throughput and latency percentiles per step. Run the API against the
+fake OpenAI server (scripts/fake_openai_server.py) to avoid API costs and limits.
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+import httpx
+import numpy as np
+from sqlalchemy import select
+
+# Add the parent directory to sys.path to allow importing from the app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+STEPS = ("login", "reading_history", "recommendations", "similar_books")
+
+class Recorder:
+    """Latencies and status codes of every request, per scenario step."""
+
+    def __init__(self):
+        self.latencies = {step: [] for step in STEPS}
+        self.statuses = {step: {} for step in STEPS}
+        self.scenarios = 0
+
+    async def request(self, client, step, method, url, **kwargs):
+        """
+        Send a request and record how it went.
+
+        Returns:
+            The response, or None if the request could not be sent
+        """
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            logger.debug(f"{step} failed: {e}")
+            response, status = None, type(e).__name__
+        self.latencies[step].append(time.perf_counter() - started)
+        self.statuses[step][status] = self.statuses[step].get(status, 0) + 1
+        return response
+
+    def report(self, elapsed, concurrency):
+        """
+        Summarize the run.
+
+        Args:
+            elapsed: Seconds the run took
+            concurrency: Number of virtual users
+
+        Returns:
+            Throughput and latency percentiles, overall and per step
+        """
+        steps = {}
+        for step in STEPS:
+            latencies = np.asarray(self.latencies[step]) * 1000
+            if not len(latencies):
+                continue
+            errors = sum(count for status, count in self.statuses[step].items() if not status.startswith("2"))
+            steps[step] = {
+                "requests": int(len(latencies)),
+                "errors": errors,
+                "statuses": self.statuses[step],
+                "requests_per_second": len(latencies) / elapsed,
+                "mean_ms": float(latencies.mean()),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p90_ms": float(np.percentile(latencies, 90)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "max_ms": float(latencies.max()),
+            }
+
+        requests = sum(step["requests"] for step in steps.values())
+        return {
+            "concurrency": concurrency,
+            "elapsed_seconds": elapsed,
+            "scenarios": self.scenarios,
+            "scenarios_per_second": self.scenarios / elapsed,
+            "requests_per_second": requests / elapsed,
+            "error_rate": sum(step["errors"] for step in steps.values()) / requests if requests else 0.0,
+            "steps": steps,
+        }
+
+async def login(client, recorder, email, password):
+    """Log in and return the bearer token, or None if login failed."""
+    response = await recorder.request(
+        client, "login", "POST", f"{settings.API_V1_STR}/auth/login",
+        data={"username": email, "password": password}
+    )
+    if response is None or response.status_code != 200:
+        return None
+    return response.json()["access_token"]
+
+async def virtual_user(client, recorder, email, password, student_ids, deadline, iterations, refresh, relogin, rng):
+    """
+    Run the scenario repeatedly until the deadline or the iteration count is reached.
+
+    Args:
+        client: HTTP client for the API
+        recorder: Recorder collecting the results
+        email: Librarian account to log in with
+        password: Password of the account
+        student_ids: Students to request recommendations for
+        deadline: perf_counter time to stop at, or None
+        iterations: Scenarios to run, or None to run until the deadline
+        refresh: Generate recommendations live instead of serving precomputed ones
+        relogin: Log in at the start of every scenario rather than once
+        rng: Random generator picking students
+    """
+    prefix = f"{settings.API_V1_STR}/recommendations"
+    token = None
+    completed = 0
+
+    while (iterations is None or completed < iterations) and (deadline is None or time.perf_counter() < deadline):
+        if token is None or relogin:
+            token = await login(client, recorder, email, password)
+            if token is None:
+                # A failed login ends the scenario; back off so a broken account does not spin
+                completed += 1
+                await asyncio.sleep(1.0)
+                continue
+        headers = {"Authorization": f"Bearer {token}"}
+        student_id = rng.choice(student_ids)
+
+        response = await recorder.request(
+            client, "reading_history", "GET", f"{prefix}/users/{student_id}/reading-history", headers=headers
+        )
+        history = response.json() if response is not None and response.status_code == 200 else []
+
+        await recorder.request(
+            client, "recommendations", "GET", f"{prefix}/users/{student_id}/recommendations",
+            headers=headers, params={"refresh": str(refresh).lower()}
+        )
+
+        if history:
+            await recorder.request(
+                client, "similar_books", "GET", f"{prefix}/books/{history[0]['id']}/similar", headers=headers
+            )
+
+        recorder.scenarios += 1
+        completed += 1
+
+async def run_load_test(
+    base_url,
+    email,
+    password,
+    student_ids,
+    concurrency=10,
+    duration=60.0,
+    iterations=None,
+    ramp_up=0.0,
+    refresh=False,
+    relogin=True,
+    timeout=120.0,
+    transport=None,
+    seed=0
+):
+    """
+    Run the scenario with concurrent virtual users.
+
+    Args:
+        base_url: Root URL of the API
+        email: Librarian account to log in with
+        password: Password of the account
+        student_ids: Students to request recommendations for
+        concurrency: Number of virtual users
+        duration: Seconds to run for, when iterations is None
+        iterations: Scenarios per virtual user, instead of a duration
+        ramp_up: Seconds over which virtual users start
+        refresh: Generate recommendations live instead of serving precomputed ones
+        relogin: Log in at the start of every scenario rather than once per virtual user
+        timeout: Seconds before a request is abandoned
+        transport: Optional httpx transport, e.g. to call an ASGI app in-process
+        seed: Random seed for student choices
+
+    Returns:
+        The report from Recorder.report
+    """
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits, transport=transport) as client:
+        async def start(i):
+            await asyncio.sleep(ramp_up * i / concurrency)
+            await virtual_user(
+                client, recorder, email, password, student_ids, deadline, iterations,
+                refresh, relogin, random.Random(seed + i)
+            )
+
+        started = time.perf_counter()
+        deadline = started + duration if iterations is None else None
+        await asyncio.gather(*[start(i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    return recorder.report(elapsed, concurrency)
+
+def load_student_ids(limit):
+    """Read student IDs from the database."""
+    from app.db.database import SessionLocal
+    from app.db.models import User
+
+    db = SessionLocal()
+    try:
+        return [str(user_id) for user_id in db.scalars(select(User.id).where(User.role == "student").limit(limit))]
+    finally:
+        db.close()
+
+def main():
+    """
+    Main function to run the load test.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", type=str, default=f"http://localhost:{settings.PORT}", help="Root URL of the API")
+    parser.add_argument("--email", type=str, required=True, help="Librarian account to log in with")
+    parser.add_argument("--password", type=str, required=True, help="Password of the librarian account")
+    parser.add_argument("--student-ids", type=Path, help="File with one student ID per line; read from the database otherwise")
+    parser.add_argument("--students", type=int, default=1000, help="Students read from the database")
+    parser.add_argument("--concurrency", type=int, default=10, help="Virtual users")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run for")
+    parser.add_argument("--iterations", type=int, help="Scenarios per virtual user, instead of --duration")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which virtual users start")
+    parser.add_argument("--refresh", action="store_true", help="Generate recommendations live instead of serving precomputed ones")
+    parser.add_argument("--login-once", action="store_true", help="Log in once per virtual user instead of every scenario")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for student choices")
+    parser.add_argument("--output", type=str, help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    if args.student_ids:
+        student_ids = [line.strip() for line in args.student_ids.read_text().splitlines() if line.strip()]
+    else:
+        student_ids = load_student_ids(args.students)
+    if not student_ids:
+        sys.exit("No student IDs to request recommendations for")
+
+    logger.info(f"{args.concurrency} virtual users against {args.base_url}, {len(student_ids)} students")
+    report = asyncio.run(run_load_test(
+        args.base_url, args.email, args.password, student_ids,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        iterations=args.iterations,
+        ramp_up=args.ramp_up,
+        refresh=args.refresh,
+        relogin=not args.login_once,
+        seed=args.seed
+    ))
+
+    print(
+        f"{report['scenarios']} scenarios in {report['elapsed_seconds']:.1f}s: "
+        f"{report['scenarios_per_second']:.2f} scenarios/s, {report['requests_per_second']:.1f} requests/s, "
+        f"{report['error_rate'] * 100:.2f}% errors"
+    )
+    print(f"{'step':<18} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for step, stats in report["steps"].items():
+        print(
+            f"{step:<18} {stats['requests']:>9} {stats['errors']:>7} {stats['requests_per_second']:>8.1f} "
+            f"{stats['p50_ms']:>9.1f} {stats['p90_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Script to precompute book recommendations for every student with a reading history.
+Only students whose borrowed books changed since the last run are recomputed,
+so it is cheap to run nightly. Their reading preference profiles are rebuilt
+first. The API serves the stored results.
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+# Add the parent directory to sys.path to allow importing from the app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings
+from app.db.database import AsyncSessionLocal
+from app.db.models import User
+from app.services.recommendation_service import RecommendationService
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+async def precompute(db, user_ids, num_recommendations, batch_size=100):
+    """
+    Generate and store recommendations for the given users.
+
+    Args:
+        db: Database session
+        user_ids: IDs of the users to recompute
+        num_recommendations: Number of recommendations to store per user
+        batch_size: Number of users whose histories and similarity searches are batched together
+
+    Returns:
+        Tuple of (users updated, users skipped)
+    """
+    recommendation_service = RecommendationService()
+    updated, skipped = 0, 0
+    user_ids = [str(user_id) for user_id in user_ids]
+
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        # Bring preference profiles up to date first; the API only reads them
+        await recommendation_service.preference_service.refresh_profiles(db, batch)
+
+        async for user_id, result in recommendation_service.generate_recommendations_bulk(
+            db, batch, num_recommendations=num_recommendations
+        ):
+            if result["recommendations"]:
+                await recommendation_service.save_recommendations(db, user_id, result, num_recommendations)
+                updated += 1
+            else:
+                logger.warning(f"No recommendations generated for user {user_id}: {result['explanation']}")
+                skipped += 1
+
+        logger.info(f"Processed {min(start + batch_size, len(user_ids))}/{len(user_ids)} students")
+
+    return updated, skipped
+
+async def precompute_students(recompute_all, num_recommendations):
+    """
+    Find the students needing recommendations and precompute them.
+
+    Args:
+        recompute_all: Recompute every student with a history, not only changed ones
+        num_recommendations: Number of recommendations to store per student
+
+    Returns:
+        Tuple of (users updated, users skipped)
+    """
+    async with AsyncSessionLocal() as db:
+        recommendation_service = RecommendationService()
+        if recompute_all:
+            student_ids = (await db.scalars(select(User.id).where(User.role == "student"))).all()
+            user_ids = list(await recommendation_service.get_history_versions(db, student_ids))
+        else:
+            user_ids = await recommendation_service.get_stale_student_ids(db)
+        logger.info(f"{len(user_ids)} students need recommendations computed")
+
+        return await precompute(db, user_ids, num_recommendations)
+
+def main():
+    """
+    Main function to precompute recommendations.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--all", action="store_true", help="Recompute every student, not only changed ones")
+    parser.add_argument(
+        "--num-recommendations", type=int, default=settings.NUM_RECOMMENDATIONS,
+        help="Number of recommendations to store per student"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    updated, skipped = asyncio.run(precompute_students(args.all, args.num_recommendations))
+    logger.info(
+        f"Precomputed recommendations for {updated} students ({skipped} skipped) "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+if __name__ == "__main__":
+    main()
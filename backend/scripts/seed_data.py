@@ -1,25 +1,38 @@
 #!/usr/bin/env python
 """
 Script to seed the database with initial data (books, users, borrowed books).
+With --bulk, large JSON, JSON Lines or CSV files are streamed in batches and
+loaded with COPY on PostgreSQL (multi-row inserts elsewhere), hashing
+passwords in parallel and reporting rows per second.
 """
 
+import io
 import os
 import sys
+import csv
 import json
+import time
 import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
 from datetime import datetime, timedelta
 import uuid
-from passlib.context import CryptContext
 from dotenv import load_dotenv
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 
 # Add the parent directory to sys.path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from app.db.database import SessionLocal, engine, Base
+from app.db.database import SessionLocal, engine
 from app.db.models import Book, User, BorrowedBook
 from app.core.config import settings
+from app.core.passwords import password_hasher
 
 # Configure logging
 logging.basicConfig(
@@ -32,12 +45,17 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Setup password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+DATA_DIR = Path(__file__).resolve().parent / "data"
+
+# Rows inserted per statement and transaction in bulk mode
+BULK_BATCH_SIZE = 5000
+
+# Bytes read at a time when streaming a JSON array
+JSON_READ_SIZE = 1 << 16
 
 def hash_password(password):
     """Hash a password for storing."""
-    return pwd_context.hash(password)
+    return password_hasher.hash_sync(password)
 
 def load_json_data(file_path):
     """Load data from a JSON file."""
@@ -206,16 +224,303 @@ def generate_detailed_description(book):
     from beginning to end, offering insights into human nature and society.
     """.strip()
 
-def create_tables():
-    """Create database tables."""
-    logger.info("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
+def iter_json_array(file, read_size=JSON_READ_SIZE):
+    """
+    Yield the items of a top-level JSON array without reading the whole file.
+
+    Args:
+        file: Text file positioned at the start of the array
+        read_size: Characters read at a time
+
+    Yields:
+        Each array item, parsed
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(read_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array")
+    buffer = buffer[1:]
+    exhausted = False
+    
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(","):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith("]"):
+            return
+        
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # The next item is not complete yet
+            if exhausted:
+                raise
+            chunk = file.read(read_size)
+            exhausted = not chunk
+            buffer += chunk
+            continue
+        
+        yield item
+        buffer = buffer[end:]
+
+def iter_records(path):
+    """
+    Stream records from a JSON array, JSON Lines or CSV file, chosen by extension.
+
+    Args:
+        path: Path of the data file
+
+    Yields:
+        Each record as a dictionary
+    """
+    path = Path(path)
+    with open(path, "r", newline="" if path.suffix == ".csv" else None) as f:
+        if path.suffix == ".csv":
+            yield from csv.DictReader(f)
+        elif path.suffix in (".jsonl", ".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+def batched(iterable, size):
+    """Split an iterable into lists of at most size items."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def _field(record, key, default=None, convert=None):
+    """A record's value, treating missing and empty CSV cells alike."""
+    value = record.get(key)
+    if value is None or value == "":
+        return default
+    return convert(value) if convert else value
+
+def _datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+def _uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+def book_row(book, now):
+    """Column values for a book record."""
+    description = _field(book, "description", "")
+    if len(description) < 100:
+        description = generate_detailed_description(book)
+    copies = _field(book, "copies", 1, int)
+    
+    return {
+        "id": _field(book, "id", None, _uuid) or uuid.uuid4(),
+        "title": book.get("title"),
+        "author": book.get("author"),
+        "isbn": _field(book, "isbn"),
+        "genre": book.get("genre"),
+        "publication_year": _field(book, "publicationYear", None, int),
+        "publisher": _field(book, "publisher"),
+        "description": description,
+        "copies": copies,
+        "copies_available": _field(book, "copiesAvailable", copies, int),
+        "cover_image": _field(book, "coverImage"),
+        "created_at": now,
+        "updated_at": now,
+    }
+
+def user_row(user, hashed_password, now):
+    """Column values for a user record."""
+    return {
+        "id": _field(user, "id", None, _uuid) or uuid.uuid4(),
+        "email": user.get("email"),
+        "first_name": user.get("firstName"),
+        "last_name": user.get("lastName"),
+        "hashed_password": hashed_password,
+        "role": user.get("role"),
+        "student_id": _field(user, "studentId"),
+        "department": _field(user, "department"),
+        "avatar": _field(user, "avatar"),
+        "join_date": _field(user, "joinDate", now, _datetime),
+        "created_at": now,
+        "updated_at": now,
+    }
+
+def borrowed_book_row(item, now):
+    """Column values for a borrowed book record."""
+    borrow_date = _field(item, "borrow_date", now, _datetime)
+    return {
+        "id": _field(item, "id", None, _uuid) or uuid.uuid4(),
+        "book_id": _uuid(item.get("book_id")),
+        "user_id": _uuid(item.get("user_id")),
+        "borrow_date": borrow_date,
+        "due_date": _field(item, "due_date", borrow_date + timedelta(days=14), _datetime),
+        "return_date": _field(item, "return_date", None, _datetime),
+        "status": _field(item, "status", "borrowed"),
+        "created_at": now,
+        "updated_at": now,
+    }
+
+def _copy_value(value):
+    # Unquoted \N is NULL in COPY's CSV format; everything else is quoted
+    if value is None:
+        return r"\N"
+    if isinstance(value, bytes):
+        return '"\\x' + value.hex() + '"'
+    return '"' + str(value).replace('"', '""') + '"'
+
+def insert_rows(connection, table, rows):
+    """
+    Insert rows with COPY on PostgreSQL (psycopg2), or a batched executemany elsewhere.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+        table: Target Table
+        rows: Column value dictionaries, all with the same keys
+    """
+    columns = list(rows[0])
+    
+    if connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2":
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(",".join(_copy_value(row[column]) for column in columns))
+            buffer.write("\n")
+        buffer.seek(0)
+        
+        with connection.connection.dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buffer
+            )
+    else:
+        connection.execute(table.insert(), rows)
+
+def bulk_insert(bind, table, rows, batch_size=BULK_BATCH_SIZE):
+    """
+    Insert a stream of rows batch by batch, committing and reporting throughput after each.
+
+    Args:
+        bind: Engine to insert with
+        table: Target Table
+        rows: Iterable of column value dictionaries
+        batch_size: Rows per batch
+
+    Returns:
+        Number of rows inserted
+    """
+    started = time.perf_counter()
+    inserted = 0
+    
+    for batch in batched(rows, batch_size):
+        with bind.begin() as connection:
+            insert_rows(connection, table, batch)
+        inserted += len(batch)
+        logger.info(f"{table.name}: {inserted} rows, {inserted / (time.perf_counter() - started):.0f} rows/s")
+    
+    elapsed = time.perf_counter() - started
+    logger.info(f"Loaded {inserted} {table.name} in {elapsed:.1f}s ({inserted / elapsed if elapsed else 0:.0f} rows/s)")
+    return inserted
+
+def _table_has_rows(bind, table):
+    with bind.connect() as connection:
+        return connection.scalar(select(func.count()).select_from(table)) > 0
+
+def bulk_seed_books(bind, path, batch_size=BULK_BATCH_SIZE):
+    """Stream books from a data file into the books table."""
+    if _table_has_rows(bind, Book.__table__):
+        logger.info("Books already exist in the database, skipping seeding")
+        return 0
+    
+    now = datetime.utcnow()
+    return bulk_insert(bind, Book.__table__, (book_row(book, now) for book in iter_records(path)), batch_size)
+
+def bulk_seed_users(bind, path, batch_size=BULK_BATCH_SIZE, hash_workers=settings.PASSWORD_HASH_WORKERS):
+    """
+    Stream users from a data file into the users table, hashing passwords in parallel.
+
+    bcrypt releases the GIL, so each batch's passwords are hashed on
+    hash_workers threads at once.
+    """
+    if _table_has_rows(bind, User.__table__):
+        logger.info("Users already exist in the database, skipping seeding")
+        return 0
+    
+    now = datetime.utcnow()
+    with ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="bcrypt") as executor:
+        def rows():
+            for users in batched(iter_records(path), batch_size):
+                hashes = executor.map(password_hasher.hash_sync, [user.get("password") for user in users])
+                for user, hashed_password in zip(users, hashes):
+                    yield user_row(user, hashed_password, now)
+        
+        return bulk_insert(bind, User.__table__, rows(), batch_size)
+
+def bulk_seed_borrowed_books(bind, path, batch_size=BULK_BATCH_SIZE):
+    """Stream borrowed books from a data file, skipping records that reference unknown books or users."""
+    if _table_has_rows(bind, BorrowedBook.__table__):
+        logger.info("Borrowed books already exist in the database, skipping seeding")
+        return 0
+    
+    # Only the IDs are needed to validate references
+    with bind.connect() as connection:
+        book_ids = set(connection.scalars(select(Book.id)))
+        user_ids = set(connection.scalars(select(User.id)))
+    
+    now = datetime.utcnow()
+    skipped = 0
+    
+    def rows():
+        nonlocal skipped
+        for item in iter_records(path):
+            row = borrowed_book_row(item, now)
+            if row["book_id"] in book_ids and row["user_id"] in user_ids:
+                yield row
+            else:
+                skipped += 1
+    
+    inserted = bulk_insert(bind, BorrowedBook.__table__, rows(), batch_size)
+    if skipped:
+        logger.warning(f"Skipped {skipped} borrowed books with an unknown book_id or user_id")
+    return inserted
+
+def _data_file(name):
+    """The first of name.json, name.jsonl and name.csv in the data directory."""
+    for suffix in (".json", ".jsonl", ".csv"):
+        path = DATA_DIR / f"{name}{suffix}"
+        if path.exists():
+            return path
+    return DATA_DIR / f"{name}.json"
+
+def check_schema(bind):
+    """Exit unless the database has every Alembic migration applied."""
+    config = Config()
+    config.set_main_option("script_location", str(Path(__file__).resolve().parent.parent / "alembic"))
+    head = ScriptDirectory.from_config(config).get_current_head()
+    
+    with bind.connect() as connection:
+        current = MigrationContext.configure(connection).get_current_revision()
+    
+    if current != head:
+        sys.exit(f"Database is at migration {current or 'none'}, not {head}; run 'alembic upgrade head' before seeding")
 
 def main():
     """Main function to seed the database."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bulk", action="store_true", help="Stream large JSON, JSON Lines or CSV files with bulk inserts")
+    parser.add_argument("--books", type=Path, default=None, help="Books file for --bulk")
+    parser.add_argument("--users", type=Path, default=None, help="Users file for --bulk")
+    parser.add_argument("--borrowed-books", type=Path, default=None, help="Borrowed books file for --bulk")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help="Rows per insert batch")
+    parser.add_argument("--hash-workers", type=int, default=settings.PASSWORD_HASH_WORKERS, help="Passwords hashed in parallel")
+    args = parser.parse_args()
+    
     try:
-        # Create tables if they don't exist
-        create_tables()
+        # The schema is managed by Alembic, never created here
+        check_schema(engine)
+        
+        if args.bulk:
+            bulk_seed_users(engine, args.users or _data_file("users"), args.batch_size, args.hash_workers)
+            bulk_seed_books(engine, args.books or _data_file("books"), args.batch_size)
+            bulk_seed_borrowed_books(engine, args.borrowed_books or _data_file("borrowed_books"), args.batch_size)
+            logger.info("Database seeding complete")
+            return
         
         # Create a database session
         db = SessionLocal()
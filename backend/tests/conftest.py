@@ -0,0 +1,302 @@
+"""
+Shared test fixtures
+"""
+
+import os
+import asyncio
+import base64
+import json
+import uuid
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Point the application at SQLite and a dummy OpenAI key before any app module is imported
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import numpy as np
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.core.metrics import request_latency, stage_latency
+from app.core.security import user_cache
+from app.db.database import Base
+from app.db.embedding_index import embedding_index
+from app.db.models import Book, User, BorrowedBook
+from app.services.embedding_cache import embedding_cache
+from app.services.recommendation_cache import recommendation_cache
+
+@pytest.fixture
+def run():
+    """Run coroutines on one event loop that lives for the whole test."""
+    loop = asyncio.new_event_loop()
+    try:
+        yield loop.run_until_complete
+    finally:
+        loop.close()
+
+@pytest.fixture
+def db(run):
+    """An in-memory SQLite async session with all tables created."""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    run(create_tables())
+    session = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)()
+    try:
+        yield session
+    finally:
+        run(session.close())
+        run(engine.dispose())
+
+@pytest.fixture
+def count_queries(db):
+    """Count the SQL statements the session executes inside a with-block."""
+    class QueryCounter:
+        def __init__(self):
+            self.count = 0
+            self.active = False
+
+        def __enter__(self):
+            self.count = 0
+            self.active = True
+            return self
+
+        def __exit__(self, *exc_info):
+            self.active = False
+
+    counter = QueryCounter()
+
+    def before_cursor_execute(*args):
+        if counter.active:
+            counter.count += 1
+
+    engine = db.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield counter
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+class FakeOpenAI:
+    """State of the local fake OpenAI endpoint."""
+
+    def __init__(self):
+        self.embedding_requests = []
+        self.encoding_formats = []
+        self.fail_next = 0
+        self.rate_limit_next = 0
+        self.retry_after = "0"
+        self.chat_requests = []
+        self.chat_fail_next = 0
+        self.chat_latency = 0.0
+        self.chat_content = json.dumps({"recommendations": [], "explanation": ""})
+        self.chat_chunk_size = 16
+        self.chat_chunk_delay = 0.0
+        self.chat_cut_after = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def embed(text: str):
+        """The deterministic embedding the fake returns for a text."""
+        return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0]
+
+    @staticmethod
+    def encode(embedding, body):
+        """Encode an embedding the way the request asked for."""
+        if body.get("encoding_format") == "base64":
+            return base64.b64encode(np.asarray(embedding, dtype="<f4").tobytes()).decode()
+        return embedding
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """Serve a fake embeddings endpoint locally and point the settings at it."""
+    state = FakeOpenAI()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self.path.endswith("/chat/completions"):
+                self._chat(body)
+                return
+
+            if state.fail_next > 0:
+                state.fail_next -= 1
+                self._respond(500, {"error": {"message": "injected failure"}})
+                return
+
+            if state.rate_limit_next > 0:
+                state.rate_limit_next -= 1
+                self._respond(429, {"error": {"message": "rate limited"}}, {"retry-after": state.retry_after})
+                return
+
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            state.embedding_requests.append(texts)
+            state.encoding_formats.append(body.get("encoding_format", "float"))
+            # Return items out of order; clients must use the index field
+            data = [
+                {"object": "embedding", "index": i, "embedding": state.encode(state.embed(text), body)}
+                for i, text in reversed(list(enumerate(texts)))
+            ]
+            self._respond(200, {
+                "object": "list",
+                "data": data,
+                "model": body["model"],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+
+        def _chat(self, body):
+            if state.chat_fail_next > 0:
+                state.chat_fail_next -= 1
+                self._respond(500, {"error": {"message": "injected failure"}})
+                return
+
+            with state._lock:
+                state.chat_requests.append(body)
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                time.sleep(state.chat_latency)
+            finally:
+                with state._lock:
+                    state.in_flight -= 1
+
+            if body.get("stream"):
+                self._stream_chat(body)
+                return
+
+            self._respond(200, {
+                "id": "chatcmpl-test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": state.chat_content},
+                }],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+            })
+
+        def _stream_chat(self, body):
+            # Server-sent chunks of chat_content, or its first chat_cut_after characters, then a usage-only chunk
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+
+            content = state.chat_content[:state.chat_cut_after]
+            chunk = {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": body["model"]}
+            for start in range(0, len(content), state.chat_chunk_size):
+                time.sleep(state.chat_chunk_delay)
+                delta = {"content": content[start:start + state.chat_chunk_size]}
+                self._send_event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            if state.chat_cut_after is not None:
+                # Drop the connection part way through the response
+                self.close_connection = True
+                return
+            self._send_event({
+                **chunk,
+                "choices": [],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+            })
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def _send_event(self, payload):
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+            self.wfile.flush()
+
+        def _respond(self, status, payload, headers=None):
+            content = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(settings, "EMBEDDING_RETRY_BACKOFF_SECONDS", 0.0)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture(autouse=True)
+def reset_process_state():
+    """Start every test with an empty embedding index, caches and metrics."""
+    embedding_index.clear()
+    embedding_cache.memory.clear()
+    asyncio.run(recommendation_cache.clear())
+    user_cache.clear()
+    stage_latency.clear()
+    request_latency.clear()
+    yield
+    embedding_index.clear()
+    embedding_cache.memory.clear()
+    asyncio.run(recommendation_cache.clear())
+    user_cache.clear()
+    stage_latency.clear()
+    request_latency.clear()
+
+async def make_book(db, title: str, genre: str = "Fiction") -> Book:
+    """Add a book to the session and return it."""
+    book = Book(
+        id=uuid.uuid4(),
+        title=title,
+        author=f"Author of {title}",
+        genre=genre,
+        publication_year=2000,
+        description=f"A description of {title}",
+        copies=1,
+        copies_available=1,
+    )
+    db.add(book)
+    await db.commit()
+    return book
+
+async def make_user(db, email: str, role: str = "student", department: str = None) -> User:
+    """Add a user to the session and return it."""
+    user = User(
+        id=uuid.uuid4(),
+        email=email,
+        first_name="Test",
+        last_name="User",
+        hashed_password="not-a-real-hash",
+        role=role,
+        department=department,
+    )
+    db.add(user)
+    await db.commit()
+    return user
+
+async def borrow(db, user: User, book: Book, days_ago: int = 0) -> BorrowedBook:
+    """Record a borrow of book by user and return it."""
+    borrow_date = datetime.utcnow() - timedelta(days=days_ago)
+    record = BorrowedBook(
+        id=uuid.uuid4(),
+        book_id=book.id,
+        user_id=user.id,
+        borrow_date=borrow_date,
+        due_date=borrow_date + timedelta(days=14),
+        status="borrowed",
+    )
+    db.add(record)
+    await db.commit()
+    return record
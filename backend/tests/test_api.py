@@ -0,0 +1,70 @@
+"""
+Tests for the API served end to end, with the OpenAI stand-in and the load-test scenario
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.core.config import settings
+from app.core.passwords import password_hasher
+from app.db.database import get_async_db
+from app.db.vector_store import VectorStore
+from app.main import app
+from app.services.embedding_service import EmbeddingService
+from conftest import borrow, make_book, make_user
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+
+def load_script(name, monkeypatch):
+    """Import a script from the scripts directory."""
+    monkeypatch.syspath_prepend(str(SCRIPTS))
+    spec = importlib.util.spec_from_file_location(name, SCRIPTS / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_load_test_scenario_against_the_fake_openai_server(db, run, monkeypatch):
+    fake_openai_server = load_script("fake_openai_server", monkeypatch)
+    load_test = load_script("load_test", monkeypatch)
+
+    config = fake_openai_server.FakeOpenAIConfig(embedding_latency=0, chat_latency=0.01, dimensions=8)
+    server = fake_openai_server.serve(config, port=0)
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+
+    librarian = run(make_user(db, "librarian@example.com", role="librarian"))
+    librarian.hashed_password = password_hasher.hash_sync("secret")
+    student = run(make_user(db, "student@example.com"))
+    books = [run(make_book(db, f"Book {i}")) for i in range(8)]
+    for book in books[:2]:
+        run(borrow(db, student, book))
+    for book in books:
+        text = EmbeddingService.build_book_text(book.to_dict())
+        run(VectorStore.save_embedding(db, str(book.id), config.embedder.embed(text)))
+
+    session_factory = async_sessionmaker(db.bind, autoflush=False, expire_on_commit=False)
+
+    async def get_test_db():
+        async with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = get_test_db
+    try:
+        report = run(load_test.run_load_test(
+            "http://test", "librarian@example.com", "secret", [str(student.id)],
+            concurrency=1, iterations=2, refresh=True, transport=httpx.ASGITransport(app=app)
+        ))
+    finally:
+        app.dependency_overrides.clear()
+        server.shutdown()
+        server.server_close()
+
+    assert report["scenarios"] == 2 and report["error_rate"] == 0.0
+    assert set(report["steps"]) == {"login", "reading_history", "recommendations", "similar_books"}
+    assert all(step["requests"] == 2 for step in report["steps"].values())
+    # The second refinement of the same candidates is served from the recommendation cache
+    assert config.counts["chat"] == 1
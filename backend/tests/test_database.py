@@ -0,0 +1,166 @@
+"""
+Tests for database engine configuration and pool instrumentation
+"""
+
+import csv
+import importlib.util
+import io
+import json
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.core.config import settings
+from app.core.passwords import password_hasher
+from app.db.database import Base, database_url, engine_options
+from app.db.models import Book, BorrowedBook, User
+from app.db.pool import (
+    InstrumentedAsyncQueuePool, InstrumentedNullPool, InstrumentedQueuePool, instrument, pool_stats, render_pool_metrics
+)
+from app.services.recommendation_service import RecommendationService
+from conftest import make_book, make_user
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+
+def test_pool_metrics_track_in_use_overflow_and_checkout_waits(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1, max_overflow=1, pool_timeout=0.1,
+    )
+    instrument(engine)
+
+    first, second = engine.connect(), engine.connect()
+    first.execute(text("SELECT 1"))
+    stats = pool_stats(engine)
+    assert stats["in_use"] == 2 and stats["overflow"] == 1 and stats["checkouts"] == 2
+
+    # Both the pool and its overflow are taken, so a third checkout waits out the timeout
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    stats = pool_stats(engine)
+    assert stats["timeouts"] == 1 and stats["wait_max_ms"] >= 100
+
+    # The same counters are exported for Prometheus, labelled by engine
+    exported = render_pool_metrics({"api": engine})
+    assert 'bookbuddy_db_pool_connections_in_use{engine="api"} 2' in exported
+    assert 'bookbuddy_db_pool_checkout_timeouts_total{engine="api"} 1' in exported
+    assert "# TYPE bookbuddy_db_pool_checkouts_total counter" in exported
+
+    first.close()
+    second.close()
+    engine.dispose()
+    stats = pool_stats(engine)
+    assert stats["in_use"] == 0 and stats["peak_in_use"] == 2 and stats["checkouts"] == 2
+
+def test_engine_options_follow_settings_and_pgbouncer_mode(monkeypatch):
+    url = "postgresql+asyncpg://user:secret@db/library"
+    monkeypatch.setattr(settings, "DB_POOL_SIZE", 5)
+    monkeypatch.setattr(settings, "DB_POOL_RECYCLE", 600)
+
+    options = engine_options(url, is_async=True)
+    assert options["poolclass"] is InstrumentedAsyncQueuePool
+    assert options["pool_size"] == 5 and options["pool_recycle"] == 600 and options["pool_pre_ping"]
+    assert database_url(url) == url
+    assert engine_options("sqlite://") == {}
+
+    # Behind PgBouncer connections are not pooled twice and prepared statements are not cached
+    monkeypatch.setattr(settings, "DB_PGBOUNCER", True)
+    options = engine_options(url, is_async=True)
+    assert options["poolclass"] is InstrumentedNullPool and "pool_size" not in options
+    assert options["connect_args"]["statement_cache_size"] == 0
+    assert "prepared_statement_cache_size=0" in database_url(url)
+
+def test_borrowed_books_hot_queries_use_indexes(db, run):
+    users = [run(make_user(db, f"reader{i}@example.com")) for i in range(20)]
+    books = [run(make_book(db, f"Book {i}")) for i in range(50)]
+
+    # Years of circulation: enough rows that a scan would be the planner's last resort
+    now = datetime.utcnow()
+    statuses = ["returned", "returned", "returned", "borrowed", "overdue"]
+    rows = [
+        {
+            "id": uuid.uuid4(),
+            "user_id": users[i % len(users)].id,
+            "book_id": books[i % len(books)].id,
+            "borrow_date": now - timedelta(hours=i),
+            "due_date": now - timedelta(hours=i) + timedelta(days=14),
+            "status": statuses[i % len(statuses)],
+        }
+        for i in range(20000)
+    ]
+    run(db.execute(insert(BorrowedBook), rows))
+    run(db.commit())
+    run(db.execute(text("ANALYZE")))
+
+    async def plan(statement):
+        compiled = statement.compile(db.bind)
+        params = tuple(
+            value.hex if isinstance(value, uuid.UUID) else value
+            for value in (compiled.params[name] for name in compiled.positiontup)
+        )
+        connection = await db.connection()
+        result = await connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+        return " | ".join(row[-1] for row in result.all())
+
+    queries = {
+        "ix_borrowed_books_user_id_borrow_date": RecommendationService.reading_history_query(users[0].id, 5),
+        "ix_borrowed_books_book_id_status": select(func.count(BorrowedBook.id)).where(
+            BorrowedBook.book_id == books[0].id, BorrowedBook.status == "borrowed"
+        ),
+        "ix_borrowed_books_status_due_date": select(BorrowedBook.id).where(
+            BorrowedBook.status == "borrowed", BorrowedBook.due_date < now
+        ),
+    }
+    for index_name, statement in queries.items():
+        query_plan = run(plan(statement))
+        assert f"USING INDEX {index_name}" in query_plan or f"USING COVERING INDEX {index_name}" in query_plan, query_plan
+        assert "SCAN borrowed_books" not in query_plan, query_plan
+        # The history is read in index order, without sorting
+        assert "TEMP B-TREE" not in query_plan, query_plan
+
+def test_bulk_seed_streams_files_and_skips_unknown_references(tmp_path, monkeypatch):
+    spec = importlib.util.spec_from_file_location("seed_data", SCRIPTS / "seed_data.py")
+    seed_data = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(seed_data)
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+
+    # Items straddle the read boundary, so the array is parsed a piece at a time
+    books = [{"id": str(uuid.uuid4()), "title": f"Book {i}", "author": "A", "genre": "Fiction", "publicationYear": 2000 + i} for i in range(7)]
+    assert list(seed_data.iter_json_array(io.StringIO(json.dumps(books, indent=2)), read_size=16)) == books
+    (tmp_path / "books.json").write_text(json.dumps(books))
+
+    users = tmp_path / "users.csv"
+    with open(users, "w", newline="") as f:
+        writer = csv.DictWriter(f, ["id", "email", "firstName", "lastName", "password", "role", "studentId"])
+        writer.writeheader()
+        for i in range(5):
+            writer.writerow({"id": str(uuid.uuid4()), "email": f"user{i}@example.com", "firstName": "F", "lastName": "L", "password": f"secret{i}", "role": "student", "studentId": ""})
+    with open(users, newline="") as f:
+        user_ids = [row["id"] for row in csv.DictReader(f)]
+
+    loans = [{"book_id": books[i]["id"], "user_id": user_ids[i % 5], "borrow_date": "2026-01-01T00:00:00"} for i in range(7)]
+    loans.append({"book_id": str(uuid.uuid4()), "user_id": user_ids[0]})
+    (tmp_path / "borrowed_books.jsonl").write_text("\n".join(json.dumps(loan) for loan in loans))
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'seed.db'}")
+    # Seeding refuses a database without the migrations applied
+    with pytest.raises(SystemExit, match="alembic upgrade head"):
+        seed_data.check_schema(engine)
+    Base.metadata.create_all(engine)
+    assert seed_data.bulk_seed_users(engine, users, batch_size=2, hash_workers=2) == 5
+    assert seed_data.bulk_seed_books(engine, tmp_path / "books.json", batch_size=3) == 7
+    assert seed_data.bulk_seed_borrowed_books(engine, tmp_path / "borrowed_books.jsonl", batch_size=3) == 7
+    assert seed_data.bulk_seed_books(engine, tmp_path / "books.json") == 0
+
+    with engine.connect() as connection:
+        user = connection.execute(select(User).where(User.email == "user3@example.com")).one()
+        assert password_hasher.verify_sync("secret3", user.hashed_password) and user.student_id is None
+        assert connection.scalar(select(func.count()).select_from(Book)) == 7
+        loan = connection.execute(select(BorrowedBook).where(BorrowedBook.book_id == uuid.UUID(books[0]["id"]))).one()
+        assert loan.due_date == datetime(2026, 1, 15) and loan.status == "borrowed"
+    engine.dispose()
@@ -0,0 +1,141 @@
+"""
+Tests for latency histograms, the metrics middleware and request profiling
+"""
+
+import asyncio
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.endpoints.profiles import get_profile, list_profiles
+from app.core import profiling
+from app.core.config import settings
+from app.core.metrics import Histogram, MetricsMiddleware, render_metrics, stage_latency, timed
+from app.models.user import Principal
+from app.db.vector_store import VectorStore
+from app.services.recommendation_service import RecommendationService
+from conftest import borrow, make_book, make_user
+
+def test_histogram_renders_cumulative_prometheus_buckets():
+    histogram = Histogram("latency_seconds", "Latency.", "stage", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe("search", value)
+
+    lines = histogram.render().splitlines()
+    assert lines[:2] == ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"]
+    assert lines[2:] == [
+        'latency_seconds_bucket{stage="search",le="0.1"} 2',
+        'latency_seconds_bucket{stage="search",le="1.0"} 3',
+        'latency_seconds_bucket{stage="search",le="+Inf"} 4',
+        'latency_seconds_sum{stage="search"} 3.65',
+        'latency_seconds_count{stage="search"} 4',
+    ]
+
+def test_recommendation_stages_are_timed(db, run):
+    student = run(make_user(db, "student@example.com"))
+    run(borrow(db, student, run(make_book(db, "Dune"))))
+
+    run(RecommendationService().get_reading_history(db, str(student.id)))
+    run(VectorStore.find_similar_books(db, [1.0, 0.0]))
+
+    @timed("stream")
+    async def stream():
+        for i in range(3):
+            await asyncio.sleep(0.01)
+            yield i
+
+    async def consume():
+        return [item async for item in stream()]
+
+    assert run(consume()) == [0, 1, 2]
+    stages = stage_latency.snapshot()
+    assert {"reading_history", "similar_books", "stream"} <= set(stages)
+    assert stages["stream"][2] == 1 and stages["stream"][1] >= 0.03
+
+def test_shared_timer_keeps_each_tasks_start_time(run):
+    timer = timed("shared")
+
+    async def work(delay_before, duration):
+        await asyncio.sleep(delay_before)
+        with timer:
+            await asyncio.sleep(duration)
+
+    async def overlap():
+        # The first task leaves the block while the second is still inside it
+        await asyncio.gather(work(0, 0.04), work(0.02, 0.2))
+
+    run(overlap())
+    cumulative, _, count = stage_latency.snapshot()["shared"]
+    buckets = dict(zip(stage_latency.buckets, cumulative))
+    assert count == 2
+    assert buckets[0.025] == 0 and buckets[0.1] == 1 and buckets[0.25] == 2
+
+def test_middleware_adds_server_timing_and_route_latency(monkeypatch):
+    monkeypatch.setattr(settings, "SERVER_TIMING_ENABLED", True)
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/books/{book_id}")
+    async def get_book(book_id: str):
+        with timed("reading_history"):
+            await asyncio.sleep(0.01)
+        return {"id": book_id}
+
+    with TestClient(app) as client:
+        response = client.get("/books/1")
+        client.get("/books/2")
+
+    entries = dict(entry.split(";dur=") for entry in response.headers["server-timing"].split(", "))
+    assert set(entries) == {"reading_history", "total"}
+    assert float(entries["reading_history"]) >= 10
+    assert 'bookbuddy_request_duration_seconds_count{route="GET /books/{book_id}"} 2' in render_metrics()
+
+    monkeypatch.setattr(settings, "SERVER_TIMING_ENABLED", False)
+    with TestClient(app) as client:
+        assert "server-timing" not in client.get("/books/3").headers
+
+def test_profiling_captures_slow_and_requested_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(settings, "PROFILING_SLOW_REQUEST_SECONDS", 0.1)
+    monkeypatch.setattr(profiling.stack_sampler, "interval", 0.005)
+    monkeypatch.setattr(profiling.profile_store, "directory", tmp_path)
+    app = FastAPI()
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+    def block_the_loop():
+        time.sleep(0.05)
+
+    async def wait_for_the_database():
+        await asyncio.sleep(0.1)
+
+    @app.get("/slow")
+    async def slow():
+        block_the_loop()
+        await wait_for_the_database()
+        return {}
+
+    @app.get("/fast")
+    async def fast():
+        return {}
+
+    with TestClient(app) as client:
+        assert "x-profile-id" not in client.get("/slow").headers
+        assert "x-profile-id" not in client.get("/fast").headers
+        profile_id = client.get("/fast", headers={"X-Profile": "1"}).headers["x-profile-id"]
+
+    summaries = profiling.profile_store.list()
+    assert [(summary["path"], summary["trigger"]) for summary in summaries] == [("/fast", "header"), ("/slow", "slow")]
+
+    # The request's own stacks show what it awaited; the loop stacks show what blocked the process
+    profile = profiling.profile_store.get(summaries[1]["id"])
+    assert profile["samples"] > 5 and profile["status"] == 200
+    assert any("wait_for_the_database" in stack for stack in profile["task_stacks"])
+    assert any("block_the_loop" in stack for stack in profile["loop_stacks"])
+
+    librarian = Principal(id="librarian", role="librarian")
+    assert asyncio.run(list_profiles(librarian)) == summaries
+    assert asyncio.run(get_profile(profile_id, "json", "task", librarian))["id"] == profile_id
+    response = asyncio.run(get_profile(summaries[1]["id"], "folded", "task", librarian))
+    assert "wait_for_the_database" in response.body.decode()
+    assert profiling.profile_store.get("../secrets") is None
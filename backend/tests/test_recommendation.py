@@ -0,0 +1,769 @@
+"""
+Tests for the vector store and recommendation services
+"""
+
+import asyncio
+import importlib.util
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.db.embedding_index import EmbeddingIndex, IVFFlatIndex, embedding_index
+from app.core.cache import LRUCache, RedisCache, SQLiteCache
+from app.core.config import settings
+from app.db.database import Base
+from app.db.models import BookEmbedding, EmbeddingCacheEntry, User, UserPreferenceProfile
+from app.db.vector_store import VectorStore
+from app.services.embedding_cache import embedding_cache
+from app.services.embedding_service import EmbeddingService
+from app.services.json_stream import JSONArrayStreamParser
+from app.services.preference_service import PreferenceProfile
+from app.services.recommendation_cache import recommendation_cache
+from app.services.recommendation_service import RecommendationService
+from conftest import FakeOpenAI, borrow, make_book, make_user
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+
+def test_embedding_index_matches_exact_cosine_ranking():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 32))
+    query = rng.normal(size=32)
+    book_ids = [f"book-{i}" for i in range(200)]
+
+    index = EmbeddingIndex()
+    index.load(book_ids, vectors)
+    results = index.search(query, n=10, exclude_book_ids=["book-3", "missing"])
+
+    cosine = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query))
+    cosine[3] = -np.inf
+    expected = np.argsort(-cosine)[:10]
+
+    assert [book_id for book_id, _ in results] == [book_ids[i] for i in expected]
+    np.testing.assert_allclose([score for _, score in results], cosine[expected], rtol=1e-5)
+
+def test_embedding_index_upsert_replaces_and_appends():
+    index = EmbeddingIndex()
+    index.load(["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+
+    index.upsert("a", [0.0, -1.0])
+    for i in range(20):
+        index.upsert(f"new-{i}", [1.0, 0.01 * i])
+
+    assert len(index) == 22
+    assert index.search([1.0, 0.0], n=1)[0][0] == "new-0"
+    assert index.search([0.0, -1.0], n=1)[0][0] == "a"
+    assert len(index.search([1.0, 0.0], n=50, exclude_book_ids=["a", "b"])) == 20
+
+def clustered_vectors(num_vectors, dim=32, num_topics=16, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(num_topics, dim))
+    vectors = topics[rng.integers(0, num_topics, size=num_vectors)]
+    return vectors + 0.5 * rng.normal(size=(num_vectors, dim))
+
+def test_ivf_index_recall_against_exact_search():
+    vectors = clustered_vectors(5000)
+    book_ids = [f"book-{i}" for i in range(len(vectors))]
+    exact = EmbeddingIndex()
+    exact.load(book_ids, vectors)
+    ivf = IVFFlatIndex(nlist=32, nprobe=4, min_train_size=0)
+    ivf.load(book_ids, vectors)
+
+    recalls = []
+    for query in vectors[:50]:
+        expected = {book_id for book_id, _ in exact.search(query, 10)}
+        found = {book_id for book_id, _ in ivf.search(query, 10)}
+        recalls.append(len(expected & found) / 10)
+
+    assert ivf.trained
+    assert np.mean(recalls) >= 0.9
+
+def test_ivf_index_incremental_insert_and_snapshot(tmp_path):
+    vectors = clustered_vectors(1000)
+    ivf = IVFFlatIndex(nlist=8, nprobe=2, min_train_size=500)
+    ivf.load([f"book-{i}" for i in range(400)], vectors[:400])
+    assert not ivf.trained
+
+    # Crossing min_train_size through inserts trains the quantizer in the background
+    for i in range(400, 1000):
+        ivf.upsert(f"book-{i}", vectors[i])
+    ivf.upsert("book-0", vectors[999])
+    ivf.wait_for_training()
+    assert ivf.trained
+    assert {"book-0", "book-999"} <= {book_id for book_id, _ in ivf.search(vectors[999], 2)}
+
+    path = str(tmp_path / "index.npz")
+    ivf.save(path)
+    restored = IVFFlatIndex(nlist=8, nprobe=2)
+    assert restored.restore(path)
+    # Loaded only once the caller has checked the snapshot against the database
+    assert restored.trained and len(restored) == 1000 and not restored.loaded
+    assert restored.search(vectors[500], 5) == ivf.search(vectors[500], 5)
+    assert not EmbeddingIndex().restore(path)
+
+def test_stale_index_snapshot_is_rebuilt_before_use(db, run, tmp_path, monkeypatch):
+    books = [run(make_book(db, title)) for title in ["Dune", "Emma", "Ulysses"]]
+    for i, book in enumerate(books):
+        run(VectorStore.save_embedding(db, str(book.id), [1.0, float(i)]))
+
+    # A snapshot holding a book the database no longer has
+    path = str(tmp_path / "index.npz")
+    stale = EmbeddingIndex()
+    stale.load(["ghost"], [[1.0, 0.0]])
+    stale.save(path)
+    monkeypatch.setattr(settings, "VECTOR_INDEX_PATH", path)
+    embedding_index.clear()
+
+    index = run(VectorStore._get_index(db))
+    assert index.loaded and len(index) == 3
+    assert "ghost" not in {book_id for book_id, _ in index.search([1.0, 0.0], 3)}
+
+def test_find_similar_books_ranks_from_resident_index(db, run, count_queries):
+    books = [run(make_book(db, title)) for title in ["Dune", "Emma", "Ulysses"]]
+    embedding_index.load(
+        [str(book.id) for book in books],
+        [[1.0, 0.0], [0.8, 0.6], [0.0, 1.0]]
+    )
+
+    with count_queries:
+        results = run(VectorStore.find_similar_books(
+            db, [1.0, 0.1], n=2, exclude_book_ids=[str(books[0].id)]
+        ))
+
+    # Book details for all results come from a single batched query
+    assert count_queries.count == 1
+
+    assert [book["title"] for book in results] == ["Emma", "Ulysses"]
+    assert results[0]["similarity_score"] > results[1]["similarity_score"]
+
+def test_get_reading_history_is_a_single_query(db, run, count_queries):
+    user = run(make_user(db, "reader@example.com"))
+    user_id = str(user.id)
+    for days_ago, title in enumerate(["Newest", "Middle", "Oldest", "Ancient"]):
+        run(borrow(db, user, run(make_book(db, title)), days_ago=days_ago))
+
+    with count_queries:
+        history = run(RecommendationService().get_reading_history(db, user_id, limit=3))
+
+    assert count_queries.count == 1
+    assert [book["title"] for book in history] == ["Newest", "Middle", "Oldest"]
+    assert history[0]["status"] == "borrowed" and "borrowDate" in history[0]
+
+def test_create_embeddings_batch_packs_and_preserves_order(fake_openai, monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_BATCH_MAX_INPUTS", 4)
+    monkeypatch.setattr(settings, "EMBEDDING_BATCH_MAX_TOKENS", 30)
+    texts = [f"text number {i}" * (1 + i % 3) for i in range(10)]
+
+    embeddings = asyncio.run(EmbeddingService().create_embeddings_batch(texts))
+
+    assert [embedding.tolist() for embedding in embeddings] == [FakeOpenAI.embed(text) for text in texts]
+    assert all(embedding.dtype == np.float32 for embedding in embeddings)
+    assert set(fake_openai.encoding_formats) == {"base64"}
+    assert [text for batch in fake_openai.embedding_requests for text in batch] == texts
+    assert all(len(batch) <= 4 for batch in fake_openai.embedding_requests)
+    assert len(fake_openai.embedding_requests) < len(texts)
+
+def test_create_embeddings_batch_retries_failed_batches(fake_openai, monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_MAX_RETRIES", 2)
+    service = EmbeddingService()
+
+    fake_openai.fail_next = 2
+    embeddings = asyncio.run(service.create_embeddings_batch(["a", "b"]))
+    assert [embedding.tolist() for embedding in embeddings] == [FakeOpenAI.embed("a"), FakeOpenAI.embed("b")]
+
+    fake_openai.fail_next = 3
+    assert asyncio.run(service.create_embeddings_batch(["c", "d"])) == [None, None]
+
+def test_rate_limited_batches_wait_for_retry_after(fake_openai, monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_RETRY_BACKOFF_SECONDS", 5.0)
+    fake_openai.rate_limit_next = 1
+    fake_openai.retry_after = "0.05"
+
+    started = time.perf_counter()
+    embeddings = asyncio.run(EmbeddingService().create_embeddings_batch(["a"]))
+    assert [embedding.tolist() for embedding in embeddings] == [FakeOpenAI.embed("a")]
+    assert time.perf_counter() - started < 1.0
+
+def test_embedding_backfill_resumes_from_checkpoint(tmp_path, run, monkeypatch):
+    spec = importlib.util.spec_from_file_location("generate_embeddings", SCRIPTS / "generate_embeddings.py")
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+
+    # A file database in WAL mode, so the streaming reader and the writers can overlap
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'books.db'}", poolclass=NullPool)
+    session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    checkpoint_path = tmp_path / "checkpoint.json"
+    embedder = script.LocalEmbedder(settings.EMBEDDING_DIMENSIONS, latency=0)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            await conn.run_sync(Base.metadata.create_all)
+        async with session_factory() as db:
+            return [(await make_book(db, f"Book {i}")).id for i in range(10)]
+
+    async def stored():
+        async with session_factory() as db:
+            return (await db.execute(select(BookEmbedding.book_id, BookEmbedding.text_hash))).all()
+
+    book_ids = sorted(run(setup()))
+    try:
+        # A dry run embeds everything and writes nothing
+        progress = run(script.backfill(embedder, session_factory, checkpoint_path, chunk_size=3, workers=2, dry_run=True))
+        assert progress.counts == {"embedded": 10, "skipped": 0, "failed": 0}
+        assert run(stored()) == [] and not checkpoint_path.exists()
+
+        # An interrupted run left the first four books done
+        checkpoint = script.Checkpoint(checkpoint_path, settings.EMBEDDING_MODEL)
+        checkpoint.finish(0, book_ids[3], {"embedded": 4, "skipped": 0, "failed": 0})
+        progress = run(script.backfill(embedder, session_factory, checkpoint_path, chunk_size=3, workers=2))
+        assert progress.total == 6 and progress.counts["embedded"] == 6
+        assert {book_id for book_id, _ in run(stored())} == set(book_ids[4:])
+        assert not checkpoint_path.exists()
+
+        # A full run then only fills the gap
+        progress = run(script.backfill(embedder, session_factory, checkpoint_path, chunk_size=3, workers=2))
+        assert progress.counts == {"embedded": 4, "skipped": 6, "failed": 0}
+        assert len(run(stored())) == 10
+    finally:
+        run(engine.dispose())
+
+def test_create_embedding_for_book_uses_batch_api(fake_openai):
+    book = {"title": "Dune", "author": "Frank Herbert", "genre": "Science Fiction"}
+
+    embedding = asyncio.run(EmbeddingService().create_embedding_for_book(book))
+
+    assert embedding.tolist() == FakeOpenAI.embed(EmbeddingService.build_book_text(book))
+    assert fake_openai.embedding_requests == [[EmbeddingService.build_book_text(book)]]
+
+BOOK = {"id": "book-1", "title": "Dune", "author": "Frank Herbert", "genre": "Science Fiction", "description": "Spice"}
+
+def test_gpt_refinement_does_not_block_the_event_loop(fake_openai, monkeypatch):
+    monkeypatch.setattr(settings, "OPENAI_MAX_CONCURRENCY", 2)
+    fake_openai.chat_latency = 0.3
+    service = RecommendationService()
+
+    async def load():
+        # A ticker standing in for cheap endpoints such as /health served by the same loop
+        lags = []
+
+        async def ticker():
+            while True:
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - start - 0.01)
+
+        ticker_task = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            service.refine_recommendations_with_gpt([BOOK], [BOOK], 1) for _ in range(6)
+        ])
+        elapsed = time.perf_counter() - start
+        ticker_task.cancel()
+        return lags, elapsed
+
+    lags, elapsed = asyncio.run(load())
+
+    assert len(fake_openai.chat_requests) == 6
+    assert fake_openai.max_in_flight == 2
+    assert elapsed < 6 * 0.3
+    assert np.percentile(lags, 99) < 0.05
+
+def test_gpt_refinement_times_out_to_fallback(fake_openai, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_TIMEOUT_SECONDS", 0.1)
+    fake_openai.chat_latency = 1.0
+
+    start = time.perf_counter()
+    result = asyncio.run(RecommendationService().refine_recommendations_with_gpt([BOOK], [BOOK], 1))
+
+    assert time.perf_counter() - start < 0.9
+    assert result["recommendations"] == [BOOK]
+
+def test_gpt_refinement_retries_transient_failures(fake_openai):
+    fake_openai.chat_fail_next = 1
+    fake_openai.chat_content = json.dumps({"recommendations": [{"id": BOOK["id"], "reason": "r"}], "explanation": "e"})
+
+    result = asyncio.run(RecommendationService().refine_recommendations_with_gpt([BOOK], [BOOK], 1))
+
+    assert fake_openai.chat_fail_next == 0
+    assert result["explanation"] == "e"
+
+def test_lru_cache_evicts_least_recently_used_and_expires(monkeypatch):
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+    clock = [100.0]
+    monkeypatch.setattr("app.core.cache.time.monotonic", lambda: clock[0])
+    expiring = LRUCache(maxsize=2, ttl=10)
+    expiring.set("a", 1)
+    clock[0] += 11
+    assert expiring.get("a") is None
+
+def test_embedding_cache_avoids_repeat_api_calls(db, run, fake_openai, monkeypatch):
+    def cached_count():
+        return run(db.scalar(select(func.count()).select_from(EmbeddingCacheEntry)))
+
+    texts = ["Dune by Frank Herbert", "Emma   by Jane Austen"]
+    run(EmbeddingService().create_embeddings_batch(texts, db=db))
+    assert cached_count() == 2
+
+    # Same text with different whitespace, served from memory and then from the table
+    fake_openai.embedding_requests.clear()
+    again = run(EmbeddingService().create_embeddings_batch(["Dune  by Frank Herbert"], db=db))
+    embedding_cache.memory.clear()
+    from_table = run(EmbeddingService().create_embeddings_batch(texts, db=db))
+    assert fake_openai.embedding_requests == []
+    assert [embedding.tolist() for embedding in again] == [FakeOpenAI.embed(texts[0])]
+    assert [embedding.tolist() for embedding in from_table] == [FakeOpenAI.embed(text) for text in texts]
+
+    # A different model misses the cache
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL", "text-embedding-3-large")
+    run(EmbeddingService().create_embeddings_batch(texts, db=db))
+    assert fake_openai.embedding_requests == [texts]
+    assert cached_count() == 4
+
+    # A batch overlapping rows already cached keeps the new rows and leaves the commit to the caller
+    embedding_cache.memory.clear()
+    run(embedding_cache.put_many(db, settings.EMBEDDING_MODEL, {
+        embedding_cache.text_hash(texts[0]): np.zeros(3),
+        embedding_cache.text_hash("Ulysses by James Joyce"): np.ones(3),
+    }))
+    assert db.in_transaction() and cached_count() == 5
+    embedding_cache.memory.clear()
+    stored = run(embedding_cache.get_many(db, settings.EMBEDDING_MODEL, [embedding_cache.text_hash(texts[0])]))
+    assert list(stored.values())[0].tolist() == FakeOpenAI.embed(texts[0])
+
+def test_benchmark_suite_times_a_small_synthetic_catalog(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(SCRIPTS))
+    spec = importlib.util.spec_from_file_location("benchmark_suite", SCRIPTS / "benchmark_suite.py")
+    suite = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(suite)
+
+    # The same seed always generates the same catalog
+    first, again = (next(suite.synthetic_catalog(50, 8, seed=1)) for _ in range(2))
+    assert [book["id"] for book, _, _ in first] == [book["id"] for book, _, _ in again]
+    assert np.allclose([np.linalg.norm(vector) for _, vector, _ in first], 1.0)
+
+    url = f"sqlite:///{tmp_path / 'benchmark.db'}"
+    assert suite.generate(url, 300, 16, num_users=20, loans_per_user=4, seed=0) > 0
+    assert suite.generate(url, 300, 16, num_users=20, loans_per_user=4, seed=0) == 0
+
+    results = asyncio.run(suite.run_benchmarks(url, iterations=5, llm_latency=0, seed=0))
+    assert {"index_load", "get_reading_history", "combine_embeddings", "find_similar_books", "generate_recommendations"} == set(results)
+    assert results["find_similar_books"]["iterations"] == 5
+    assert {"reading_history", "similar_books", "gpt_refinement"} <= set(results["generate_recommendations"]["stages_mean_ms"])
+
+def test_book_text_hash_ignores_unrelated_fields():
+    book = {"title": "Dune", "author": "Frank Herbert", "genre": "Science Fiction", "description": "Spice"}
+
+    assert EmbeddingService.book_text_hash(book) == EmbeddingService.book_text_hash({**book, "copies": 7})
+    assert EmbeddingService.book_text_hash(book) != EmbeddingService.book_text_hash({**book, "title": "Emma"})
+
+def test_gpt_refinement_results_are_cached(fake_openai):
+    service = RecommendationService()
+    fake_openai.chat_content = json.dumps({
+        "recommendations": [{"id": "book-1", "reason": "More spice"}],
+        "explanation": "Because you liked Dune",
+    })
+
+    first = asyncio.run(service.refine_recommendations_with_gpt([BOOK], [BOOK], 1))
+    second = asyncio.run(service.refine_recommendations_with_gpt([BOOK], [BOOK], 1))
+    asyncio.run(service.refine_recommendations_with_gpt([BOOK], [BOOK], 2))
+
+    assert first == second
+    assert first["recommendations"][0]["recommendation_reason"] == "More spice"
+    assert len(fake_openai.chat_requests) == 2
+    stats = asyncio.run(recommendation_cache.stats())
+    assert (stats["hits"], stats["misses"], stats["llm_calls"]) == (1, 2, 2)
+    assert stats["estimated_tokens_saved"] == 120
+
+def test_sqlite_cache_persists_evicts_and_expires(tmp_path, run, monkeypatch):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path, maxsize=2, ttl=60)
+    run(cache.set("a", {"value": 1}))
+    run(cache.set("b", {"value": 2}))
+    run(cache.get("a"))
+    run(cache.set("c", {"value": 3}))
+
+    reopened = SQLiteCache(path, maxsize=2, ttl=60)
+    assert run(reopened.get("a")) == {"value": 1}
+    assert run(reopened.get("b")) is None
+    assert len(reopened) == 2
+
+    now = time.time()
+    monkeypatch.setattr("app.core.cache.time.time", lambda: now + 61)
+    assert run(reopened.get("c")) is None
+    assert run(reopened.stats())["hits"] == 1
+
+def test_redis_cache_works_with_a_local_stand_in(run):
+    class FakeRedis:
+        def __init__(self):
+            self.data, self.expiry = {}, {}
+
+        async def get(self, key):
+            return self.data.get(key)
+
+        async def set(self, key, value, ex=None):
+            self.data[key], self.expiry[key] = value, ex
+
+        async def delete(self, key):
+            self.data.pop(key, None)
+
+        async def scan_iter(self, pattern):
+            for key in [key for key in list(self.data) if key.startswith(pattern.rstrip("*"))]:
+                yield key
+
+    client = FakeRedis()
+    cache = RedisCache(client, prefix="recommendations", ttl=900)
+    run(cache.set("key", {"explanation": "cached"}))
+
+    assert run(cache.get("key")) == {"explanation": "cached"}
+    assert run(cache.get("other")) is None
+    assert client.expiry == {"recommendations:key": 900}
+    run(cache.clear())
+    assert client.data == {} and run(cache.stats())["hits"] == 0
+
+def test_precomputed_recommendations_refresh_only_changed_students(db, run):
+    service = RecommendationService()
+    student = run(make_user(db, "student@example.com"))
+    other = run(make_user(db, "other@example.com"))
+    run(make_user(db, "librarian@example.com", role="librarian"))
+    run(borrow(db, student, run(make_book(db, "Dune"))))
+    run(borrow(db, other, run(make_book(db, "Emma"))))
+    student_id, other_id = student.id, other.id
+
+    assert set(run(service.get_stale_student_ids(db))) == {student_id, other_id}
+
+    result = {
+        "recommendations": [{"id": "a", "title": "A"}, {"id": "b", "title": "B"}],
+        "explanation": "Because"
+    }
+    run(service.save_recommendations(db, str(student_id), result, num_recommendations=2))
+    assert run(service.get_stale_student_ids(db)) == [other_id]
+
+    stored = run(service.get_precomputed_recommendations(db, str(student_id), num_recommendations=1))
+    assert stored["recommendations"] == [{"id": "a", "title": "A"}]
+    assert stored["generated_at"] is not None
+    assert run(service.get_precomputed_recommendations(db, str(student_id), num_recommendations=3)) is None
+
+    # A new borrow makes the stored recommendations stale again
+    run(borrow(db, run(db.get(User, student_id)), run(make_book(db, "Ulysses"))))
+    assert set(run(service.get_stale_student_ids(db))) == {student_id, other_id}
+
+def test_search_many_matches_single_query_search():
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(300, 8))
+    book_ids = [f"book-{i}" for i in range(300)]
+    queries = rng.normal(size=(5, 8))
+    excluded = [[f"book-{i}" for i in range(q, 300, 7)] for q in range(5)]
+
+    for index in (EmbeddingIndex(), IVFFlatIndex(nlist=8, nprobe=3, min_train_size=0)):
+        index.load(book_ids, vectors)
+        batched = index.search_many(queries, 5, exclude_book_ids=excluded, chunk_size=2)
+        single = [index.search(query, 5, exclude) for query, exclude in zip(queries, excluded)]
+        assert [[book_id for book_id, _ in ranked] for ranked in batched] == \
+            [[book_id for book_id, _ in ranked] for ranked in single]
+        assert np.allclose([[s for _, s in r] for r in batched], [[s for _, s in r] for r in single], atol=1e-5)
+
+def test_bulk_recommendations_batch_queries_and_refine_concurrently(db, run, fake_openai, count_queries, monkeypatch):
+    fake_openai.chat_latency = 0.2
+    books = [run(make_book(db, f"Book {i}")) for i in range(8)]
+    for i, book in enumerate(books):
+        run(VectorStore.save_embedding(db, str(book.id), [1.0, i / 8, 0.5]))
+
+    students = [run(make_user(db, f"student{i}@example.com")) for i in range(4)]
+    for i, student in enumerate(students[:3]):
+        run(borrow(db, student, books[i], days_ago=1))
+        run(borrow(db, student, books[i + 3]))
+    user_ids = [str(student.id) for student in students]
+    # Preference profiles are built ahead of time, as by the precompute job
+    run(RecommendationService().preference_service.refresh_profiles(db, user_ids))
+
+    async def collect():
+        return [
+            result async for result in
+            RecommendationService().generate_recommendations_bulk(db, user_ids, num_recommendations=2, concurrency=2)
+        ]
+
+    start = time.perf_counter()
+    with count_queries:
+        results = run(collect())
+    elapsed = time.perf_counter() - start
+
+    # The student without a history is answered first, without any refinement
+    assert results[0] == (user_ids[3], {
+        "recommendations": [],
+        "explanation": "Unable to generate recommendations as the student has no reading history."
+    })
+    assert sorted(user_id for user_id, _ in results) == sorted(user_ids)
+
+    # Histories, embeddings, the index and book details are loaded once for the whole group
+    assert count_queries.count <= 5
+    assert len(fake_openai.chat_requests) == 3
+    assert fake_openai.max_in_flight == 2
+    assert elapsed < 3 * 0.2
+
+def test_json_array_stream_parser_emits_items_as_they_complete():
+    document = json.dumps({
+        "recommendations": [
+            {"id": "1", "reason": "Braces {like [these]} and \"quotes\" in strings"},
+            {"id": "2", "tags": ["a", {"b": 1}]},
+        ],
+        "explanation": "{not an item}",
+    })
+    parser = JSONArrayStreamParser("recommendations")
+
+    emitted = []
+    for start in range(0, len(document), 3):
+        items = parser.feed(document[start:start + 3])
+        emitted.extend((start, item) for item in items)
+
+    assert [item for _, item in emitted] == json.loads(document)["recommendations"]
+    # The first item is reported as soon as it is closed, not at the end of the document
+    assert emitted[0][0] < document.index('{"id": "2"')
+    assert parser.text == document
+
+def test_stream_recommendations_reports_candidates_before_refined_picks(db, run, fake_openai):
+    books = [run(make_book(db, f"Book {i}")) for i in range(5)]
+    for i, book in enumerate(books):
+        run(VectorStore.save_embedding(db, str(book.id), [1.0, i / 5, 0.5]))
+    student = run(make_user(db, "student@example.com"))
+    run(borrow(db, student, books[0], days_ago=1))
+    run(borrow(db, student, books[1]))
+    user_id = str(student.id)
+
+    picks = [str(books[3].id), str(books[2].id)]
+    fake_openai.chat_content = json.dumps({
+        "recommendations": [{"id": book_id, "reason": f"Reason {book_id}"} for book_id in picks],
+        "explanation": "Because you liked the others",
+    })
+    fake_openai.chat_chunk_delay = 0.01
+
+    async def collect():
+        started = time.perf_counter()
+        return [
+            (name, data, time.perf_counter() - started) async for name, data in
+            RecommendationService().stream_recommendations(db, user_id, num_recommendations=2)
+        ]
+
+    events = run(collect())
+
+    assert [name for name, _, _ in events] == ["candidates", "recommendation", "recommendation", "done"]
+    assert {book["id"] for book in events[0][1]["candidates"]} == {str(book.id) for book in books[2:]}
+    assert [data["id"] for name, data, _ in events if name == "recommendation"] == picks
+    assert events[1][1]["recommendation_reason"] == f"Reason {picks[0]}"
+    # Picks arrive while the response is still streaming
+    assert events[0][2] < events[1][2] < events[3][2] - 0.05
+
+    done = events[-1][1]
+    assert [book["id"] for book in done["recommendations"]] == picks
+    assert done["explanation"] == "Because you liked the others"
+    assert fake_openai.chat_requests[0]["stream"] is True
+
+    # The streamed result is cached like a regular refinement
+    assert run(collect())[-1][1] == done
+    assert len(fake_openai.chat_requests) == 1
+
+def test_stream_cut_off_mid_array_finishes_with_the_picks_already_sent(fake_openai):
+    similar = [dict(BOOK, id=f"book-{i}") for i in range(3)]
+    content = json.dumps({
+        "recommendations": [{"id": book["id"], "reason": "r"} for book in similar],
+        "explanation": "e",
+    })
+    # Cut the response just after the first pick is complete
+    fake_openai.chat_content = content
+    fake_openai.chat_cut_after = content.index('{"id": "book-1"')
+
+    async def collect():
+        return [event async for event in RecommendationService().stream_refinement_with_gpt([BOOK], similar, 3)]
+
+    events = asyncio.run(collect())
+
+    assert [name for name, _ in events] == ["recommendation", "done"]
+    done = events[-1][1]
+    assert [book["id"] for book in done["recommendations"]] == ["book-0"]
+    assert done["error"] is True
+
+def test_pgvector_top_k_runs_in_sql_and_falls_back_off_postgres(db, run, monkeypatch):
+    from sqlalchemy.dialects import postgresql
+
+    excluded = str(uuid.uuid4())
+    sql = str(VectorStore.pgvector_query([0.1, 0.2], 5, [excluded]).compile(dialect=postgresql.dialect()))
+    assert "ORDER BY book_embeddings.embedding_vector <=> CAST(" in sql
+    assert "NOT IN" in sql and "LIMIT" in sql
+
+    # SQLite has no vector type, so the ARRAY path and resident index are used
+    monkeypatch.setattr(settings, "VECTOR_STORAGE", "pgvector")
+    assert not VectorStore.uses_pgvector(db)
+    books = [run(make_book(db, title)) for title in ["Dune", "Emma"]]
+    for book, embedding in zip(books, [[1.0, 0.0], [0.0, 1.0]]):
+        assert run(VectorStore.save_embedding(db, str(book.id), embedding))
+
+    results = run(VectorStore.find_similar_books(db, [1.0, 0.2], n=1))
+    assert [book["title"] for book in results] == ["Dune"]
+    assert not run(VectorStore.has_vector_column(db))
+    assert run(VectorStore.backfill_vectors(db)) == 0
+
+def test_packed_embeddings_are_compact_and_decoded_without_copying(db, run, monkeypatch):
+    embedding = np.random.default_rng(0).normal(size=1536)
+    books = [run(make_book(db, title)) for title in ["Dune", "Emma", "Ulysses"]]
+
+    assert run(VectorStore.save_embedding(db, str(books[0].id), embedding))
+    row = run(db.scalar(select(BookEmbedding).where(BookEmbedding.book_id == books[0].id)))
+    assert len(row.embedding) == 1536 * 4 and row.embedding_dtype == "<f4"
+
+    stored = run(VectorStore.get_book_embedding(db, str(books[0].id)))
+    assert stored.dtype == np.float32 and not stored.flags.owndata and not stored.flags.writeable
+    # A list of Python floats costs about 32 bytes per value, the packed array 4
+    as_list = embedding.tolist()
+    list_bytes = sys.getsizeof(as_list) + sum(sys.getsizeof(value) for value in as_list)
+    assert list_bytes > 7 * stored.nbytes
+    np.testing.assert_allclose(stored, embedding, rtol=1e-6)
+
+    monkeypatch.setattr(settings, "EMBEDDING_STORAGE_DTYPE", "float16")
+    assert run(VectorStore.save_embedding(db, str(books[1].id), embedding))
+    half = run(VectorStore.get_book_embedding(db, str(books[1].id)))
+    assert half.dtype == np.float16 and half.nbytes == 1536 * 2
+    np.testing.assert_allclose(half, embedding, atol=2e-3)
+
+    # Rows converted by the migration hold big-endian float32
+    db.add(BookEmbedding(
+        book_id=books[2].id, model=settings.EMBEDDING_MODEL,
+        embedding=embedding.astype(">f4").tobytes(), embedding_dtype=">f4"
+    ))
+    run(db.commit())
+    np.testing.assert_allclose(run(VectorStore.get_book_embedding(db, str(books[2].id))), embedding, rtol=1e-6)
+
+def test_packed_embedding_ranking_matches_float64(db, run, monkeypatch):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(200, 64))
+    queries = rng.normal(size=(10, 64))
+    books = [run(make_book(db, f"Book {i}")) for i in range(200)]
+    book_ids = [str(book.id) for book in books]
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = queries @ normalized.T / np.linalg.norm(queries, axis=1, keepdims=True)
+    expected = [[book_ids[i] for i in np.argsort(-row)[:10]] for row in scores]
+
+    for dtype, tolerance, min_overlap in [("float32", 1e-5, 10), ("float16", 2e-3, 9)]:
+        monkeypatch.setattr(settings, "EMBEDDING_STORAGE_DTYPE", dtype)
+        for book, vector in zip(books, vectors):
+            assert run(VectorStore.save_embedding(db, str(book.id), vector))
+        embedding_index.clear()
+
+        results = run(VectorStore.find_similar_books_many(db, list(queries), n=10))
+
+        for row, ranked, truth in zip(scores, results, expected):
+            assert len({book["id"] for book in ranked} & set(truth)) >= min_overlap
+            for book in ranked:
+                assert abs(book["similarity_score"] - row[book_ids.index(book["id"])]) < tolerance
+
+def test_preference_profiles_are_rebuilt_offline_and_read_without_writes(db, run, count_queries):
+    science, poetry = [1.0, 0.05, 0.0], [0.0, 1.0, 0.05]
+    books = [run(make_book(db, f"Book {i}")) for i in range(5)]
+    for book, vector in zip(books, [science, science, poetry, poetry, poetry]):
+        run(VectorStore.save_embedding(db, str(book.id), vector))
+    student = run(make_user(db, "student@example.com"))
+    for days_ago, book in zip([400, 300, 20, 10], books):
+        run(borrow(db, student, book, days_ago=days_ago))
+    student_id = str(student.id)
+    service = RecommendationService().preference_service
+
+    # Until the job builds it there is no profile to read
+    assert run(service.get_profiles(db, {student_id: 4})) == {}
+    assert run(service.refresh_profiles(db, [student_id])) == 1
+    assert run(service.refresh_profiles(db, [student_id])) == 0
+
+    with count_queries:
+        profile = run(service.get_profiles(db, {student_id: 4}))[student_id]
+    assert count_queries.count == 1 and not db.new and not db.dirty
+    assert profile.book_count == 4 and len(profile.clusters) == 2
+    # Recent poetry outweighs the science read over a year ago
+    assert profile.cluster_weights[1] > 3 * profile.cluster_weights[0]
+    centroid, _ = profile.queries()[0]
+    assert centroid @ np.array(poetry) > centroid @ np.array(science)
+
+    # A new borrow is folded in on read, without writing, and matches a full rebuild
+    run(borrow(db, run(db.get(User, student.id)), books[4]))
+    with count_queries:
+        folded = run(service.get_profiles(db, {student_id: 5}))[student_id]
+    assert count_queries.count == 3 and not db.new and not db.dirty
+    assert folded.book_count == 5 and folded.cluster_weights[1] > profile.cluster_weights[1]
+    assert run(service.refresh_profiles(db, [student_id])) == 1
+    rebuilt = run(service.get_profiles(db, {student_id: 5}))[student_id]
+    np.testing.assert_allclose(folded.centroid, rebuilt.centroid, rtol=1e-5)
+    np.testing.assert_allclose(folded.clusters, rebuilt.clusters, rtol=1e-5)
+
+    # Counts that cannot be explained by new borrows wait for the next rebuild
+    assert run(service.get_profiles(db, {student_id: 4})) == {}
+
+def test_mixed_tastes_get_candidates_from_each_cluster(db, run, monkeypatch):
+    monkeypatch.setattr(settings, "NUM_SIMILAR_BOOKS", 6)
+    groups = {"science": [1.0, 0.0, 0.0], "poetry": [0.0, 1.0, 0.0], "between": [0.7, 0.7, 0.0]}
+    rng = np.random.default_rng(0)
+    catalog = {}
+    for name, center in groups.items():
+        for i in range(8):
+            book = run(make_book(db, f"{name} {i}"))
+            run(VectorStore.save_embedding(db, str(book.id), np.array(center) + rng.normal(scale=0.05, size=3)))
+            catalog[str(book.id)] = (name, book)
+
+    # Eight borrows, more than the five-book history, alternating between the two tastes
+    student = run(make_user(db, "student@example.com"))
+    science = [book for name, book in catalog.values() if name == "science"][:4]
+    poetry = [book for name, book in catalog.values() if name == "poetry"][:4]
+    read = [book for pair in zip(science, poetry) for book in pair]
+    for days_ago, book in enumerate(read):
+        run(borrow(db, student, book, days_ago=days_ago))
+    user_id = str(student.id)
+    read_ids = {str(book.id) for book in read}
+    service = RecommendationService()
+
+    def candidates():
+        _, found = run(service.find_candidates(db, [user_id]))
+        return found[user_id][1]
+
+    # Without a profile the two latest books are averaged, landing between the tastes
+    fallback = candidates()
+    assert "between" in {catalog[book["id"]][0] for book in fallback}
+    assert not {book["id"] for book in fallback} & read_ids
+
+    run(service.preference_service.refresh_profiles(db, [user_id]))
+    similar_books = candidates()
+
+    # Each taste gets its own share of the candidates rather than the books between them
+    assert len(similar_books) == 6
+    assert {catalog[book["id"]][0] for book in similar_books} == {"science", "poetry"}
+    assert not {book["id"] for book in similar_books} & read_ids
+    scores = [book["similarity_score"] for book in similar_books]
+    assert scores == sorted(scores, reverse=True)
+
+def test_preference_profile_is_independent_of_borrow_order():
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(6, 8))
+    dates = [datetime(2026, 1, 1) + timedelta(days=int(days)) for days in rng.integers(0, 400, size=6)]
+
+    forward, backward = PreferenceProfile(8), PreferenceProfile(8)
+    for vector, date in zip(vectors, dates):
+        forward.add(vector, date)
+    for vector, date in reversed(list(zip(vectors, dates))):
+        backward.add(vector, date)
+
+    assert forward.reference_date == backward.reference_date == max(dates)
+    np.testing.assert_allclose(forward.centroid, backward.centroid, rtol=1e-5)
+    assert forward.weight == pytest.approx(backward.weight)
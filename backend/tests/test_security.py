@@ -0,0 +1,117 @@
+"""
+Tests for authentication dependencies
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.endpoints.auth import login_access_token
+from app.core.config import settings
+from app.core.passwords import PasswordHasher, password_hasher
+from app.db.models import User
+from app.core.security import (
+    create_access_token, decode_access_token, get_current_principal, get_current_user, get_password_hash, user_cache
+)
+from conftest import make_user
+
+def test_current_user_is_cached_until_the_user_changes(db, run, count_queries):
+    user = run(make_user(db, "student@example.com"))
+    token = create_access_token(str(user.id), user.role)
+    # Each request gets a fresh session, so nothing is served from the identity map
+    db.expunge_all()
+
+    with count_queries:
+        first = run(get_current_user(token, db))
+        second = run(get_current_user(token, db))
+    assert count_queries.count == 1
+    assert first.id == second.id == str(user.id) and first.role == "student"
+
+    # Changing the role through the ORM evicts the cached user
+    user = run(db.get(User, user.id))
+    user.role = "librarian"
+    run(db.commit())
+    db.expunge_all()
+    with count_queries:
+        assert run(get_current_user(token, db)).role == "librarian"
+    assert count_queries.count == 1
+
+def test_principal_trusts_the_token_role_only_when_enabled(db, run, count_queries, monkeypatch):
+    user = run(make_user(db, "librarian@example.com", role="librarian"))
+    token = create_access_token(str(user.id), "student")
+    db.expunge_all()
+
+    with count_queries:
+        principal = run(get_current_principal(token, db))
+    assert principal.role == "librarian" and count_queries.count == 1
+
+    user_cache.clear()
+    monkeypatch.setattr(settings, "AUTH_TRUST_TOKEN_ROLE", True)
+    with count_queries:
+        principal = run(get_current_principal(token, db))
+    assert principal.id == str(user.id) and principal.role == "student"
+    assert count_queries.count == 0
+
+def test_password_hashing_runs_on_the_worker_pool():
+    hasher = PasswordHasher(rounds=4, workers=2)
+    hashed = hasher.hash_sync("correct horse")
+
+    async def storm():
+        return await asyncio.gather(*[hasher.verify(password, hashed) for password in ["correct horse", "wrong"] * 3])
+
+    try:
+        assert asyncio.run(storm()) == [True, False] * 3
+        stats = hasher.stats()
+        assert stats["completed"] == 6 and stats["queued"] == 0 and stats["running"] == 0
+        assert stats["peak_queued"] >= 1
+        assert "bookbuddy_password_hash_queued 0\n" in hasher.render()
+        assert "bookbuddy_password_hash_completed_total 6\n" in hasher.render()
+    finally:
+        hasher.shutdown()
+
+    # A hash cancelled while waiting for a worker leaves the queue
+    blocked, release = PasswordHasher(rounds=4, workers=1), threading.Event()
+
+    async def cancel_waiting():
+        busy = asyncio.ensure_future(blocked._run(release.wait))
+        waiting = asyncio.ensure_future(blocked.hash("secret"))
+        await asyncio.sleep(0.05)
+        assert blocked.stats()["queued"] == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        release.set()
+        await busy
+
+    try:
+        asyncio.run(cancel_waiting())
+        assert blocked.stats()["queued"] == 0 and blocked.stats()["completed"] == 1
+    finally:
+        blocked.shutdown()
+
+    # bcrypt ignores bytes past 72; longer passwords are truncated rather than rejected
+    assert hasher.verify_sync("x" * 72 + "ignored", hasher.hash_sync("x" * 80))
+    assert not hasher.needs_rehash(hashed) and PasswordHasher(5, 1).needs_rehash(hashed)
+    assert not hasher.verify_sync("anything", "not-a-bcrypt-hash")
+
+def test_login_verifies_off_the_loop_and_upgrades_the_cost_factor(db, run, monkeypatch):
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+    user = run(make_user(db, "student@example.com"))
+    user.hashed_password = get_password_hash("secret-password")
+    run(db.commit())
+
+    with pytest.raises(HTTPException) as error:
+        run(login_access_token(SimpleNamespace(username="student@example.com", password="wrong"), db))
+    assert error.value.status_code == 401
+
+    form = SimpleNamespace(username="student@example.com", password="secret-password")
+    token = run(login_access_token(form, db))["access_token"]
+    assert decode_access_token(token).sub == str(user.id)
+    assert user.hashed_password.startswith("$2b$04$")
+
+    # Raising BCRYPT_ROUNDS rehashes the stored password on the next login
+    monkeypatch.setattr(password_hasher, "rounds", 5)
+    run(login_access_token(form, db))
+    assert user.hashed_password.startswith("$2b$05$")
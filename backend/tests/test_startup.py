@@ -0,0 +1,19 @@
+"""
+Tests for the API's startup path
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+SCRIPT = Path(__file__).resolve().parent.parent / "scripts" / "check_import_time.py"
+
+def test_app_imports_without_heavy_optional_modules():
+    # Import time depends on the machine, so only the import graph is asserted here
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), "--runs", "1", "--budget-ms", "60000"],
+        capture_output=True, text=True
+    )
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "app.main imports in" in result.stdout